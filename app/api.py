@@ -0,0 +1,380 @@
+"""
+Local JSON API for the backend queries, for tools that cannot go through the
+Streamlit UI.
+
+    GET  /health
+    GET  /version
+    GET  /services/<service_no>/hour-counts?percentile=25&start_hour=6&end_hour=22&direction=1
+    GET  /services/<service_no>/stops?direction=1
+    GET  /services/<service_no>/corridors?min_stops=5
+    GET  /stops/<bus_stop_code>/services?direction=1
+    GET  /stations/<station_name>/stops?radius=400&walking=1
+    GET  /locations/nearest?lat=1.3521&lng=103.8198
+    POST /batch  {"requests": [{"path": "/services/167/hour-counts", "params": {...}}]}
+
+Responses carry an ETag derived from the data version and the request, so
+clients can revalidate with If-None-Match, and are kept in an LRU cache.
+At most `--workers` requests are computed at once.
+
+Usage (from the repo root):
+    python app/api.py --port 8600 --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import traceback
+import urllib.parse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import bus_corridors
+import core
+import percentile_ranks
+import result_cache
+
+DATA_FOLDER = "app/appdata"
+RESPONSE_CACHE_SIZE = 1024  # responses
+MAX_BATCH_SIZE = 100  # requests per batch
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _records(df: pd.DataFrame) -> list[dict]:
+    # geometry is returned as latitude/longitude columns
+    if "geometry" in df:
+        df = df.to_crs(4326)
+        df = pd.DataFrame(df.drop(columns="geometry")).assign(
+            latitude=df.geometry.y, longitude=df.geometry.x
+        )
+    return json.loads(df.to_json(orient="records"))
+
+
+def _param(params: dict, name: str, cast, default=None):
+    if name not in params:
+        if default is None:
+            raise ApiError(400, f"Missing parameter: {name}")
+        return default
+    try:
+        return cast(params[name])
+    except (TypeError, ValueError):
+        raise ApiError(400, f"Invalid value for {name}: {params[name]}")
+
+
+def _flag(value) -> bool:
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def _batch_item_error(request) -> str:
+    # what is wrong with a request of a batch, if anything
+    if not isinstance(request, dict):
+        return "Each request must be an object"
+    if not isinstance(request.get("path"), str):
+        return "Each request needs a path string"
+    if not isinstance(request.get("params", {}), dict):
+        return "params must be an object"
+    return None
+
+
+class BackendApi:
+    """
+    Routes requests to the backend functions and caches the responses.
+    """
+
+    def __init__(
+        self, data_folder: str = DATA_FOLDER, cache_size: int = RESPONSE_CACHE_SIZE
+    ):
+        self.data_folder = data_folder
+        self.data_collection = core.get_data_collection(data_folder)
+        # data version: content hash of every data file
+        self.data_version = result_cache.content_hash(
+            sorted(
+                (name, result_cache.tagged_content_hash(data))
+                for name, data in self.data_collection.items()
+            )
+        )[:16]
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.routes = [
+            (re.compile(r"^/health$"), self.health),
+            (re.compile(r"^/version$"), self.version),
+            (re.compile(r"^/services/([^/]+)/hour-counts$"), self.hour_counts),
+            (re.compile(r"^/services/([^/]+)/stops$"), self.service_stops),
+            (re.compile(r"^/services/([^/]+)/corridors$"), self.service_corridors),
+            (re.compile(r"^/stops/([^/]+)/services$"), self.stop_services),
+            (re.compile(r"^/stations/([^/]+)/stops$"), self.station_stops),
+            (re.compile(r"^/locations/nearest$"), self.nearest_location),
+        ]
+
+    ## Endpoints
+
+    def health(self, params: dict) -> dict:
+        return {"status": "ok"}
+
+    def version(self, params: dict) -> dict:
+        return {
+            "data_version": self.data_version,
+            "cached_responses": len(self.cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+        }
+
+    def hour_counts(self, params: dict, service_no: str) -> dict:
+        percentile = _param(params, "percentile", float, 25)
+        hour_window = (
+            _param(params, "start_hour", int, percentile_ranks.HOUR_WINDOW[0]),
+            _param(params, "end_hour", int, percentile_ranks.HOUR_WINDOW[1]),
+        )
+        direction = _param(params, "direction", int, 1)
+        if service_no not in core.get_stop_service_index(self.data_collection)[
+            "service_names"
+        ]:
+            raise ApiError(404, f"Bus service '{service_no}' not found.")
+        hour_counts, total_num_stops = core.get_hour_count_below_percentile_each_stop(
+            self.data_collection,
+            service_no,
+            percentile,
+            hour_window,
+            None if direction == -1 else direction,
+        )
+        return {
+            "service_no": service_no,
+            "direction": direction,
+            "percentile": percentile,
+            "hour_window": hour_window,
+            "total_num_stops": total_num_stops,
+            "hour_counts": _records(hour_counts),
+        }
+
+    def service_stops(self, params: dict, service_no: str) -> dict:
+        direction = _param(params, "direction", int, -1)
+        bus_stops = core.get_bus_stops_for_service(
+            self.data_collection, service_no, None if direction == -1 else direction
+        )
+        if bus_stops.empty:
+            raise ApiError(404, f"Bus service '{service_no}' not found.")
+        return {"service_no": service_no, "stops": _records(bus_stops)}
+
+    def service_corridors(self, params: dict, service_no: str) -> dict:
+        min_stops = _param(params, "min_stops", int, bus_corridors.MIN_SHARED_STOPS)
+        if min_stops < 2:
+            raise ApiError(400, "min_stops must be at least 2")
+        if service_no not in core.get_stop_service_index(self.data_collection)[
+            "service_names"
+        ]:
+            raise ApiError(404, f"Bus service '{service_no}' not found.")
+        corridors, summary = core.get_bus_corridors(self.data_collection, min_stops)
+        return {
+            "service_no": service_no,
+            "min_stops": min_stops,
+            "runs": _records(
+                corridors[
+                    (corridors["Service_A"] == service_no)
+                    | (corridors["Service_B"] == service_no)
+                ]
+            ),
+            "summary": _records(
+                summary[
+                    (summary["Service_A"] == service_no)
+                    | (summary["Service_B"] == service_no)
+                ]
+            ),
+        }
+
+    def stop_services(self, params: dict, stop_code: str) -> dict:
+        direction = _param(params, "direction", int, -1)
+        services = core.get_services_at_stop(
+            self.data_collection, stop_code, None if direction == -1 else direction
+        )
+        return {"bus_stop_code": stop_code, "services": services.tolist()}
+
+    def station_stops(self, params: dict, station_name: str) -> dict:
+        radius = _param(params, "radius", float, 400)
+        if _flag(params.get("walking", "0")):
+            error, bus_stops = core.find_bus_stops_within_walking_distance(
+                station_name, radius, self.data_collection, self.data_folder
+            )
+        else:
+            rail_stations, bus_stops = core.get_projected_stations_and_stops(
+                self.data_collection
+            )
+            error, bus_stops = core.find_bus_stops_within_radius(
+                station_name, radius, rail_stations, bus_stops
+            )
+        if error:
+            raise ApiError(404, error)
+        return {
+            "station_name": station_name,
+            "radius": radius,
+            "stops": _records(bus_stops.sort_values("Distance (m)")),
+        }
+
+    def nearest_location(self, params: dict) -> dict:
+        latitude = _param(params, "lat", float)
+        longitude = _param(params, "lng", float)
+        place = core.query_map_location(self.data_collection, latitude, longitude)
+        if place is None:
+            raise ApiError(404, "No bus stop or rail station near this location.")
+        place["nearby_stops"] = _records(place["nearby_stops"])
+        return {"latitude": latitude, "longitude": longitude, **place}
+
+    ## Dispatch
+
+    def etag(self, path: str, params: dict) -> str:
+        key = json.dumps([self.data_version, path, sorted(params.items())])
+        return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+    def is_cached(self, etag: str) -> bool:
+        with self.cache_lock:
+            return etag in self.cache
+
+    def handle(self, path: str, params: dict) -> tuple[int, bytes, str]:
+        """
+        Response (status, JSON body, ETag) to a GET request, from the cache if possible.
+        """
+        etag = self.etag(path, params)
+        with self.cache_lock:
+            if etag in self.cache:
+                self.cache.move_to_end(etag)
+                self.hits += 1
+                return 200, self.cache[etag], etag
+            self.misses += 1
+
+        status, body = self.call(path, params)
+        body = json.dumps(body).encode()
+        # only successful responses are cached; /version changes with the cache
+        if status == 200 and path != "/version":
+            with self.cache_lock:
+                self.cache[etag] = body
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return status, body, etag
+
+    def call(self, path: str, params: dict) -> tuple[int, dict]:
+        for pattern, endpoint in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            args = [urllib.parse.unquote(arg) for arg in match.groups()]
+            try:
+                return 200, endpoint(params, *args)
+            except ApiError as e:
+                return e.status, {"error": str(e)}
+            except Exception as e:
+                print(f"Error in {path}:")
+                traceback.print_exc()
+                return 500, {"error": f"Internal error: {e}"}
+        return 404, {"error": f"Unknown path: {path}"}
+
+    def batch(self, requests: list) -> dict:
+        """
+        Responses to several GET requests, in order.
+        """
+        if not isinstance(requests, list) or len(requests) > MAX_BATCH_SIZE:
+            raise ApiError(400, f"Expected a list of up to {MAX_BATCH_SIZE} requests")
+        responses = []
+        for request in requests:
+            error = _batch_item_error(request)
+            if error:
+                responses.append({"status": 400, "body": {"error": error}})
+                continue
+            params = {k: str(v) for k, v in request.get("params", {}).items()}
+            status, body, etag = self.handle(request["path"], params)
+            responses.append({"status": status, "etag": etag, "body": json.loads(body)})
+        return {"responses": responses}
+
+
+def make_handler(api: BackendApi, workers: int):
+    # requests beyond the number of workers wait for a free one
+    worker_slots = threading.BoundedSemaphore(workers)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: bytes = b"", etag: str = None):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if etag:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            # revalidation does not need a worker
+            etag = api.etag(url.path, params)
+            if self.headers.get("If-None-Match") == etag and api.is_cached(etag):
+                self._send(304, etag=etag)
+                return
+            with worker_slots:
+                status, body, etag = api.handle(url.path, params)
+            self._send(status, body, etag if status == 200 else None)
+
+        def do_POST(self):
+            if urllib.parse.urlsplit(self.path).path != "/batch":
+                self._send(404, json.dumps({"error": "Unknown path"}).encode())
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                requests = json.loads(self.rfile.read(length) or b"{}").get("requests")
+            except (ValueError, AttributeError):
+                self._send(400, json.dumps({"error": "Invalid JSON body"}).encode())
+                return
+            try:
+                with worker_slots:
+                    body = api.batch(requests)
+            except ApiError as e:
+                self._send(e.status, json.dumps({"error": str(e)}).encode())
+                return
+            except Exception as e:
+                print("Error in /batch:")
+                traceback.print_exc()
+                self._send(500, json.dumps({"error": f"Internal error: {e}"}).encode())
+                return
+            self._send(200, json.dumps(body).encode())
+
+        def log_message(self, format, *args):
+            print(f"{time.strftime('%H:%M:%S')} {self.address_string()} {format % args}")
+
+    return Handler
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8600,
+    workers: int = 4,
+    data_folder: str = DATA_FOLDER,
+):
+    api = BackendApi(data_folder)
+    server = ThreadingHTTPServer((host, port), make_handler(api, workers))
+    print(f"Serving data version {api.data_version} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local JSON API for backend queries")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=4, help="requests computed at once")
+    parser.add_argument("--data", default=DATA_FOLDER, help="data folder")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.data)
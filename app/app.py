@@ -1,18 +1,36 @@
-import pandas as pd
-import folium
+import sys
+import time
+
+STARTUP_START = time.perf_counter()
+
 import streamlit as st
-import frontend
-from streamlit_folium import st_folium
-import backend
+
+# render the page before the heavy imports and the data load
+st.set_page_config(layout="wide")
+
+# imports and data are cached by the server process; only the first run pays
+COLD_START = "backend" not in sys.modules
+loading_placeholder = st.empty()
+if COLD_START:
+    loading_placeholder.info("Loading data...")
+
 import json
 import os
-import altair as alt
+import numpy as np
+import pandas as pd
+import frontend
+import backend
+import map_query
+import memcache
+import percentile_ranks
+import ridership_cube
+import whatif
 
-st.set_page_config(layout="wide")
+IMPORT_END = time.perf_counter()
 
-DATA_COLLECTION = backend.get_data_collection("app/appdata")
 CENTER_START = [1.3521, 103.8198]
 ZOOM_START = 12
+BUS_DIRECTIONS = {"Direction 1": 1, "Direction 2": 2, "Both directions": None}
 
 
 ## General functions
@@ -23,11 +41,14 @@ def init_session():
         print("Reusing session state")
         return
     print("Initialising session state")
-    st.session_state.global_data = DATA_COLLECTION
     st.session_state.filters = {}
-    st.session_state.filtered_data = {}
+    # row positions into DATA_COLLECTION; the rows themselves are shared by all sessions
+    st.session_state.filtered_rows = {}
     st.session_state.is_initialised = True
     st.session_state.mrtlines = None
+    # latest map clicks seen, to tell which one is new
+    st.session_state.plot1_clicks = {}
+    st.session_state.plot1_clicked_point = None
 
 
 def create_filter_selectbox(dataset, filter_name, label=None):
@@ -97,162 +118,190 @@ def update_filters(dataset, filter_name, filter_type):
 
     print(f"Filters: {json.dumps(st.session_state.filters, indent=2)}")
 
-    # only update filtered data if the filter value has changed
-    if (st.session_state.filtered_data.get(dataset) is None) or (
+    # only update filtered rows if the filter value has changed
+    if (dataset not in st.session_state.filtered_rows) or (
         filter_value != previous_value
     ):
-        print("Filter value changed, updating filtered data")
-        filter_kv = st.session_state.filters[dataset]
-
-        # this might need fixing if filtering over multiple columns is needed
-        for filter_col, filter_value in filter_kv.items():
+        print("Filter value changed, updating filtered rows")
+        positions = None
+        for filter_col, filter_value in st.session_state.filters[dataset].items():
             # value may be a string or list
-            st.session_state.filtered_data[dataset] = backend.filter_single_dataset(
-                DATA_COLLECTION[dataset], filter_col, filter_value
+            filter_positions = backend.filter_positions(
+                DATA_COLLECTION, dataset, filter_col, filter_value
             )
+            positions = (
+                filter_positions
+                if positions is None
+                else np.intersect1d(positions, filter_positions)
+            )
+        st.session_state.filtered_rows[dataset] = positions
 
-    print("Filtered data:" f"{st.session_state.filtered_data[dataset].shape[0]} rows")
+    print(f"Filtered data: {len(get_filtered_data(dataset))} rows")
     return
 
 
-## Plot 1: MRT-Bus Visualisation
+def get_filtered_data(dataset):
+    """
+    Gather the filtered rows of a dataset, for rendering.
+    """
+    positions = st.session_state.filtered_rows.get(dataset)
+    if positions is None:
+        return DATA_COLLECTION[dataset]
+    return DATA_COLLECTION[dataset].iloc[positions]
 
 
-def init_plot1_vars():
-    if st.session_state.get("plot1_initialized"):
-        print("Reusing plot1 state")
-        return
-    st.session_state.plot1_initialized = True
-    st.session_state.plot1_bus_markers = {}
-    st.session_state.plot1_rail_markers = {}
+## Plot 1: MRT-Bus Visualisation
 
 
-def plot1_get_bus_markers(service_no: str) -> list[folium.Marker]:
+@st.cache_resource
+def plot1_get_bus_marker_specs(service_no: str, direction=1) -> list[dict]:
+    """
+    Locations, popups and colours of the bus stop markers of a service in one
+    direction (both if None), shared by all sessions.
+    A stop served in both directions gets a single marker.
+    """
+    print(f"Creating markers for bus service {service_no} (direction {direction})")
+    return frontend.get_bus_marker_specs(
+        service_no,
+        {
+            route_direction: backend.get_bus_stops_for_service(
+                DATA_COLLECTION, service_no, direction=route_direction
+            )
+            for route_direction in ([1, 2] if direction is None else [direction])
+        },
+    )
+
 
-    if service_no in st.session_state.plot1_bus_markers:
-        return st.session_state.plot1_bus_markers[service_no]
+def plot1_get_bus_markers(service_no: str, direction=1) -> list["folium.Marker"]:
 
-    if service_no:
-        bus_route_data = st.session_state.filtered_data["BusRoutes"]
-    else:
+    if not service_no:
         return []
-    print(f"Creating markers for bus service {service_no}")
-    bus_route_data = backend.left_join_datasets(
-        bus_route_data, DATA_COLLECTION["BusStops"], "BusStopCode", "BUS_STOP_N"
-    )
-    bus_route_data = bus_route_data[bus_route_data["Direction"] == 1]
 
-    markers = []
+    # folium elements hold a reference to their parent, so they are not shared
+    return frontend.create_bus_markers(plot1_get_bus_marker_specs(service_no, direction))
 
-    for _, row in bus_route_data.iterrows():
-        service_no = row["ServiceNo"]
-        # direction = row["Direction"]
-        bus_stop_code = row["BusStopCode"]
 
-        popup = frontend.create_popup_text(
-            ServiceNo=service_no,
-            # Direction=direction,
-            BusStopCode=bus_stop_code,
-        )
+def plot1_get_rail_polylines() -> list["folium.PolyLine"]:
 
-        loc = frontend.get_location_from_row(row)
-        markers.append(
-            folium.CircleMarker(
-                location=loc,
-                radius=6,
-                fill_color="gray",
-                fill_opacity=0.8,
-                color="black",
-                weight=1,
-                popup=popup,
-            )
+    print(f"Creating rail lines")
+
+    layer = frontend.create_rail_line_layer(DATA_COLLECTION["RailLineStrings"])
+
+    # st.session_state.mrtlines = layer
+    return layer
+
+
+@st.cache_resource
+def plot1_get_rail_marker_specs(rail_name: str) -> list[dict]:
+    """
+    Locations and colours of the station markers of a rail line, shared by all sessions.
+    """
+    print(f"Creating markers for rail line {rail_name}")
+    rail_station_data = DATA_COLLECTION["RailStationsMerged"].iloc[
+        backend.filter_positions(
+            DATA_COLLECTION, "RailStationsMerged", "StationLine", rail_name
         )
+    ]
 
-    st.session_state.plot1_bus_markers[service_no] = markers
-    return markers
+    marker_specs = []
 
+    for _, row in rail_station_data.iterrows():
 
-def plot1_get_rail_polylines() -> list[folium.PolyLine]:
+        line_color = frontend.get_rail_line_color(row["StationCode"])
 
-    print(f"Creating rail lines")
+        popup = frontend.create_popup_text(
+            StationCode=row["StationCode"],
+            StationName=row["StationName"],
+            StationLine=row["StationLine"],
+        )
+        loc = frontend.get_location_from_row(row)
+        if loc is None:
+            continue
 
-    layer = folium.GeoJson(
-        DATA_COLLECTION["RailLineStrings"],
-        name="geojson",
-        style_function=lambda x: {
-            "color": frontend.get_rail_line_color_by_line_name(
-                x["properties"]["StationLine"]
-            ),
-            "weight": 4,
-            "opacity": 0.8,
-            "smoothFactor": 5,
-        },
-    )
+        marker_specs.append({"location": loc, "fill_color": line_color})
 
-    # st.session_state.mrtlines = layer
-    return layer
+    return marker_specs
 
 
-def plot1_get_rail_layer(all_rail_names: list[str]) -> list[folium.Marker]:
+def plot1_get_rail_layer(all_rail_names: list[str]) -> list["folium.Marker"]:
+    import folium
 
     if not all_rail_names:
         return []
 
-    all_markers = []
     print(f"Creating markers for rail lines {all_rail_names}")
-    print(f"Session state: {st.session_state.plot1_rail_markers.keys()}")
+    all_markers = []
     for rail_name in all_rail_names:
-        if rail_name in st.session_state.plot1_rail_markers:
-            print(f"Reusing markers for rail line {rail_name}")
-            all_markers += st.session_state.plot1_rail_markers[rail_name]
-            continue
-
-        if rail_name:
-            rail_station_data = st.session_state.filtered_data["RailStationsMerged"]
-        else:
-            return []
+        all_markers += [
+            folium.CircleMarker(
+                location=spec["location"],
+                radius=8,
+                fill_color=spec["fill_color"],
+                fill_opacity=0.8,
+                color="black",
+                weight=2,
+                # popup=popup,
+            )
+            for spec in plot1_get_rail_marker_specs(rail_name)
+        ]
+    return all_markers
 
-        print(f"Creating markers for rail line {rail_name}")
-        markers = []
 
-        for _, row in rail_station_data.iterrows():
+def plot1_get_clicked_point(plot1_data) -> tuple[float, float]:
+    """
+    (latitude, longitude) of the latest click on the map or on one of its
+    markers, or None if nothing was clicked yet.
+    """
+    for key in ["last_object_clicked", "last_clicked"]:
+        click = (plot1_data or {}).get(key)
+        if click and click != st.session_state.plot1_clicks.get(key):
+            st.session_state.plot1_clicks[key] = click
+            st.session_state.plot1_clicked_point = (click["lat"], click["lng"])
+    return st.session_state.plot1_clicked_point
+
+
+@st.cache_data
+def plot1_get_low_ridership_heat_data(percentile, hour_window) -> list[list[float]]:
+    """
+    [latitude, longitude, weight] of every bus stop with low-ridership hours,
+    weighted by its share of the network maximum.
+    """
+    print(f"Creating network low ridership heatmap data")
+    stop_metrics = backend.get_low_ridership_hours_each_stop(
+        DATA_COLLECTION, percentile, hour_window
+    )
+    stop_metrics = stop_metrics[stop_metrics["Low_Ridership_Hours"] > 0]
+    if stop_metrics.empty:
+        return []
+    weights = (
+        stop_metrics["Low_Ridership_Hours"] / stop_metrics["Low_Ridership_Hours"].max()
+    )
+    return np.column_stack(
+        [stop_metrics["latitude"], stop_metrics["longitude"], weights]
+    ).tolist()
 
-            line_color = frontend.get_rail_line_color(row["StationCode"])
 
-            popup = frontend.create_popup_text(
-                StationCode=row["StationCode"],
-                StationName=row["StationName"],
-                StationLine=row["StationLine"],
-            )
-            loc = frontend.get_location_from_row(row)
-            if loc is None:
-                continue
-
-            markers.append(
-                folium.CircleMarker(
-                    location=loc,
-                    radius=8,
-                    fill_color=line_color,
-                    fill_opacity=0.8,
-                    color="black",
-                    weight=2,
-                    # popup=popup,
-                )
-            )
+def plot1_get_low_ridership_heatmap(percentile, hour_window) -> "folium.FeatureGroup":
+    import folium
+    from folium.plugins import HeatMap
 
-        all_markers += markers
-        st.session_state.plot1_rail_markers[rail_name] = markers
-    return all_markers
+    layer = folium.FeatureGroup(name="Low Ridership Hours")
+    heat_data = plot1_get_low_ridership_heat_data(percentile, hour_window)
+    if heat_data:
+        HeatMap(heat_data, radius=12, blur=15, min_opacity=0.2).add_to(layer)
+    return layer
 
 
 ## Plot 2: Bus Stop Low Ridership Count
 
 
-def plot2_get_bus_stop_hourly_count(service_no: str):
+def plot2_get_bus_stop_hourly_count(
+    service_no: str, percentile, hour_window, direction=1
+):
     print(f"Getting bus stop hourly count for service {service_no}")
     if service_no:
-        df, total_num_stops = backend.get_hour_count_below_25th_percentile_each_stop(
-            DATA_COLLECTION, service_no
+        df, total_num_stops = backend.get_hour_count_below_percentile_each_stop(
+            DATA_COLLECTION, service_no, percentile, hour_window, direction
         )
         df = df[df["DAY_TYPE"] == "WEEKDAY"]
     else:
@@ -266,52 +315,69 @@ def plot2_get_bus_stop_hourly_count(service_no: str):
     return df, total_num_stops
 
 
-def plot2_get_percent_exceeding(hour_counts, total_num_stops, threshold):
+## Ridership by hour of day
+
+
+@st.cache_data
+def hourly_get_heat_frames(day_type: str, measure: str) -> list[list[list[float]]]:
+    """
+    [latitude, longitude, weight] of the bus stops for each hour of the day,
+    weighted by their share of the day's maximum so that hours are comparable.
+    """
+    print(f"Creating hourly heatmap frames for {measure} ({day_type})")
+    cube = backend.get_ridership_cube(DATA_COLLECTION)
+    positions, locations = backend.get_ridership_cube_locations(DATA_COLLECTION)
+    # (num_stops, 24) slice of the memory-mapped cube
+    values = ridership_cube.hour_slice(cube, day_type, measure)[positions]
+    max_value = values.max() if values.size else 0
+    if max_value <= 0:
+        values, max_value = np.zeros_like(values), 1
+
+    # every frame has every stop (HeatMapWithTime cannot compute the map bounds
+    # with empty frames); stops with a weight of 0 are not drawn
+    weights = np.round(values / max_value, 3)
+    return [
+        np.column_stack([locations, weights[:, hour]]).tolist()
+        for hour in range(ridership_cube.HOURS)
+    ]
 
-    if total_num_stops == 0:
-        return ""
 
-    weekday_data = hour_counts[hour_counts["DAY_TYPE"] == "WEEKDAY"]
-    num_hours_low_ridership_weekday = weekday_data.shape[0]
-    exceeding_sequences_weekday = weekday_data[
-        weekday_data["Total_Hour_Count"] > threshold
-    ].shape[0]
-    percentage_exceed_weekday = (
-        (exceeding_sequences_weekday / total_num_stops) * 100
-        if num_hours_low_ridership_weekday
-        else 0
-    )
-    # weekday_out = f"Percentage of stop sequences exceeding {threshold} (weekday): {percentage_exceed_weekday:.2f}%"
-
-    weekend_data = hour_counts[hour_counts["DAY_TYPE"] == "WEEKENDS/HOLIDAY"]
-    num_hours_low_ridership_weekend = weekend_data.shape[0]
-    exceeding_sequences_weekend = weekend_data[
-        weekend_data["Total_Hour_Count"] > threshold
-    ].shape[0]
-    percentage_exceed_weekend = (
-        (exceeding_sequences_weekend / total_num_stops) * 100
-        if num_hours_low_ridership_weekend
-        else 0
-    )
-    # weekend_out = f"Percentage of stop sequences exceeding {threshold} (weekend): {percentage_exceed_weekend:.2f}%"
+## What-if: bus service removal
 
-    output = (
-        f"% of bus stops with over {threshold} hours of low ridership, out of {total_num_stops} stops:  \n"
-        f"{percentage_exceed_weekday:.2f}%  \n"
-        # f"{percentage_exceed_weekend:.2f}% (weekend)  \n"
-    )
 
-    return output
+def whatif_get_removal_impact(removed_services: list[str]):
+    print(f"Evaluating removal of bus services {removed_services}")
+    return backend.get_service_removal_impact(DATA_COLLECTION, removed_services)
 
 
 # for whole app
 init_session()
 
-# first plot
-init_plot1_vars()
-
-with st.container():
+# lay out the page first, so that it shows while the data loads
+main_container = st.container()
+with main_container:
     col1, col2 = st.columns(2)
+col2.markdown("### Map Overview")
+whatif_container = st.container()
+whatif_container.markdown("### What if bus services were removed?")
+hourly_container = st.container()
+hourly_container.markdown("### Ridership by hour of day")
+
+# one read-only collection shared by all sessions (a cache resource): the row
+# positions and marker specs cached below index into this single object
+DATA_COLLECTION = backend.get_data_collection("app/appdata")
+# build the stop-service index once, with the data
+backend.get_stop_service_index(DATA_COLLECTION)
+
+LOAD_END = time.perf_counter()
+loading_placeholder.empty()
+if COLD_START:
+    print(
+        f"Startup profile: imports {IMPORT_END - STARTUP_START:.2f}s, "
+        f"data load {LOAD_END - IMPORT_END:.2f}s"
+    )
+
+with main_container:
     with col1:
         rail_line_filter = create_filter_multiselect_list(
             "RailStationsMerged", "StationLine", label="Station Line"
@@ -319,48 +385,66 @@ with st.container():
         bus_route_filter = create_filter_selectbox(
             "BusRoutes", "ServiceNo", label="Bus Route"
         )
+        # without bus_route_trips.csv the trips (and so the low-ridership
+        # hours) are only known in direction 1
+        both_directions = "bus_route_trips" in DATA_COLLECTION
+        bus_direction = BUS_DIRECTIONS[
+            st.radio(
+                "Direction",
+                list(BUS_DIRECTIONS) if both_directions else ["Direction 1"],
+                index=0,
+                horizontal=True,
+                key=f"{os.path.basename(__file__)}_bus_direction_radio",
+            )
+        ]
+        if not both_directions:
+            st.markdown(
+                "<small>Only direction 1 is available: add bus_route_trips.csv "
+                "to the data folder for both directions.</small>",
+                unsafe_allow_html=True,
+            )
 
         st.markdown("### Number of low-ridership hours for each bus stop")
 
-        plot2_df, total_num_stops = plot2_get_bus_stop_hourly_count(
-            st.session_state.filters["BusRoutes"].get("ServiceNo")
+        param_col1, param_col2 = st.columns(2)
+        low_ridership_percentile = param_col1.slider(
+            "Low ridership: below network percentile",
+            min_value=5,
+            max_value=50,
+            value=25,
+            step=5,
+            key=f"{os.path.basename(__file__)}_plot2_percentile_slider",
         )
-
-        # Create Altair scatter plot
-        scatter_plot = (
-            alt.Chart(plot2_df)
-            .mark_circle(size=60)
-            .encode(
-                x=alt.X(
-                    "Destination_StopSequence", title="Bus Stop Sequence along Route"
-                ),
-                y=alt.Y("Total_Hour_Count", title="Number of Low Ridership Hours"),
-                # color="DAY_TYPE",
-                # tooltip=["Destination_StopSequence", "Total_Hour_Count", "DAY_TYPE"],
-                tooltip=["Destination_StopSequence", "Total_Hour_Count"],
-            )
-            .properties(width=800, height=600)
+        low_ridership_hours = param_col2.slider(
+            "Hours of day",
+            min_value=0,
+            max_value=23,
+            value=percentile_ranks.HOUR_WINDOW,
+            key=f"{os.path.basename(__file__)}_plot2_hour_window_slider",
         )
 
-        threshold = 6
-
-        # add threshold line if there are stops
-        if total_num_stops:
-            hline = (
-                alt.Chart(pd.DataFrame({"y": [threshold]}))
-                .mark_rule(color="red")
-                .encode(y="y")
-            )
-            scatter_plot = scatter_plot + hline
+        plot2_df, total_num_stops = plot2_get_bus_stop_hourly_count(
+            st.session_state.filters["BusRoutes"].get("ServiceNo"),
+            low_ridership_percentile,
+            low_ridership_hours,
+            bus_direction,
+        )
 
-        st.altair_chart(scatter_plot)
+        threshold = frontend.HOUR_COUNT_THRESHOLD
+        st.altair_chart(
+            frontend.create_hour_count_chart(plot2_df, total_num_stops, threshold)
+        )
 
-        text_display = plot2_get_percent_exceeding(plot2_df, total_num_stops, threshold)
+        text_display = frontend.get_percent_exceeding_text(
+            plot2_df, total_num_stops, threshold
+        )
 
         st.markdown(text_display)
 
     with col2:
-        st.markdown("### Map Overview")
+        import folium
+        from streamlit_folium import st_folium
+
         plot1 = folium.Map(location=CENTER_START, zoom_start=ZOOM_START)
 
         plot1_rail_polylines = folium.FeatureGroup(name="MRT Lines")
@@ -368,7 +452,7 @@ with st.container():
 
         plot1_bus_layer = folium.FeatureGroup(name="Bus Routes")
         for marker in plot1_get_bus_markers(
-            st.session_state.filters["BusRoutes"].get("ServiceNo")
+            st.session_state.filters["BusRoutes"].get("ServiceNo"), bus_direction
         ):
             marker.add_to(plot1_bus_layer)
 
@@ -377,6 +461,20 @@ with st.container():
             st.session_state.filters["RailStationsMerged"].get("StationLine")
         ):
             marker.add_to(plot1_rail_layer)
+        show_low_ridership = st.checkbox(
+            "Show low-ridership hours of all bus stops (weekday, all services)",
+            value=False,
+            key=f"{os.path.basename(__file__)}_plot1_low_ridership_checkbox",
+        )
+        plot1_layers = [plot1_rail_polylines, plot1_rail_layer, plot1_bus_layer]
+        if show_low_ridership:
+            plot1_layers.insert(
+                0,
+                plot1_get_low_ridership_heatmap(
+                    low_ridership_percentile, low_ridership_hours
+                ),
+            )
+
         st.markdown(
             "<small>LRT and Cross Island Line are excluded. </small>",
             unsafe_allow_html=True,
@@ -385,9 +483,98 @@ with st.container():
             plot1,
             use_container_width=True,
             height=800,
-            feature_group_to_add=[
-                plot1_rail_polylines,
-                plot1_rail_layer,
-                plot1_bus_layer,
-            ],
+            feature_group_to_add=plot1_layers,
+        )
+
+        clicked_point = plot1_get_clicked_point(plot1_data)
+        if clicked_point is None:
+            st.markdown(
+                "<small>Click the map to look up the nearest bus stop or rail station.</small>",
+                unsafe_allow_html=True,
+            )
+        else:
+            place = backend.query_map_location(DATA_COLLECTION, *clicked_point)
+            if place is None:
+                st.markdown(
+                    f"No bus stop or rail station within {map_query.MAX_CLICK_METERS} m "
+                    "of the selected point."
+                )
+            else:
+                st.markdown(f"#### {place['kind']}: {place['name']} ({place['code']})")
+                services_label = "Bus services" if place["kind"] == "Bus Stop" else "Lines"
+                st.markdown(
+                    f"**{services_label}:** {', '.join(place['services']) or 'None'}  \n"
+                    f"{place['distance_m']:.0f} m from the selected point"
+                )
+                st.markdown(f"Other bus stops within {map_query.NEARBY_METERS} m:")
+                st.dataframe(
+                    place["nearby_stops"], use_container_width=True, hide_index=True
+                )
+
+with whatif_container:
+    removed_services = st.multiselect(
+        "Bus services to remove",
+        backend.get_unique_values(DATA_COLLECTION["BusRoutes"], "ServiceNo"),
+        default=[],
+        key=f"{os.path.basename(__file__)}_whatif_removed_services",
+    )
+    affected_stops, removal_summary = whatif_get_removal_impact(removed_services)
+
+    for col, (label, value) in zip(st.columns(4), removal_summary.items()):
+        col.metric(label, value)
+    st.markdown(
+        f"<small>Stops with no service within {whatif.RADIUS_METERS} m have no other "
+        "bus service or rail station within walking distance.</small>",
+        unsafe_allow_html=True,
+    )
+    st.dataframe(
+        affected_stops.sort_values(["Services_Remaining", "Nearest_Served_Stop_m"]),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+with hourly_container:
+    show_hourly = st.checkbox(
+        "Show ridership by hour of day",
+        value=False,
+        key=f"{os.path.basename(__file__)}_hourly_checkbox",
+    )
+    if show_hourly:
+        import folium
+        from folium.plugins import HeatMapWithTime
+        from streamlit_folium import st_folium
+
+        hourly_col1, hourly_col2 = st.columns(2)
+        hourly_day_type = hourly_col1.selectbox(
+            "Day type",
+            ridership_cube.DAY_TYPES,
+            key=f"{os.path.basename(__file__)}_hourly_day_type_selectbox",
+        )
+        hourly_measure = hourly_col2.selectbox(
+            "Measure",
+            ridership_cube.MEASURES,
+            format_func=lambda measure: measure.replace("_", " "),
+            key=f"{os.path.basename(__file__)}_hourly_measure_selectbox",
         )
+
+        hourly_map = folium.Map(location=CENTER_START, zoom_start=ZOOM_START)
+        HeatMapWithTime(
+            hourly_get_heat_frames(hourly_day_type, hourly_measure),
+            index=[f"{hour:02d}:00" for hour in range(ridership_cube.HOURS)],
+            radius=12,
+            min_opacity=0.2,
+            auto_play=False,
+        ).add_to(hourly_map)
+        st_folium(
+            hourly_map,
+            use_container_width=True,
+            height=600,
+            returned_objects=[],
+            key=f"{os.path.basename(__file__)}_hourly_map",
+        )
+
+if COLD_START:
+    print(f"Startup profile: first page {time.perf_counter() - STARTUP_START:.2f}s")
+
+# for the load test (see loadtest), if CACHE_STATS_FILE is set
+memcache.write_cache_stats()
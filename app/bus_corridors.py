@@ -0,0 +1,206 @@
+"""
+Bus services running along the same corridor as other bus services.
+
+Two routes (a service in one direction) share a corridor where they visit the
+same run of consecutive stops. Instead of aligning every pair of routes, every
+run of `min_stops` consecutive stops (a stop n-gram) of every route is hashed
+from the integer stop ids of the stop-service index. Routes can only share a
+run where they share an n-gram, so only n-grams with the same hash are
+compared. Matching n-grams at consecutive positions of both routes (on the
+same diagonal of their alignment) are then chained into maximal shared runs.
+"""
+
+import numpy as np
+import pandas as pd
+
+MIN_SHARED_STOPS = 5  # consecutive stops
+HASH_BASE = np.uint64(0x100000001B3)  # multiplier of the polynomial hash
+
+
+def _ngram_hashes(
+    route_stops: np.ndarray, route_offsets: np.ndarray, n: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # polynomial hash (mod 2**64) of every n-gram that fits within its route,
+    # with its start position and route
+    route_ids = np.repeat(np.arange(len(route_offsets) - 1), np.diff(route_offsets))
+    positions = np.arange(len(route_stops))
+    starts = positions[positions + n <= route_offsets[1:][route_ids]]
+
+    # stop id 0 must not hash like a missing stop
+    values = route_stops.astype(np.uint64) + np.uint64(1)
+    hashes = np.zeros(len(starts), dtype=np.uint64)
+    for j in range(n):
+        hashes = hashes * HASH_BASE + values[starts + j]
+    return starts, route_ids[starts], hashes
+
+
+def _group_pairs(group_starts: np.ndarray, group_sizes: np.ndarray):
+    # every (i, j) pair, i < j, of members of the same group, for groups of
+    # consecutive members
+    member = np.arange(group_sizes.sum())
+    rank = member - np.repeat(group_starts, group_sizes)
+    partners = np.repeat(group_sizes, group_sizes) - 1 - rank
+    first = np.repeat(member, partners)
+    second = first + 1 + (
+        np.arange(partners.sum()) - np.repeat(np.cumsum(partners) - partners, partners)
+    )
+    return first, second
+
+
+def find_shared_runs(index: dict, min_stops: int = MIN_SHARED_STOPS) -> dict:
+    """
+    Every maximal run of at least `min_stops` consecutive stops shared by two
+    routes of different services, from the stop-service index.
+    Returns a dict of arrays, one entry per run:
+    - route_a, route_b: route ids, route_a < route_b
+    - start_a, start_b: position of the first shared stop in index["route_stops"]
+    - num_stops: number of shared stops
+    """
+    route_stops = index["route_stops"]
+    route_offsets = index["route_offsets"]
+    starts, routes, hashes = _ngram_hashes(route_stops, route_offsets, min_stops)
+
+    # n-grams with the same hash, by start position within each group
+    order = np.lexsort((starts, hashes))
+    sorted_hashes = hashes[order]
+    is_group_start = np.ones(len(order), dtype=bool)
+    is_group_start[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+    group_starts = np.flatnonzero(is_group_start)
+    group_sizes = np.diff(np.append(group_starts, len(order)))
+
+    # only groups of two or more n-grams can match
+    shared = group_sizes >= 2
+    members = order[np.repeat(shared, group_sizes)]
+    shared_sizes = group_sizes[shared]
+    first, second = _group_pairs(np.cumsum(shared_sizes) - shared_sizes, shared_sizes)
+    a, b = members[first], members[second]
+
+    # different services, and no hash collisions
+    services = index["route_service"]
+    keep = services[routes[a]] != services[routes[b]]
+    a, b = a[keep], b[keep]
+    same = np.ones(len(a), dtype=bool)
+    for j in range(min_stops):
+        same &= route_stops[starts[a] + j] == route_stops[starts[b] + j]
+    a, b = a[same], b[same]
+
+    # the lower route id first
+    swap = routes[a] > routes[b]
+    a, b = np.where(swap, b, a), np.where(swap, a, b)
+    route_a, route_b = routes[a], routes[b]
+    start_a, start_b = starts[a], starts[b]
+
+    # chain matches at consecutive positions on the same diagonal into runs
+    diagonal = (start_a - route_offsets[route_a]) - (start_b - route_offsets[route_b])
+    order = np.lexsort((start_a, diagonal, route_b, route_a))
+    route_a, route_b = route_a[order], route_b[order]
+    start_a, start_b, diagonal = start_a[order], start_b[order], diagonal[order]
+    is_run_start = np.ones(len(order), dtype=bool)
+    is_run_start[1:] = (
+        (route_a[1:] != route_a[:-1])
+        | (route_b[1:] != route_b[:-1])
+        | (diagonal[1:] != diagonal[:-1])
+        | (start_a[1:] != start_a[:-1] + 1)
+    )
+    run_starts = np.flatnonzero(is_run_start)
+    run_matches = np.diff(np.append(run_starts, len(order)))
+    return {
+        "route_a": route_a[run_starts],
+        "route_b": route_b[run_starts],
+        "start_a": start_a[run_starts],
+        "start_b": start_b[run_starts],
+        "num_stops": run_matches + min_stops - 1,
+    }
+
+
+def find_bus_corridors(
+    index: dict, min_stops: int = MIN_SHARED_STOPS, bus_routes: pd.DataFrame = None
+) -> pd.DataFrame:
+    """
+    Runs of consecutive stops shared by two bus services, longest first.
+    If the BusRoutes the index was built from are given and have a Distance
+    column, the length of each run (along service A) is added.
+    Resultant df has these columns:
+    - Service_A, Direction_A, Service_B, Direction_B
+    - Start_Sequence_A, End_Sequence_A, Start_Sequence_B, End_Sequence_B:
+      StopSequence of the first and last shared stop on each route
+    - Shared_Stops, First_Stop, Last_Stop
+    - Shared_Distance_km (if available)
+    """
+    print(f"Finding bus corridors of at least {min_stops} stops...")
+    runs = find_shared_runs(index, min_stops)
+    end_a = runs["start_a"] + runs["num_stops"] - 1
+    end_b = runs["start_b"] + runs["num_stops"] - 1
+
+    services = index["service_names"][index["route_service"]]
+    sequences = index["route_sequences"]
+    corridors = pd.DataFrame(
+        {
+            "Service_A": services[runs["route_a"]],
+            "Direction_A": index["route_direction"][runs["route_a"]],
+            "Service_B": services[runs["route_b"]],
+            "Direction_B": index["route_direction"][runs["route_b"]],
+            "Start_Sequence_A": sequences[runs["start_a"]],
+            "End_Sequence_A": sequences[end_a],
+            "Start_Sequence_B": sequences[runs["start_b"]],
+            "End_Sequence_B": sequences[end_b],
+            "Shared_Stops": runs["num_stops"],
+            "First_Stop": index["stop_codes"][index["route_stops"][runs["start_a"]]],
+            "Last_Stop": index["stop_codes"][index["route_stops"][end_a]],
+        }
+    )
+
+    if bus_routes is not None and "Distance" in bus_routes:
+        # the index keeps BusRoutes rows in this order
+        distances = (
+            bus_routes.sort_values(["ServiceNo", "Direction", "StopSequence"])["Distance"]
+            .to_numpy(dtype=np.float64)
+        )
+        if len(distances) == len(index["route_stops"]):
+            corridors["Shared_Distance_km"] = np.round(
+                distances[end_a] - distances[runs["start_a"]], 1
+            )
+
+    return corridors.sort_values(
+        ["Shared_Stops", "Service_A", "Service_B"],
+        ascending=[False, True, True],
+        kind="stable",
+    ).reset_index(drop=True)
+
+
+def corridor_summary(corridors: pd.DataFrame, index: dict) -> pd.DataFrame:
+    """
+    Overlap of every pair of routes sharing at least one run, with the share of
+    each route's stops that are shared, most shared first.
+    Resultant df has columns Service_A, Direction_A, Service_B, Direction_B,
+    Num_Runs, Longest_Run_Stops, Total_Shared_Stops, Shared_Percentage_A,
+    Shared_Percentage_B.
+    """
+    route_keys = ["Service_A", "Direction_A", "Service_B", "Direction_B"]
+    summary = corridors.groupby(route_keys, as_index=False).agg(
+        Num_Runs=("Shared_Stops", "size"),
+        Longest_Run_Stops=("Shared_Stops", "max"),
+        Total_Shared_Stops=("Shared_Stops", "sum"),
+    )
+
+    route_lengths = pd.Series(
+        np.diff(index["route_offsets"]),
+        index=pd.MultiIndex.from_arrays(
+            [
+                index["service_names"][index["route_service"]],
+                index["route_direction"],
+            ]
+        ),
+    )
+    for side in ("A", "B"):
+        lengths = route_lengths.reindex(
+            pd.MultiIndex.from_arrays(
+                [summary[f"Service_{side}"], summary[f"Direction_{side}"]]
+            )
+        ).to_numpy()
+        summary[f"Shared_Percentage_{side}"] = np.round(
+            summary["Total_Shared_Stops"] / lengths * 100, 1
+        )
+    return summary.sort_values(
+        "Total_Shared_Stops", ascending=False, kind="stable"
+    ).reset_index(drop=True)
@@ -0,0 +1,676 @@
+"""
+Backend core: data loading and cached analysis queries, without Streamlit.
+
+Scripts, the JSON API and worker processes import this module directly, so
+they start without importing Streamlit. Results are cached in memory with
+memcache (and on disk with result_cache where marked); the app uses these
+functions through backend, which plugs Streamlit's caches in instead.
+"""
+
+import json
+import logging
+import os
+import ast
+import numpy as np
+import pandas as pd
+
+import bus_corridors
+import map_query
+import memcache
+import percentile_ranks
+import result_cache
+import ridership_cube
+import stop_groups
+import stop_service_index
+import walking
+import whatif
+
+DATA_FOLDER = os.path.join("data", "cleaned")
+DTYPE_FOLDER = os.path.join("data", "cleaned", "dtypes")
+DATA_FNAMES = [
+    "RailStationsMerged.geojson",
+    "BusRoutes.json",
+    "BusStops.geojson",
+    "RailLineStrings.geojson",
+    "aggregated_ridership.csv",
+    "ridership_percentiles.csv",
+    "bus_route_trips_single_direction.csv",
+]
+# loaded if present in the folder
+OPTIONAL_DATA_FNAMES = [
+    "bus_route_trips.csv",  # both directions, with a Direction column
+]
+
+
+def _read_dtypes(file: str):
+    file_name, _ = os.path.splitext(file)
+    dtype_file_path = os.path.join(DTYPE_FOLDER, f"{file_name}.json")
+    if not os.path.exists(dtype_file_path):
+        return None
+    with open(dtype_file_path, "r") as f:
+        return json.load(f)
+
+
+def data_file_hash(folder: str, file: str) -> str:
+    """
+    Content hash of a data file and its dtypes, without loading it.
+    """
+    dtypes = _read_dtypes(file)
+    # the data version used by the disk cache covers both the file and its dtypes
+    return result_cache.content_hash(
+        (result_cache.file_content_hash(os.path.join(folder, file)), dtypes)
+    )
+
+
+def load_data_file(folder: str, file: str) -> pd.DataFrame:
+    """
+    Load one data file, tagged with its content hash.
+    """
+    print(f"Loading data ({file})...")
+    file_path = os.path.join(folder, file)
+    _, file_ext = os.path.splitext(file)
+    dtypes = _read_dtypes(file)
+
+    if file_ext == ".csv":
+        if dtypes:
+            data = pd.read_csv(file_path, dtype=dtypes)
+        else:
+            data = pd.read_csv(file_path)
+    elif file_ext == ".geojson":
+        # imported here, to keep importing the core (and the app's first page) fast
+        import geopandas as gpd
+
+        data = gpd.read_file(file_path)
+
+        if file == "RailLineStrings.geojson":
+            data["StationNames"] = data["StationNames"].apply(ast.literal_eval)
+            data["StationCodes"] = data["StationCodes"].apply(ast.literal_eval)
+            data.set_geometry("geometry", inplace=True)
+
+    elif file_ext == ".json":
+        json_readers = [
+            lambda: pd.read_json(file_path),
+            lambda: pd.read_json(file_path, lines=True),
+        ]
+        for reader in json_readers:
+            try:
+                if dtypes:
+                    data = reader().astype(dtypes)
+                else:
+                    data = reader()
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"File type not supported: {file}")
+    else:
+        raise ValueError(f"File type not supported: {file}")
+
+    return result_cache.tag_content_hash(data, data_file_hash(folder, file))
+
+
+@memcache.cache_resource
+def get_data_collection(folder=DATA_FOLDER):
+    """
+    Load all the data sources in the given folder. The collection is loaded
+    once and shared by all callers (and all sessions of the app), so it must
+    not be modified; filter it into new frames or row positions instead.
+    """
+    data_collection = {}
+    optional_files = [
+        file for file in OPTIONAL_DATA_FNAMES if os.path.exists(os.path.join(folder, file))
+    ]
+
+    for file in DATA_FNAMES + optional_files:
+        if "dtypes" in file:
+            continue
+        file_name, _ = os.path.splitext(file)
+        data_collection[file_name] = load_data_file(folder, file)
+    return data_collection
+
+
+@memcache.cache_data
+def get_unique_values(_data: pd.DataFrame, column_name: str) -> list:
+    """
+    Get the unique values from the given column in the data.
+    """
+    return _data[column_name].sort_values().unique().tolist()
+
+
+def left_join_datasets(
+    left: pd.DataFrame,
+    right: pd.DataFrame,
+    left_on: str,
+    right_on: str,
+) -> pd.DataFrame:
+    """
+    Join two datasets on the given columns.
+    """
+    return left.merge(right, left_on=left_on, right_on=right_on)
+
+
+def filter_single_dataset(
+    _dataset: pd.DataFrame, filter_name: str, _filter_value
+) -> pd.DataFrame:
+    """
+    Apply a single filter to a dataset.
+    """
+    print(f"Applying filter: {filter_name} == {_filter_value}")
+    if isinstance(_filter_value, list):
+        return _dataset[_dataset[filter_name].isin(_filter_value)]
+    else:
+        return _dataset[_dataset[filter_name] == _filter_value]
+
+
+@memcache.cache_resource
+def get_value_positions(_data_collection, dataset_name: str, column_name: str) -> dict:
+    """
+    Row positions of each value of a column in a dataset, shared by all sessions.
+    """
+    print(f"Indexing {dataset_name} by {column_name}...")
+    return _data_collection[dataset_name].groupby(column_name, sort=False).indices
+
+
+def filter_positions(
+    _data_collection, dataset_name: str, filter_name: str, _filter_value
+) -> np.ndarray:
+    """
+    Row positions (in order) of the rows of a dataset matching a single filter,
+    without copying any data.
+    """
+    value_positions = get_value_positions(_data_collection, dataset_name, filter_name)
+    filter_values = _filter_value if isinstance(_filter_value, list) else [_filter_value]
+    positions = [
+        value_positions[value] for value in filter_values if value in value_positions
+    ]
+    if not positions:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate(positions))
+
+
+@memcache.cache_data
+def filter_data(_data_collection: dict, filters: dict) -> dict:
+    """
+    Filter the data based on the given filters.
+    """
+    filtered_data = {}
+    for dataset_name, dataset in _data_collection.items():
+        print(f"Filtering {dataset_name}...")
+        for filter_name, filter_value in filters.get(dataset_name, {}).items():
+            dataset = filter_single_dataset(dataset, filter_name, filter_value)
+        filtered_data[dataset_name] = dataset
+    return filtered_data
+
+
+def load_data(rail_stations, bus_stops):
+
+    # Reproject both GeoDataFrames to the projected CRS for distance calculations
+    rail_stations_projected = rail_stations.to_crs(3857)
+    bus_stops_projected = bus_stops.to_crs(3857)
+
+    return rail_stations_projected, bus_stops_projected, rail_stations, bus_stops
+
+
+@memcache.cache_resource
+def get_projected_stations_and_stops(_data_collection) -> tuple:
+    """
+    Rail stations and bus stops of the data collection reprojected for distance
+    calculations (see load_data), once for all callers. They are tagged with a
+    hash of their source, so that cached distance queries do not hash every
+    geometry.
+    """
+    projected = load_data(_data_collection["RailStationsMerged"], _data_collection["BusStops"])
+    return tuple(
+        result_cache.tag_content_hash(
+            data, result_cache.content_hash(("EPSG:3857", source))
+        )
+        for data, source in zip(projected[:2], projected[2:])
+    )
+
+
+@memcache.cache_data
+@result_cache.disk_cache
+def find_bus_stops_within_radius(
+    station_name, radius_meters, _rail_stations_gdf, _bus_stops_gdf
+):
+    """
+    Find bus stops within the specified radius (in meters) from a given MRT station and return distances.
+    """
+    # Get the geometry for the given station
+    station = _rail_stations_gdf[
+        _rail_stations_gdf["StationName"].str.lower() == station_name.lower()
+    ]
+
+    if station.empty:
+        return f"Station '{station_name}' not found.", None
+
+    station_geom = station.geometry.iloc[0]
+
+    # Compute the distance from the station to all bus stops (in meters)
+    distances = _bus_stops_gdf.distance(station_geom)
+
+    # Filter bus stops within the specified radius
+    nearby_bus_stops = _bus_stops_gdf[distances <= radius_meters].copy()
+
+    # Add the distance to the resulting bus stops DataFrame
+    nearby_bus_stops["Distance (m)"] = distances[distances <= radius_meters]
+
+    return None, nearby_bus_stops
+
+
+@result_cache.disk_cache
+def build_walking_table(
+    network_hash, max_distance, _network_path, _rail_stations_gdf, _bus_stops_gdf
+):
+    """
+    Walking distance table from the pedestrian network, cached on disk by the
+    network file's content hash.
+    """
+    network = walking.load_walking_network(_network_path)
+    return walking.build_walking_table(
+        network, _rail_stations_gdf, _bus_stops_gdf, max_distance
+    )
+
+
+@memcache.cache_resource
+def get_walking_table(
+    _data_collection, folder: str, max_distance=walking.MAX_WALKING_DISTANCE
+):
+    """
+    Stop-station walking distance table, shared by all sessions.
+    None if there is no walking network file in the data folder.
+    """
+    network_path = walking.find_walking_network(folder)
+    if network_path is None:
+        print("No walking network found, using straight-line distances")
+        return None
+    return build_walking_table(
+        result_cache.file_content_hash(network_path),
+        max_distance,
+        network_path,
+        _data_collection["RailStationsMerged"],
+        _data_collection["BusStops"],
+    )
+
+
+def find_bus_stops_within_walking_distance(
+    station_name, radius_meters, _data_collection, folder: str
+):
+    """
+    Same as find_bus_stops_within_radius, with walking distances over the
+    pedestrian network if there is one, else straight-line distances.
+    """
+    walking_table = get_walking_table(_data_collection, folder)
+    if walking_table is None:
+        rail_stations, bus_stops = get_projected_stations_and_stops(_data_collection)
+        return find_bus_stops_within_radius(
+            station_name, radius_meters, rail_stations, bus_stops
+        )
+    return walking.find_bus_stops_within_walking_distance(
+        walking_table, station_name, radius_meters, _data_collection["BusStops"]
+    )
+
+
+@memcache.cache_data
+@result_cache.disk_cache
+def get_hour_count_below_25th_percentile_each_stop(
+    _data_collection,
+    bus_service: str,
+) -> tuple[pd.DataFrame, int]:
+    """
+    Same function taken from ridership analysis: ridership_final.ipynb
+    resultant df has these columns:
+    - Destination_StopSequence
+    - DAY_TYPE
+    - Total_Hour_Count
+    """
+    print(f"Doing analysis for bus service: {bus_service}")
+
+    bus_routes_trips = _data_collection["bus_route_trips_single_direction"]
+    ridership = _data_collection["aggregated_ridership"]
+    ridership_percentiles = _data_collection["ridership_percentiles"]
+
+    # filter bus_routes_trips to only include the chosen bus service
+    chosen_bus_route_trips = bus_routes_trips[
+        bus_routes_trips["ServiceNo"] == bus_service
+    ]
+    total_num_stops = len(chosen_bus_route_trips["Destination_Stop"].unique())
+
+    # merge chosen_bus_route_trips with ridership to get the estimated tap in and tap out
+    chosen_route_ridership = chosen_bus_route_trips.merge(
+        ridership,
+        on=["Destination_Stop", "PT_TYPE", "TIME_PER_HOUR", "DAY_TYPE"],
+        how="left",
+    )
+
+    # calculate the estimated tap in and tap out based on estimated number of trips for the bus route
+    chosen_route_ridership["Estimated_Tap_In"] = chosen_route_ridership[
+        "Adj_Estimated_Trips"
+    ] * (
+        chosen_route_ridership["TOTAL_TAP_IN_VOLUME"]
+        / chosen_route_ridership["TOTAL_TRIPS"]
+    )
+    chosen_route_ridership["Estimated_Tap_Out"] = chosen_route_ridership[
+        "Adj_Estimated_Trips"
+    ] * (
+        chosen_route_ridership["TOTAL_TAP_OUT_VOLUME"]
+        / chosen_route_ridership["TOTAL_TRIPS"]
+    )
+
+    # merge chosen_route_ridership with overall ridership_percentiles to get the 25th percentile tap in and tap out
+    service_ridership_and_global_ridership = chosen_route_ridership.merge(
+        ridership_percentiles, on=["TIME_PER_HOUR", "DAY_TYPE"]
+    )
+
+    # filter the bus stops to only include those with estimated tap in and tap out below the 25th percentile
+    filtered_busstops = service_ridership_and_global_ridership[
+        (
+            service_ridership_and_global_ridership["Estimated_Tap_In"]
+            < service_ridership_and_global_ridership["TAP_IN_25"]
+        )
+        & (
+            service_ridership_and_global_ridership["Estimated_Tap_Out"]
+            < service_ridership_and_global_ridership["TAP_OUT_25"]
+        )
+        & (service_ridership_and_global_ridership["TIME_PER_HOUR"] > 5)
+        & (service_ridership_and_global_ridership["TIME_PER_HOUR"] < 23)
+    ]
+
+    # count the number of hours below the 25th percentile for each service stop
+    num_hours_below_25th_by_service_stop = (
+        filtered_busstops.groupby(["Destination_StopSequence", "DAY_TYPE"])
+        .size()
+        .reset_index(name="Total_Hour_Count")
+    )
+
+    # create full index of all possible combinations of Destination_StopSequence and DAY_TYPE
+    # this is because some bus stops may not have any hours below the 25th percentile and won't be included in the previous step
+    max_sequence = filtered_busstops["Max_StopSequence"].max()
+    day_types = filtered_busstops["DAY_TYPE"].unique()
+    full_index = pd.MultiIndex.from_product(
+        [range(1, int(max_sequence) + 1), day_types],
+        names=["Destination_StopSequence", "DAY_TYPE"],
+    )
+
+    # filling missing values with 0
+    num_hours_below_25th_by_service_stop = (
+        num_hours_below_25th_by_service_stop.set_index(
+            ["Destination_StopSequence", "DAY_TYPE"]
+        )
+        .reindex(full_index, fill_value=0)
+        .reset_index()
+    )
+
+    num_hours_below_25th_by_service_stop["Destination_StopSequence"] = (
+        num_hours_below_25th_by_service_stop["Destination_StopSequence"].astype(int)
+    )
+
+    return num_hours_below_25th_by_service_stop, total_num_stops
+
+
+@memcache.cache_resource
+def get_stop_service_index(_data_collection) -> dict:
+    """
+    CSR indexes between bus stops and services, built once from BusRoutes and
+    shared by all sessions.
+    """
+    return stop_service_index.build_stop_service_index(
+        _data_collection["BusRoutes"], _data_collection["BusStops"]
+    )
+
+
+def get_stops_for_service(_data_collection, service_no, direction=None):
+    """
+    Bus stop codes visited by a service, in stop sequence order if a direction is given.
+    """
+    index = get_stop_service_index(_data_collection)
+    return stop_service_index.get_stops_for_service(index, service_no, direction)
+
+
+def get_services_at_stop(_data_collection, stop_code, direction=None):
+    """
+    Bus services stopping at a bus stop, optionally only in one direction.
+    """
+    index = get_stop_service_index(_data_collection)
+    return stop_service_index.get_services_at_stop(index, stop_code, direction)
+
+
+def get_bus_stops_for_service(_data_collection, service_no, direction=None):
+    """
+    Rows of BusStops visited by a service (stops missing from BusStops are skipped).
+    """
+    index = get_stop_service_index(_data_collection)
+    stop_ids = stop_service_index.get_stop_ids_for_service(index, service_no, direction)
+    stop_rows = index["stop_rows"][stop_ids]
+    return _data_collection["BusStops"].iloc[stop_rows[stop_rows >= 0]]
+
+
+@memcache.cache_data
+@result_cache.disk_cache
+def get_bus_corridors(
+    _data_collection, min_stops: int = bus_corridors.MIN_SHARED_STOPS
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Runs of at least `min_stops` consecutive stops shared by two bus services
+    (in any direction), and the overlap of each pair of routes.
+    """
+    index = get_stop_service_index(_data_collection)
+    corridors = bus_corridors.find_bus_corridors(
+        index, min_stops, _data_collection["BusRoutes"]
+    )
+    return corridors, bus_corridors.corridor_summary(corridors, index)
+
+
+@memcache.cache_data
+@result_cache.disk_cache
+def get_stop_groups(_data_collection) -> pd.DataFrame:
+    """
+    Stop -> stop group mapping, pairing bus stops on opposite sides of a road
+    (see stop_groups.build_stop_groups).
+    """
+    return stop_groups.build_stop_groups(_data_collection["BusStops"])
+
+
+@memcache.cache_data
+def get_stop_group_locations(_data_collection) -> pd.DataFrame:
+    """
+    Location of every stop group, for proximity queries at group level.
+    """
+    return stop_groups.get_group_locations(
+        get_stop_groups(_data_collection), _data_collection["BusStops"]
+    )
+
+
+@memcache.cache_data
+@result_cache.disk_cache
+def get_stop_group_ridership(_data_collection) -> pd.DataFrame:
+    """
+    aggregated_ridership summed over each stop group.
+    """
+    return stop_groups.aggregate_ridership_by_group(
+        _data_collection["aggregated_ridership"], get_stop_groups(_data_collection)
+    )
+
+
+@memcache.cache_resource
+def get_location_index(_data_collection) -> dict:
+    """
+    Nearest-neighbour index of bus stops and rail stations for map clicks.
+    Shared by all sessions.
+    """
+    return map_query.build_location_index(
+        get_stop_service_index(_data_collection),
+        _data_collection["BusStops"],
+        _data_collection["RailStationsMerged"],
+    )
+
+
+def query_map_location(_data_collection, latitude: float, longitude: float):
+    """
+    The bus stop or rail station nearest to a point on the map, with its
+    services and nearby stops (see map_query.query_location), or None.
+    """
+    return map_query.query_location(
+        get_location_index(_data_collection), latitude, longitude
+    )
+
+
+@memcache.cache_resource
+def get_whatif_index(_data_collection, radius_meters=whatif.RADIUS_METERS) -> dict:
+    """
+    Precomputed stop neighbourhoods for what-if analysis. Shared by all sessions.
+    """
+    return whatif.build_whatif_index(
+        get_stop_service_index(_data_collection),
+        _data_collection["BusStops"],
+        _data_collection["RailStationsMerged"],
+        radius_meters,
+    )
+
+
+def get_service_removal_impact(_data_collection, removed_services: list[str]):
+    """
+    Stops affected by removing the given bus services, and a summary of the counts.
+    """
+    index = get_whatif_index(_data_collection)
+    affected_stops = whatif.evaluate_service_removal(index, removed_services)
+    return affected_stops, whatif.summarise_service_removal(affected_stops)
+
+
+@memcache.cache_resource
+def get_bus_route_trips(_data_collection) -> pd.DataFrame:
+    """
+    Estimated trips of every service between consecutive stops, in both
+    directions if bus_route_trips is in the data folder, otherwise in
+    direction 1 only. Always has a Direction column.
+    """
+    if "bus_route_trips" in _data_collection:
+        return _data_collection["bus_route_trips"]
+    bus_route_trips = _data_collection["bus_route_trips_single_direction"]
+    return result_cache.tag_content_hash(
+        bus_route_trips.assign(Direction=1),
+        result_cache.content_hash(bus_route_trips),
+    )
+
+
+@memcache.cache_resource
+def get_percentile_rank_table(_data_collection) -> pd.DataFrame:
+    """
+    Percentile ranks of every service stop's estimated tap in/out against the
+    network distribution, for each hour and day type. Shared by all sessions.
+    """
+    return percentile_ranks.build_percentile_rank_table(
+        get_bus_route_trips(_data_collection),
+        _data_collection["aggregated_ridership"],
+    )
+
+
+@memcache.cache_data
+@result_cache.disk_cache
+def get_hour_count_below_percentile_each_stop(
+    _data_collection,
+    bus_service: str,
+    percentile: float = 25,
+    hour_window: tuple[int, int] = percentile_ranks.HOUR_WINDOW,
+    direction: int = 1,
+) -> tuple[pd.DataFrame, int]:
+    """
+    Same analysis as get_hour_count_below_25th_percentile_each_stop, for any
+    percentile cut-off, (inclusive) hour window and direction (None for both,
+    which needs bus_route_trips in the data folder).
+    """
+    print(
+        f"Doing analysis for bus service: {bus_service} "
+        f"(percentile {percentile}, hours {hour_window}, direction {direction})"
+    )
+    return percentile_ranks.get_hour_count_below_percentile_each_stop(
+        get_percentile_rank_table(_data_collection),
+        bus_service,
+        percentile,
+        hour_window,
+        direction,
+    )
+
+
+@memcache.cache_data
+@result_cache.disk_cache
+def get_low_ridership_hours_each_stop(
+    _data_collection,
+    percentile: float = 25,
+    hour_window: tuple[int, int] = percentile_ranks.HOUR_WINDOW,
+    day_type: str = "WEEKDAY",
+) -> pd.DataFrame:
+    """
+    Low-ridership hours of every bus stop, summed over all the services serving
+    it, with the stop locations, for the network-wide map layer.
+    Stops without a location are left out.
+    """
+    print(
+        f"Doing network-wide analysis (percentile {percentile}, hours {hour_window})"
+    )
+    stop_metrics = percentile_ranks.get_low_ridership_hours_each_stop(
+        get_percentile_rank_table(_data_collection), percentile, hour_window
+    )
+    stop_metrics = stop_metrics[stop_metrics["DAY_TYPE"] == day_type]
+
+    bus_stops = _data_collection["BusStops"]
+    bus_stops = bus_stops[bus_stops.geometry.notna()].to_crs(4326)
+    stop_locations = pd.DataFrame(
+        {
+            # Destination_Stop is numeric, BUS_STOP_N may have leading zeros
+            "Destination_Stop": pd.to_numeric(bus_stops["BUS_STOP_N"], errors="coerce"),
+            "BUS_STOP_N": bus_stops["BUS_STOP_N"].astype(str),
+            "LOC_DESC": bus_stops["LOC_DESC"],
+            "latitude": bus_stops.geometry.y,
+            "longitude": bus_stops.geometry.x,
+        }
+    ).drop_duplicates("Destination_Stop")
+    return stop_metrics.merge(stop_locations, on="Destination_Stop").reset_index(
+        drop=True
+    )
+
+
+@memcache.cache_resource
+def get_ridership_cube(_data_collection, folder=result_cache.CACHE_FOLDER) -> dict:
+    """
+    Stop x hour x day type ridership cube (see ridership_cube), memory-mapped
+    from disk. It is built once per version of the ridership data and shared
+    by all sessions and server processes.
+    """
+    bus_route_trips = get_bus_route_trips(_data_collection)
+    data_hash = result_cache.content_hash(
+        [_data_collection["aggregated_ridership"], bus_route_trips]
+    )
+    cube_folder = os.path.join(folder, f"ridership_cube_{data_hash[:16]}")
+    cube = ridership_cube.load_ridership_cube(cube_folder)
+    if cube is None:
+        ridership_cube.save_ridership_cube(
+            ridership_cube.build_ridership_cube(
+                _data_collection["aggregated_ridership"], bus_route_trips
+            ),
+            cube_folder,
+        )
+        cube = ridership_cube.load_ridership_cube(cube_folder)
+    return cube
+
+
+@memcache.cache_resource
+def get_ridership_cube_locations(_data_collection) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cube rows of the bus stops with a location, and their [latitude, longitude].
+    """
+    cube = get_ridership_cube(_data_collection)
+    bus_stops = _data_collection["BusStops"]
+    bus_stops = bus_stops[bus_stops.geometry.notna()].to_crs(4326)
+    # stop codes that are not numbers are not in the cube
+    stop_codes = pd.to_numeric(bus_stops["BUS_STOP_N"], errors="coerce")
+    positions = np.full(len(bus_stops), -1)
+    numeric = stop_codes.notna().to_numpy()
+    positions[numeric] = ridership_cube.stop_positions(
+        cube, stop_codes[numeric].to_numpy(dtype=np.int64)
+    )
+    located = positions >= 0
+    locations = np.column_stack(
+        [bus_stops.geometry.y.to_numpy(), bus_stops.geometry.x.to_numpy()]
+    )
+    return positions[located], locations[located]
@@ -0,0 +1,246 @@
+"""
+Batch export of the low-ridership chart and route map of many bus services
+into a static report folder, for review outside the app.
+
+The per-service hour counts come from the `hour_counts` stage of the analysis
+pipeline (see pipeline), so they are only recomputed for services whose data
+changed. Charts (Altair) and maps (folium) are rendered to standalone HTML by
+a pool of worker processes, with the same builders as the app (see frontend).
+
+    report/
+        index.html
+        services/<service_no>/chart.html
+        services/<service_no>/map.html
+
+Usage (from the repo root):
+    python app/export.py report --workers 4
+    python app/export.py report --services 167 179 --percentile 25
+"""
+
+import argparse
+import html
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import core
+import frontend
+import percentile_ranks
+import pipeline
+
+RAIL_LINE_TOLERANCE = 0.0001  # degrees (about 10 m), to keep every map file small
+
+# set in each worker process by _init_worker
+_rail_line_strings = None
+
+
+def _service_folder(service_no: str) -> str:
+    return os.path.join("services", re.sub(r"[^\w.-]", "_", str(service_no)))
+
+
+def _init_worker(rail_line_strings) -> None:
+    global _rail_line_strings
+    _rail_line_strings = rail_line_strings
+
+
+def export_service(task: dict) -> dict:
+    """
+    Write the chart and map of one service into the report folder, and return
+    its row of the index.
+    """
+    hour_counts = task["hour_counts"]
+    total_num_stops = task["total_num_stops"]
+    threshold = task["threshold"]
+    service_folder = _service_folder(task["service_no"])
+    os.makedirs(os.path.join(task["folder"], service_folder), exist_ok=True)
+
+    chart_path = os.path.join(service_folder, "chart.html")
+    chart = frontend.create_hour_count_chart(
+        hour_counts[hour_counts["DAY_TYPE"] == "WEEKDAY"], total_num_stops, threshold
+    ).properties(title=f"Bus service {task['service_no']}: low-ridership hours (weekday)")
+    chart.save(os.path.join(task["folder"], chart_path))
+
+    map_path = os.path.join(service_folder, "map.html")
+    frontend.create_route_map(task["marker_specs"], _rail_line_strings).save(
+        os.path.join(task["folder"], map_path)
+    )
+
+    return {
+        "ServiceNo": task["service_no"],
+        "Stops": total_num_stops,
+        "Weekday_Percentage_Exceed": round(
+            frontend.get_percent_exceeding(
+                hour_counts, total_num_stops, threshold, "WEEKDAY"
+            ),
+            2,
+        ),
+        "Weekend_Percentage_Exceed": round(
+            frontend.get_percent_exceeding(
+                hour_counts, total_num_stops, threshold, "WEEKENDS/HOLIDAY"
+            ),
+            2,
+        ),
+        "Chart": chart_path,
+        "Map": map_path,
+    }
+
+
+def write_index(folder: str, rows: list[dict], title: str, description: str) -> str:
+    """
+    index.html of the report: one row per service with links to its files,
+    services with the most stops above the threshold first.
+    """
+    index = pd.DataFrame(rows).sort_values(
+        ["Weekday_Percentage_Exceed", "ServiceNo"], ascending=[False, True]
+    )
+    for column in ["Chart", "Map"]:
+        index[column] = [
+            f'<a href="{html.escape(path.replace(os.sep, "/"))}">{column.lower()}</a>'
+            for path in index[column]
+        ]
+    index["ServiceNo"] = index["ServiceNo"].map(html.escape)
+    table = index.rename(columns=lambda column: column.replace("_", " ")).to_html(
+        index=False, escape=False, border=0
+    )
+
+    index_path = os.path.join(folder, "index.html")
+    with open(index_path, "w") as f:
+        f.write(
+            f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+th, td {{ padding: 4px 12px; text-align: right; border-bottom: 1px solid #ddd; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+<p>{html.escape(description)}</p>
+{table}
+</body>
+</html>
+"""
+        )
+    return index_path
+
+
+def export_report(
+    folder: str,
+    services: list[str] = None,
+    data_folder: str = core.DATA_FOLDER,
+    pipeline_folder: str = pipeline.PIPELINE_FOLDER,
+    workers: int = 4,
+    percentile: float = 25,
+    hour_window: tuple[int, int] = percentile_ranks.HOUR_WINDOW,
+    threshold: int = frontend.HOUR_COUNT_THRESHOLD,
+) -> str:
+    """
+    Export the chart and map of the given services (all services by default),
+    in both directions, and return the path of the report's index.html.
+    """
+    start = time.perf_counter()
+    analysis = pipeline.build_analysis_pipeline(
+        data_folder,
+        pipeline_folder,
+        workers,
+        percentile=percentile,
+        hour_window=hour_window,
+    )
+    analysis.run(["hour_counts"])
+    hour_counts = analysis.value("hour_counts")
+
+    data_collection = core.get_data_collection(data_folder)
+    if services is None:
+        services = core.get_stop_service_index(data_collection)["service_names"]
+    services = [str(service_no) for service_no in services]
+
+    print(f"Preparing {len(services)} services...")
+    service_rows = hour_counts.groupby(hour_counts["ServiceNo"].astype(str)).indices
+    empty = hour_counts.iloc[:0]
+    tasks = []
+    for service_no in services:
+        service_counts = (
+            hour_counts.iloc[service_rows[service_no]]
+            if service_no in service_rows
+            else empty
+        )
+        tasks.append(
+            {
+                "folder": folder,
+                "service_no": service_no,
+                "hour_counts": service_counts.drop(columns=["ServiceNo", "Total_Num_Stops"]),
+                "total_num_stops": (
+                    int(service_counts["Total_Num_Stops"].iloc[0])
+                    if len(service_counts)
+                    else 0
+                ),
+                "threshold": threshold,
+                "marker_specs": frontend.get_bus_marker_specs(
+                    service_no,
+                    {
+                        direction: core.get_bus_stops_for_service(
+                            data_collection, service_no, direction
+                        )
+                        for direction in [1, 2]
+                    },
+                ),
+            }
+        )
+
+    rail_line_strings = data_collection["RailLineStrings"][["StationLine", "geometry"]]
+    rail_line_strings = rail_line_strings.assign(
+        geometry=rail_line_strings.geometry.simplify(RAIL_LINE_TOLERANCE)
+    )
+
+    print(f"Rendering {len(tasks)} services with {workers} workers...")
+    os.makedirs(folder, exist_ok=True)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(rail_line_strings,)
+    ) as executor:
+        rows = list(executor.map(export_service, tasks, chunksize=8))
+
+    index_path = write_index(
+        folder,
+        rows,
+        "Low-ridership bus services",
+        f"Stops with more than {threshold} hours (between {hour_window[0]}:00 and "
+        f"{hour_window[1]}:00) with both tap in and tap out below the network's "
+        f"{percentile:g}th percentile, both directions.",
+    )
+    print(f"Exported {len(rows)} services in {time.perf_counter() - start:.2f}s")
+    return index_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export bus service charts and maps to a static report"
+    )
+    parser.add_argument("folder", help="report folder")
+    parser.add_argument("--services", nargs="+", help="only these services")
+    parser.add_argument("--data", default=core.DATA_FOLDER, help="data folder")
+    parser.add_argument("--pipeline", default=pipeline.PIPELINE_FOLDER)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--percentile", type=float, default=25)
+    parser.add_argument("--start-hour", type=int, default=percentile_ranks.HOUR_WINDOW[0])
+    parser.add_argument("--end-hour", type=int, default=percentile_ranks.HOUR_WINDOW[1])
+    parser.add_argument("--threshold", type=int, default=frontend.HOUR_COUNT_THRESHOLD)
+    args = parser.parse_args()
+
+    index_path = export_report(
+        args.folder,
+        args.services,
+        args.data,
+        args.pipeline,
+        args.workers,
+        args.percentile,
+        (args.start_hour, args.end_hour),
+        args.threshold,
+    )
+    print(f"Report written to {index_path}")
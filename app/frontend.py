@@ -1,13 +1,18 @@
-import folium
-from folium.plugins import MarkerCluster
-import geopandas as gpd
 import pandas as pd
 import frontend
-import altair as alt
+
+# folium and altair are imported by the functions that need them, to keep app
+# start-up fast
+
+# stops served in both directions are drawn once, in black
+BUS_DIRECTION_COLORS = {(1,): "gray", (2,): "steelblue", (1, 2): "black"}
+HOUR_COUNT_THRESHOLD = 6  # low-ridership hours
 
 
 def get_base_map():
     """Map centred in Singapore."""
+    import folium
+
     return folium.Map(location=[1.3521, 103.8198], zoom_start=12)
 
 
@@ -51,6 +56,8 @@ def get_location_from_row(row):
 
 def create_base_map():
     """Create a base Folium map centered at Singapore."""
+    import folium
+
     singapore_center = [1.3521, 103.8198]  # Coordinates for Singapore
     return folium.Map(location=singapore_center, zoom_start=12)
 
@@ -101,3 +108,181 @@ def get_rail_line_color_by_line_name(line_name):
         return "#40E0D0"
     else:
         return "#808080"  # gray
+
+
+"""For bus service charts and route maps (app and export)"""
+
+
+def get_bus_marker_specs(service_no, stops_by_direction: dict) -> list[dict]:
+    """
+    Locations, popups and colours of the bus stop markers of a service, from
+    its BusStops rows in each direction ({direction: rows}).
+    A stop served in both directions gets a single marker.
+    """
+    stop_directions = {}
+    stop_rows = {}
+    for route_direction, bus_route_data in stops_by_direction.items():
+        for _, row in bus_route_data.iterrows():
+            bus_stop_code = row["BUS_STOP_N"]
+            stop_rows.setdefault(bus_stop_code, row)
+            stop_directions.setdefault(bus_stop_code, []).append(route_direction)
+
+    marker_specs = []
+
+    for bus_stop_code, row in stop_rows.items():
+        directions = tuple(sorted(set(stop_directions[bus_stop_code])))
+
+        popup = create_popup_text(
+            ServiceNo=service_no,
+            Direction=", ".join(str(d) for d in directions),
+            BusStopCode=bus_stop_code,
+        )
+
+        loc = get_location_from_row(row)
+        marker_specs.append(
+            {
+                "location": loc,
+                "popup": popup,
+                "fill_color": BUS_DIRECTION_COLORS.get(directions, "gray"),
+            }
+        )
+
+    return marker_specs
+
+
+def create_bus_markers(marker_specs: list[dict]) -> list:
+    """
+    Circle markers of bus stops. folium elements hold a reference to their
+    parent, so new ones are created for every map.
+    """
+    import folium
+
+    return [
+        folium.CircleMarker(
+            location=spec["location"],
+            radius=6,
+            fill_color=spec["fill_color"],
+            fill_opacity=0.8,
+            color="black",
+            weight=1,
+            popup=spec["popup"],
+        )
+        for spec in marker_specs
+        if spec["location"] is not None
+    ]
+
+
+def create_rail_line_layer(rail_line_strings):
+    """
+    MRT/LRT lines as a GeoJson layer, coloured by line.
+    """
+    import folium
+
+    return folium.GeoJson(
+        rail_line_strings,
+        name="geojson",
+        style_function=lambda x: {
+            "color": get_rail_line_color_by_line_name(x["properties"]["StationLine"]),
+            "weight": 4,
+            "opacity": 0.8,
+            "smoothFactor": 5,
+        },
+    )
+
+
+def create_route_map(marker_specs: list[dict], rail_line_strings=None):
+    """
+    Standalone map of a bus route's stops (and the rail lines), zoomed to the route.
+    """
+    import folium
+
+    route_map = create_base_map()
+    if rail_line_strings is not None:
+        create_rail_line_layer(rail_line_strings).add_to(route_map)
+    bus_layer = folium.FeatureGroup(name="Bus Routes")
+    for marker in create_bus_markers(marker_specs):
+        marker.add_to(bus_layer)
+    bus_layer.add_to(route_map)
+
+    locations = [spec["location"] for spec in marker_specs if spec["location"]]
+    if locations:
+        route_map.fit_bounds(
+            [
+                [min(lat for lat, _ in locations), min(lon for _, lon in locations)],
+                [max(lat for lat, _ in locations), max(lon for _, lon in locations)],
+            ]
+        )
+    return route_map
+
+
+def create_hour_count_chart(
+    hour_counts: pd.DataFrame,
+    total_num_stops: int,
+    threshold: int = HOUR_COUNT_THRESHOLD,
+):
+    """
+    Scatter chart of the number of low-ridership hours at each stop along the
+    route, coloured by direction if there is a Direction column, with the
+    threshold as a red line.
+    """
+    import altair as alt
+
+    scatter_plot = (
+        alt.Chart(hour_counts)
+        .mark_circle(size=60)
+        .encode(
+            x=alt.X("Destination_StopSequence", title="Bus Stop Sequence along Route"),
+            y=alt.Y("Total_Hour_Count", title="Number of Low Ridership Hours"),
+            # color="DAY_TYPE",
+            # tooltip=["Destination_StopSequence", "Total_Hour_Count", "DAY_TYPE"],
+            tooltip=["Destination_StopSequence", "Total_Hour_Count"],
+        )
+        .properties(width=800, height=600)
+    )
+    if "Direction" in hour_counts:
+        scatter_plot = scatter_plot.encode(
+            color=alt.Color("Direction:N", title="Direction"),
+            tooltip=["Direction", "Destination_StopSequence", "Total_Hour_Count"],
+        )
+
+    # add threshold line if there are stops
+    if total_num_stops:
+        hline = (
+            alt.Chart(pd.DataFrame({"y": [threshold]}))
+            .mark_rule(color="red")
+            .encode(y="y")
+        )
+        scatter_plot = scatter_plot + hline
+    return scatter_plot
+
+
+def get_percent_exceeding(
+    hour_counts: pd.DataFrame, total_num_stops: int, threshold: int, day_type: str
+) -> float:
+    """
+    Percentage of the stops with more than `threshold` low-ridership hours on a day type.
+    """
+    day_data = hour_counts[hour_counts["DAY_TYPE"] == day_type]
+    if total_num_stops == 0 or day_data.empty:
+        return 0
+    return (day_data["Total_Hour_Count"] > threshold).sum() / total_num_stops * 100
+
+
+def get_percent_exceeding_text(
+    hour_counts: pd.DataFrame,
+    total_num_stops: int,
+    threshold: int = HOUR_COUNT_THRESHOLD,
+) -> str:
+
+    if total_num_stops == 0:
+        return ""
+
+    percentage_exceed_weekday = get_percent_exceeding(
+        hour_counts, total_num_stops, threshold, "WEEKDAY"
+    )
+    output = (
+        f"% of bus stops with over {threshold} hours of low ridership, out of {total_num_stops} stops:  \n"
+        f"{percentage_exceed_weekday:.2f}%  \n"
+    )
+
+    return output
@@ -0,0 +1,381 @@
+"""
+Load test for the Streamlit app.
+
+Starts the app with `streamlit run` (a single server process, as deployed) and
+connects many headless sessions to it over the app's websocket. Each session
+replays a random sequence of StationLine / ServiceNo selections; every
+selection is one rerun, timed from sending the new widget state to the end of
+the script run.
+
+For each concurrency level the report gives rerun latency (p50/p95), reruns
+per second, the server's memory, and the hit rates of the backend's cache_data
+and cache_resource functions (st.cache_data / st.cache_resource in the app) and
+of the disk cache behind them. The server writes these counts to a stats file
+at the end of every run (see memcache.write_cache_stats); functions cached in
+app.py itself are not counted. Saturation is where adding sessions no longer
+adds throughput and only increases latency.
+
+Usage (from the repo root, with app/appdata in place):
+    python app/loadtest.py --concurrency 1 5 10 20 50 --steps 10
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.sync.client import connect
+
+import memcache
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+APP_KEY = os.path.basename(APP_FILE)
+SERVICE_KEY = f"{APP_KEY}_BusRoutes_ServiceNo_selectbox"
+STATION_LINE_KEY = f"{APP_KEY}_RailStationsMerged_StationLine_multiselect"
+CONCURRENCY = (1, 5, 10, 20, 50)
+SATURATION_GAIN = 0.1  # minimum relative throughput gain from more sessions
+LOG_FILE = os.path.join("data", "loadtest_server.log")
+STATS_FILE = os.path.join("data", "loadtest_cache_stats.json")
+
+
+def start_server(
+    port: int, log_file: str = LOG_FILE, stats_file: str = STATS_FILE, timeout: float = 60
+):
+    """
+    Run the app with `streamlit run` in the background, logging to `log_file`
+    and writing its cache stats to `stats_file`.
+    Returns the server process once it accepts connections.
+    """
+    if os.path.exists(stats_file):
+        os.remove(stats_file)
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+    log = open(log_file, "w")
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            APP_FILE,
+            "--server.headless=true",
+            f"--server.port={port}",
+            "--browser.gatherUsageStats=false",
+        ],
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        env={
+            **os.environ,
+            "PYTHONUNBUFFERED": "1",
+            memcache.STATS_FILE_ENV: os.path.abspath(stats_file),
+        },
+    )
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Streamlit server exited, see {log_file}")
+        try:
+            with urllib.request.urlopen(f"http://localhost:{port}/_stcore/health") as r:
+                if r.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise TimeoutError(f"Streamlit server did not start within {timeout}s")
+
+
+def server_memory_mb(pid: int) -> tuple[float, float]:
+    """
+    Current and peak resident memory of a process, in MB (linux only, else NaN).
+    """
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value, _ = line.split()
+                    memory[name] = int(value) / 1024
+    except OSError:
+        pass
+    return memory.get("VmRSS:", np.nan), memory.get("VmHWM:", np.nan)
+
+
+def read_cache_stats(stats_file: str) -> dict:
+    """
+    The server's cache counts (see memcache.cache_stats), all 0 before its first run.
+    """
+    try:
+        with open(stats_file, "r") as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+
+def hit_rate(hits: int, lookups: int) -> float:
+    return hits / lookups if lookups else np.nan
+
+
+class Session:
+    """
+    A headless browser session: sends widget states and waits for the script
+    run to finish, like the frontend does.
+    """
+
+    def __init__(self, port: int, timeout: float):
+        self.port = port
+        self.timeout = timeout
+        self.websocket = None
+        self.widget_states = {}
+        # user key -> (widget id, options), filled in from the elements received
+        self.widgets = {}
+
+    def __enter__(self) -> "Session":
+        self.websocket = connect(
+            f"ws://localhost:{self.port}/_stcore/stream",
+            subprotocols=["streamlit"],
+            max_size=None,
+        ).__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.websocket.__exit__(*exc_info)
+
+    def rerun(self) -> float:
+        """
+        Rerun the script with the current widget states. Returns the latency.
+        """
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.widget_states.widgets.extend(self.widget_states.values())
+
+        start = time.perf_counter()
+        self.websocket.send(message.SerializeToString())
+        while True:
+            forward_message = ForwardMsg()
+            forward_message.ParseFromString(self.websocket.recv(timeout=self.timeout))
+            message_type = forward_message.WhichOneof("type")
+
+            if message_type == "delta":
+                self._read_element(forward_message.delta)
+            elif message_type == "script_finished":
+                status = forward_message.script_finished
+                if status == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    return time.perf_counter() - start
+                if status == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("App failed to compile")
+
+    def _read_element(self, delta) -> None:
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element_type = delta.new_element.WhichOneof("type")
+        if element_type == "exception":
+            raise RuntimeError(f"App raised {delta.new_element.exception.message}")
+        if element_type in ("selectbox", "multiselect"):
+            element = getattr(delta.new_element, element_type)
+            for key in (SERVICE_KEY, STATION_LINE_KEY):
+                if element.id.endswith(key):
+                    self.widgets[key] = (element.id, list(element.options))
+
+    def select(self, key: str, value) -> float:
+        """
+        Set a selectbox (string value) or multiselect (list value) and rerun.
+        """
+        widget_id, _ = self.widgets[key]
+        widget_state = WidgetState(id=widget_id)
+        if isinstance(value, list):
+            widget_state.string_array_value.data[:] = value
+        else:
+            widget_state.string_value = value
+        self.widget_states[key] = widget_state
+        return self.rerun()
+
+
+def make_filter_sequence(
+    services: list[str], station_lines: list[str], num_steps: int, rng: random.Random
+) -> list[tuple[str, object]]:
+    """
+    A user's sequence of selections: mostly switching bus services, sometimes
+    adding or removing a rail line, occasionally clearing the service.
+    """
+    sequence = []
+    selected_lines = []
+    for _ in range(num_steps):
+        action = rng.random()
+        if action < 0.6:
+            sequence.append((SERVICE_KEY, rng.choice(services)))
+        elif action < 0.9:
+            line = rng.choice(station_lines)
+            if line in selected_lines:
+                selected_lines.remove(line)
+            else:
+                selected_lines.append(line)
+            sequence.append((STATION_LINE_KEY, list(selected_lines)))
+        else:
+            sequence.append((SERVICE_KEY, "Not selected"))
+    return sequence
+
+
+def run_session(port: int, sequence: list[tuple[str, object]], timeout: float):
+    """
+    Open the app and replay a filter sequence.
+    Returns the latency (seconds) of every rerun, including the first run.
+    """
+    with Session(port, timeout) as session:
+        latencies = [session.rerun()]
+        for key, value in sequence:
+            latencies.append(session.select(key, value))
+    return latencies
+
+
+def get_widget_options(port: int, timeout: float) -> tuple[list[str], list[str]]:
+    """
+    Options of the ServiceNo selectbox and StationLine multiselect, from one
+    session. Also loads the data and warms the caches, as for a running server.
+    """
+    with Session(port, timeout) as session:
+        session.rerun()
+    services = [
+        option
+        for option in session.widgets[SERVICE_KEY][1]
+        if option != "Not selected"
+    ]
+    return services, session.widgets[STATION_LINE_KEY][1]
+
+
+def run_level(
+    server,
+    port: int,
+    concurrency: int,
+    sequences: list[list[tuple[str, object]]],
+    stats_file: str,
+    timeout: float,
+) -> dict:
+    """
+    Run one session per sequence, all at once, and summarise their reruns.
+    """
+    print(f"Running {concurrency} concurrent sessions...")
+    stats_before = read_cache_stats(stats_file)
+    # all sessions start together
+    barrier = threading.Barrier(concurrency)
+
+    def session(sequence):
+        barrier.wait()
+        return run_session(port, sequence, timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        all_latencies = list(executor.map(session, sequences))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate(all_latencies)
+    stats_after = read_cache_stats(stats_file)
+    stats = {
+        name: count - stats_before.get(name, 0) for name, count in stats_after.items()
+    }
+    data_calls, resource_calls = stats.get("data_calls", 0), stats.get("resource_calls", 0)
+    disk_hits, disk_misses = stats.get("disk_hits", 0), stats.get("disk_misses", 0)
+    rss, peak_rss = server_memory_mb(server.pid)
+    return {
+        "Concurrency": concurrency,
+        "Reruns": len(latencies),
+        "P50_Latency_s": np.percentile(latencies, 50),
+        "P95_Latency_s": np.percentile(latencies, 95),
+        "Max_Latency_s": latencies.max(),
+        "Reruns_Per_s": len(latencies) / elapsed,
+        "Data_Cache_Hit_Rate": hit_rate(
+            data_calls - stats.get("data_misses", 0), data_calls
+        ),
+        "Resource_Cache_Hit_Rate": hit_rate(
+            resource_calls - stats.get("resource_misses", 0), resource_calls
+        ),
+        # disk cache lookups only happen when st.cache_data misses
+        "Disk_Cache_Lookups_Per_Rerun": (disk_hits + disk_misses) / len(latencies),
+        "Disk_Cache_Hit_Rate": hit_rate(disk_hits, disk_hits + disk_misses),
+        "Server_RSS_MB": rss,
+        "Server_Peak_RSS_MB": peak_rss,
+    }
+
+
+def find_saturation(report: pd.DataFrame, min_gain: float = SATURATION_GAIN):
+    """
+    First concurrency level at which throughput grows by less than `min_gain`
+    (relative) over the previous level, or None if throughput keeps scaling.
+    """
+    throughput = report["Reruns_Per_s"].to_numpy()
+    for i in range(1, len(report)):
+        if throughput[i] < throughput[i - 1] * (1 + min_gain):
+            return int(report["Concurrency"].iloc[i])
+    return None
+
+
+def load_test(
+    concurrency_levels=CONCURRENCY,
+    num_steps: int = 10,
+    seed: int = 0,
+    port: int = 8599,
+    timeout: float = 300,
+    log_file: str = LOG_FILE,
+    stats_file: str = STATS_FILE,
+) -> pd.DataFrame:
+    """
+    Run the app at each concurrency level. Returns one row per level.
+    """
+    server = start_server(port, log_file, stats_file)
+    try:
+        print("Warming up...")
+        services, station_lines = get_widget_options(port, timeout)
+
+        rows = []
+        for concurrency in concurrency_levels:
+            rng = random.Random(seed + concurrency)
+            sequences = [
+                make_filter_sequence(services, station_lines, num_steps, rng)
+                for _ in range(concurrency)
+            ]
+            rows.append(
+                run_level(server, port, concurrency, sequences, stats_file, timeout)
+            )
+    finally:
+        server.terminate()
+        server.wait()
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent-session load test")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=list(CONCURRENCY)
+    )
+    parser.add_argument("--steps", type=int, default=10, help="selections per session")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds per rerun")
+    parser.add_argument("--output", help="path to save the report as csv")
+    args = parser.parse_args()
+
+    report = load_test(
+        args.concurrency, args.steps, args.seed, args.port, args.timeout
+    )
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(report.round(3).to_string(index=False))
+
+    saturation = find_saturation(report)
+    if saturation is None:
+        print("Throughput kept scaling up to the highest concurrency level")
+    else:
+        print(f"Throughput stops scaling at {saturation} concurrent sessions")
+
+    if args.output:
+        report.to_csv(args.output, index=False)
+        print(f"Saved report to {args.output}")
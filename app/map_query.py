@@ -0,0 +1,138 @@
+"""
+Nearest bus stop or rail station to a point clicked on the map.
+
+Bus stops and rail stations are indexed once in KDTrees over their projected
+coordinates (as in whatif), so that a click only needs a tree query instead of
+a distance computation against every row of BusStops. The services at a stop
+come from the stop-service index.
+"""
+
+import numpy as np
+import pandas as pd
+
+from stop_service_index import get_services_at_stop
+from whatif import projected_xy
+
+EARTH_RADIUS = 6378137.0  # metres, sphere of PROJECTED_CRS (EPSG:3857)
+MAX_CLICK_METERS = 500  # clicks further than this from any stop or station select nothing
+NEARBY_METERS = 300
+
+
+def project_point(latitude: float, longitude: float) -> np.ndarray:
+    """
+    WGS84 latitude/longitude (as returned by the map) to PROJECTED_CRS x/y.
+    """
+    x = EARTH_RADIUS * np.radians(longitude)
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(latitude) / 2))
+    return np.array([x, y])
+
+
+def build_location_index(stop_service_index: dict, bus_stops, rail_stations) -> dict:
+    """
+    KDTrees over the bus stops and rail stations with a location. The services
+    at each stop are looked up in the stop-service index.
+    """
+    # sklearn is slow to import, only import it when the index is built
+    from sklearn.neighbors import KDTree
+
+    print("Building map location index...")
+    bus_stops = bus_stops[bus_stops.geometry.notna()]
+    stop_xy = projected_xy(bus_stops)
+    rail_stations = rail_stations[rail_stations.geometry.notna()]
+    station_xy = projected_xy(rail_stations)
+    return {
+        "stop_service_index": stop_service_index,
+        "stop_codes": bus_stops["BUS_STOP_N"].astype(str).to_numpy(),
+        "stop_descriptions": bus_stops["LOC_DESC"].to_numpy(),
+        "stop_xy": stop_xy,
+        "stop_tree": KDTree(stop_xy),
+        "station_names": rail_stations["StationName"].to_numpy(),
+        "station_codes": rail_stations["StationCode"].to_numpy(),
+        "station_lines": rail_stations["StationLine"].to_numpy(),
+        "station_xy": station_xy,
+        "station_tree": KDTree(station_xy) if len(station_xy) else None,
+    }
+
+
+def _nearest(tree, xy: np.ndarray) -> tuple[float, int]:
+    if tree is None:
+        return np.inf, -1
+    distances, positions = tree.query(xy[np.newaxis], k=1)
+    return distances[0, 0], positions[0, 0]
+
+
+def nearby_stops(
+    index: dict, xy: np.ndarray, radius_meters: float = NEARBY_METERS
+) -> pd.DataFrame:
+    """
+    Bus stops within `radius_meters` of a projected point, nearest first.
+    Resultant df has columns BusStopCode, Description, Distance_m, Services.
+    """
+    positions, distances = index["stop_tree"].query_radius(
+        xy[np.newaxis], r=radius_meters, return_distance=True, sort_results=True
+    )
+    positions, distances = positions[0], distances[0]
+    stop_service_index = index["stop_service_index"]
+    stop_codes = index["stop_codes"][positions]
+    return pd.DataFrame(
+        {
+            "BusStopCode": stop_codes,
+            "Description": index["stop_descriptions"][positions],
+            "Distance_m": np.round(distances, 1),
+            "Services": [
+                ", ".join(get_services_at_stop(stop_service_index, code))
+                for code in stop_codes
+            ],
+        }
+    )
+
+
+def query_location(
+    index: dict,
+    latitude: float,
+    longitude: float,
+    max_distance: float = MAX_CLICK_METERS,
+    radius_meters: float = NEARBY_METERS,
+):
+    """
+    The bus stop or rail station nearest to a clicked point, or None if there
+    is none within `max_distance`. Returns a dict with:
+    - kind: "Bus Stop" or "Rail Station"
+    - code, name, distance_m (from the clicked point)
+    - services: bus services at the stop, or lines at the station
+    - nearby_stops: other bus stops within `radius_meters` of it (see nearby_stops)
+    """
+    xy = project_point(latitude, longitude)
+    stop_distance, stop = _nearest(index["stop_tree"], xy)
+    station_distance, station = _nearest(index["station_tree"], xy)
+    if min(stop_distance, station_distance) > max_distance:
+        return None
+
+    if stop_distance <= station_distance:
+        code = index["stop_codes"][stop]
+        place = {
+            "kind": "Bus Stop",
+            "code": code,
+            "name": index["stop_descriptions"][stop],
+            "distance_m": round(float(stop_distance), 1),
+            "services": get_services_at_stop(index["stop_service_index"], code).tolist(),
+        }
+        place_xy = index["stop_xy"][stop]
+    else:
+        name = index["station_names"][station]
+        # interchanges have one row per line
+        same_station = index["station_names"] == name
+        place = {
+            "kind": "Rail Station",
+            "code": "/".join(index["station_codes"][same_station]),
+            "name": name,
+            "distance_m": round(float(station_distance), 1),
+            "services": list(dict.fromkeys(index["station_lines"][same_station])),
+        }
+        place_xy = index["station_xy"][station]
+
+    stops = nearby_stops(index, place_xy, radius_meters)
+    place["nearby_stops"] = stops[stops["BusStopCode"] != place["code"]].reset_index(
+        drop=True
+    )
+    return place
@@ -0,0 +1,228 @@
+"""
+In-memory caching for the backend core, without Streamlit.
+
+`cache_data` and `cache_resource` mirror Streamlit's decorators: cached data is
+copied for every caller, so callers may modify it, while cached resources
+(indexes, lookup tables) are shared by all callers. Outside Streamlit, results
+are kept in MemoryCache stores, keyed like result_cache.disk_cache by a content
+hash of every argument, including underscore-prefixed ones.
+
+The implementation is pluggable: `use_cache_decorators` swaps in other
+decorators, e.g. `st.cache_data` and `st.cache_resource` in the app (see
+backend). Cached functions are wrapped on their first call, and stay plain
+module-level functions, so they can be pickled by name for worker processes.
+Calls and misses are counted whichever decorators are plugged in (see
+cache_stats).
+"""
+
+import copy
+import functools
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import result_cache
+
+DATA_CACHE_ENTRIES = 256
+STATS_FILE_ENV = "CACHE_STATS_FILE"
+
+
+class MemoryCache:
+    """
+    Cache in a dict, capped at `max_entries` entries (uncapped if None).
+    Least recently used entries are evicted first. Same interface as
+    result_cache.DiskCache.
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Return (True, value) on a hit, or (False, None) on a miss.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+DATA_CACHE = MemoryCache(DATA_CACHE_ENTRIES)
+RESOURCE_CACHE = MemoryCache()
+
+
+def memoize(func, cache: MemoryCache, copy_result: bool = False):
+    """
+    Cache a function's results in `cache`. Concurrent calls with the same
+    arguments wait for the first one instead of computing the result again.
+    """
+    # entries only live as long as the process, so the code cannot change
+    func_name = f"{func.__module__}.{func.__qualname__}"
+    key_locks = {}
+    key_locks_lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = result_cache.content_hash((func_name, args, kwargs))
+        # one lock per key being computed, with the number of callers using it
+        with key_locks_lock:
+            key_lock, users = key_locks.get(key, (None, 0))
+            key_lock = key_lock or threading.Lock()
+            key_locks[key] = (key_lock, users + 1)
+        try:
+            with key_lock:
+                hit, value = cache.get(key)
+                if not hit:
+                    value = func(*args, **kwargs)
+                    cache.set(key, value)
+        finally:
+            with key_locks_lock:
+                users = key_locks[key][1] - 1
+                if users:
+                    key_locks[key] = (key_lock, users)
+                else:
+                    del key_locks[key]
+        return copy.deepcopy(value) if copy_result else value
+
+    return wrapper
+
+
+def _memory_cache_data(func):
+    return memoize(func, DATA_CACHE, copy_result=True)
+
+
+def _memory_cache_resource(func):
+    return memoize(func, RESOURCE_CACHE)
+
+
+_decorators = {"data": _memory_cache_data, "resource": _memory_cache_resource}
+_cached_functions = []
+_stats = {kind: {"calls": 0, "misses": 0} for kind in _decorators}
+_stats_lock = threading.Lock()
+_stats_file_lock = threading.Lock()
+
+
+def _count(kind: str, name: str) -> None:
+    with _stats_lock:
+        _stats[kind][name] += 1
+
+
+def _cached(kind: str, func):
+    cached_func = None
+    lock = threading.Lock()
+
+    # only runs when the plugged-in cache misses
+    @functools.wraps(func)
+    def compute(*args, **kwargs):
+        _count(kind, "misses")
+        return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal cached_func
+        if cached_func is None:
+            with lock:
+                if cached_func is None:
+                    cached_func = _decorators[kind](compute)
+        _count(kind, "calls")
+        return cached_func(*args, **kwargs)
+
+    def reset():
+        nonlocal cached_func
+        with lock:
+            cached_func = None
+
+    _cached_functions.append(reset)
+    return wrapper
+
+
+def cache_data(func):
+    """
+    Cache a function returning data; every caller gets its own copy.
+    """
+    return _cached("data", func)
+
+
+def cache_resource(func):
+    """
+    Cache a function returning a shared resource, e.g. an index.
+    """
+    return _cached("resource", func)
+
+
+def use_cache_decorators(data=None, resource=None) -> None:
+    """
+    Cache the functions decorated with cache_data / cache_resource with the
+    given decorators instead (None for the in-memory default), e.g.
+    `use_cache_decorators(st.cache_data, st.cache_resource)`.
+    """
+    _decorators["data"] = data or _memory_cache_data
+    _decorators["resource"] = resource or _memory_cache_resource
+    for reset in _cached_functions:
+        reset()
+
+
+def cache_stats() -> dict:
+    """
+    Calls and misses of the cache_data / cache_resource functions since the
+    process started, and hits and misses of result_cache's default disk cache.
+    Functions cached with Streamlit's decorators directly are not counted.
+    """
+    with _stats_lock:
+        stats = {
+            f"{kind}_{name}": count
+            for kind, counts in _stats.items()
+            for name, count in counts.items()
+        }
+    stats["disk_hits"] = result_cache.DEFAULT_CACHE.hits
+    stats["disk_misses"] = result_cache.DEFAULT_CACHE.misses
+    return stats
+
+
+def write_cache_stats(path: str = None) -> None:
+    """
+    Write cache_stats() as JSON to `path`, by default the file named by the
+    CACHE_STATS_FILE environment variable (nothing is written if it is unset).
+    The file is replaced atomically, so readers never see a partial write.
+    """
+    path = path or os.environ.get(STATS_FILE_ENV)
+    if not path:
+        return
+    folder = os.path.dirname(os.path.abspath(path))
+    # the latest stats are written last
+    with _stats_file_lock:
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache_stats(), f)
+        os.replace(tmp_path, path)
+
+
+def clear() -> None:
+    """
+    Clear the in-memory caches.
+    """
+    DATA_CACHE.clear()
+    RESOURCE_CACHE.clear()
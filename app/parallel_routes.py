@@ -0,0 +1,910 @@
+"""
+Bus routes running parallel to MRT lines (Parallel_Route.ipynb), with shapely
+array functions instead of per-geometry loops.
+
+Phase 3 of the notebook scores how parallel a bus route is to an MRT line by
+the angle, for every 1 km MRT segment, between the segment and the vector from
+its midpoint to the closest point on the bus route (90 degrees = the route runs
+alongside the segment). Here the midpoints of every segment of every line are
+projected onto every bus route in one call.
+
+Phase 1 (which routes pass within walking distance of each line, and for how
+long) is answered for all routes at once from buffers prepared per radius, so
+different walking distances can be compared cheaply. Phase 2 (how many 1 km
+segments of the line the route crosses, and how many consecutive segments of
+the route cross the line) intersects the segments of all pairs in one call.
+bus_mrt_overlap puts the phases together into the notebook's scored table.
+
+Alternative parallelism metrics (Hausdorff and discrete Fréchet distance,
+shared corridor length) are also computed here for all pairs at once.
+
+Bus routes can be built for both directions of every service. Geometry shared
+by several routes (a service's two directions through the same stops, or
+services sharing stops) is only computed once.
+
+All geometries are expected in a metric CRS (PROJECTED_CRS).
+"""
+
+import warnings
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+PROJECTED_CRS = 32648  # UTM zone 48N, as in the notebook
+SEGMENT_LENGTH = 1000  # metres
+BUFFER_DISTANCE = 500  # metres, walking distance to the MRT line
+BUFFER_RADII = (200, 300, 500, 800)  # metres
+BUFFER_QUAD_SEGS = 16  # segments per quarter circle, as geometry.buffer in the notebook
+FRECHET_SPACING = 200  # metres between points compared
+FRECHET_CUTOFF = 2000  # metres, larger Fréchet distances are not computed
+
+# Weighted_Average_Score in the notebook
+SCORE_WEIGHTS = {
+    "Coverage_Percentage": 0.4,
+    "Consecutive_Coverage_Percentage": 0.4,
+    "Weighted_Average_Angle": 0.2,
+}
+
+
+def build_bus_route_lines(
+    bus_routes: pd.DataFrame, bus_stops: gpd.GeoDataFrame, direction: int = 1
+) -> gpd.GeoDataFrame:
+    """
+    One LineString per bus service and direction through its stops in
+    StopSequence order, for the given direction (as in the notebook), or for
+    both directions if `direction` is None.
+    Resultant gdf has columns ServiceNo, Direction, geometry (in PROJECTED_CRS).
+    """
+    stops = bus_stops[["BUS_STOP_N", "geometry"]].to_crs(PROJECTED_CRS)
+    stops = stops.drop_duplicates("BUS_STOP_N")
+    routes = bus_routes
+    if direction is not None:
+        routes = routes[routes["Direction"] == direction]
+    routes = routes.merge(
+        stops, left_on=routes["BusStopCode"].astype(str), right_on="BUS_STOP_N"
+    ).sort_values(["ServiceNo", "Direction", "StopSequence"])
+
+    coordinates = shapely.get_coordinates(routes["geometry"].values)
+    route_groups = routes.groupby(["ServiceNo", "Direction"], sort=True)
+    route_ids = route_groups.ngroup().to_numpy()
+    counts = route_groups.size()
+
+    # a line needs at least 2 stops
+    has_line = counts.to_numpy() >= 2
+    keep = has_line[route_ids]
+    lines = shapely.linestrings(coordinates[keep], indices=route_ids[keep])
+    route_keys = counts.index[has_line]
+    return gpd.GeoDataFrame(
+        {
+            "ServiceNo": route_keys.get_level_values("ServiceNo"),
+            "Direction": route_keys.get_level_values("Direction").astype(np.int64),
+        },
+        geometry=lines,
+        crs=PROJECTED_CRS,
+    )
+
+
+def build_mrt_lines(rail_line_strings: gpd.GeoDataFrame) -> gpd.GeoSeries:
+    """
+    One geometry per MRT line (the union of its branches), indexed by
+    StationLine, as mrt_linestrings_only in the notebook.
+    """
+    lines = rail_line_strings.to_crs(PROJECTED_CRS)
+    return lines.dissolve(by="StationLine").geometry
+
+
+def _segment_distances(lengths: np.ndarray, distance: float) -> tuple[np.ndarray, np.ndarray]:
+    # start distance of every segment along each line, and the line of each segment
+    counts = np.ceil(lengths / distance).astype(np.int64)
+    line_ids = np.repeat(np.arange(len(lengths)), counts)
+    offsets = np.cumsum(counts) - counts
+    starts = (np.arange(counts.sum()) - offsets[line_ids]) * distance
+    return starts, line_ids
+
+
+def segment_endpoints(
+    lines: np.ndarray, distance: float = SEGMENT_LENGTH
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Start and end coordinates of the `distance`-long segments of each line
+    (the last one may be shorter), as (num_segments, 2) arrays, with the line
+    of each segment.
+    """
+    lines = np.asarray(lines, dtype=object)
+    lengths = shapely.length(lines)
+    starts, line_ids = _segment_distances(lengths, distance)
+    ends = np.minimum(starts + distance, lengths[line_ids])
+
+    start_points = shapely.line_interpolate_point(lines[line_ids], starts)
+    end_points = shapely.line_interpolate_point(lines[line_ids], ends)
+    return (
+        shapely.get_coordinates(start_points),
+        shapely.get_coordinates(end_points),
+        line_ids,
+    )
+
+
+def segment_line_by_distance(line, distance: float = SEGMENT_LENGTH) -> np.ndarray:
+    """
+    Split a line into straight `distance`-long segments between points along it,
+    as segment_line_by_distance in the notebook.
+    """
+    start_xy, end_xy, _ = segment_endpoints(np.array([line], dtype=object), distance)
+    return shapely.linestrings(np.stack([start_xy, end_xy], axis=1))
+
+
+def _pair_columns(pairs: pd.DataFrame) -> list[str]:
+    # pairs name a direction when the bus lines have several per service
+    return ["MRT_Line", "Bus_ServiceNo"] + (
+        ["Bus_Direction"] if "Bus_Direction" in pairs else []
+    )
+
+
+def _pair_codes(
+    pairs: pd.DataFrame, bus_lines: gpd.GeoDataFrame, mrt_lines: gpd.GeoSeries
+) -> tuple[np.ndarray, np.ndarray]:
+    # positions of each pair's bus route and MRT line
+    if "Bus_Direction" in pairs:
+        service_ids = pd.MultiIndex.from_arrays(
+            [bus_lines["ServiceNo"], bus_lines["Direction"]]
+        ).get_indexer(
+            pd.MultiIndex.from_arrays([pairs["Bus_ServiceNo"], pairs["Bus_Direction"]])
+        )
+    elif bus_lines["ServiceNo"].is_unique:
+        service_ids = pd.Index(bus_lines["ServiceNo"]).get_indexer(pairs["Bus_ServiceNo"])
+    else:
+        raise ValueError("Bus lines have several directions, pairs need a Bus_Direction")
+    line_ids = pd.Index(mrt_lines.index).get_indexer(pairs["MRT_Line"])
+    if (service_ids < 0).any() or (line_ids < 0).any():
+        raise ValueError("Pairs refer to unknown bus services or MRT lines")
+    return service_ids, line_ids
+
+
+def all_pairs(bus_lines: gpd.GeoDataFrame, mrt_lines: gpd.GeoSeries) -> pd.DataFrame:
+    """
+    Every (MRT_Line, Bus_ServiceNo, Bus_Direction) pair, without Bus_Direction
+    if the bus lines have none.
+    """
+    pairs = pd.DataFrame(
+        {
+            "MRT_Line": np.repeat(np.asarray(mrt_lines.index), len(bus_lines)),
+            "Bus_ServiceNo": np.tile(bus_lines["ServiceNo"].to_numpy(), len(mrt_lines)),
+        }
+    )
+    if "Direction" in bus_lines:
+        pairs["Bus_Direction"] = np.tile(
+            bus_lines["Direction"].to_numpy(), len(mrt_lines)
+        )
+    return pairs
+
+
+## Shared geometry between routes
+#
+# The two directions of a service, and different services, often run through
+# the same stops. Geometry they share is computed once: additive quantities
+# (overlap lengths) per unique stop-to-stop hop, and whole-route metrics per
+# unique route, a route and its reverse being the same.
+
+
+def _unique_rows(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # first row of each distinct row, and the distinct row of every row
+    # (np.unique with axis=0 sorts rows as bytes, which is much slower)
+    order = np.lexsort(values.T[::-1])
+    sorted_values = values[order]
+    is_new = np.ones(len(values), dtype=bool)
+    is_new[1:] = np.any(sorted_values[1:] != sorted_values[:-1], axis=1)
+    inverse = np.empty(len(values), dtype=np.int64)
+    inverse[order] = np.cumsum(is_new) - 1
+    return order[is_new], inverse
+
+
+def _pair_keys(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # one int64 per pair of non-negative integers
+    return a.astype(np.int64) * (int(b.max(initial=0)) + 1) + b
+
+
+def route_hops(routes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The straight stop-to-stop hops of every route, deduplicated (a hop and its
+    reverse are the same hop). Returns the unique hops as 2-point LineStrings,
+    and the unique hop and the route of every hop of every route.
+    """
+    parts, part_routes = shapely.get_parts(
+        np.asarray(routes, dtype=object), return_index=True
+    )
+    xy, vertex_parts = shapely.get_coordinates(parts, return_index=True)
+    same_part = vertex_parts[1:] == vertex_parts[:-1]
+    starts, ends = xy[:-1][same_part], xy[1:][same_part]
+    hop_routes = part_routes[vertex_parts[1:][same_part]]
+
+    # undirected: the lexicographically smaller endpoint first
+    swap = (starts[:, 0] > ends[:, 0]) | (
+        (starts[:, 0] == ends[:, 0]) & (starts[:, 1] > ends[:, 1])
+    )
+    keys = np.hstack(
+        [np.where(swap[:, None], ends, starts), np.where(swap[:, None], starts, ends)]
+    )
+    first, hop_ids = _unique_rows(keys)
+    hops = shapely.linestrings(keys[first].reshape(-1, 2, 2))
+    return hops, hop_ids, hop_routes
+
+
+def unique_routes(routes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Positions of the distinct routes (a route and its reverse being the same),
+    and the distinct route of every route.
+    """
+    xy, route_ids = shapely.get_coordinates(
+        np.asarray(routes, dtype=object), return_index=True
+    )
+    bounds = np.searchsorted(route_ids, np.arange(len(routes) + 1))
+    keys = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        forward = xy[start:end]
+        keys.append(min(forward.tobytes(), forward[::-1].tobytes()))
+    _, first, inverse = np.unique(
+        np.array(keys, dtype=object), return_index=True, return_inverse=True
+    )
+    return first, inverse.ravel()
+
+
+def _unique_pairs(
+    service_ids: np.ndarray, line_ids: np.ndarray, routes: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (distinct route, line) pairs: one route position and line per distinct
+    # pair, and the distinct pair of every pair
+    _, route_keys = unique_routes(routes)
+    _, pair_first, pair_inverse = np.unique(
+        _pair_keys(route_keys[service_ids], line_ids),
+        return_index=True,
+        return_inverse=True,
+    )
+    return service_ids[pair_first], line_ids[pair_first], pair_inverse
+
+
+def _repeat_rows(counts: np.ndarray, selection: np.ndarray) -> np.ndarray:
+    # rows of the selected groups, for groups of `counts` consecutive rows
+    offsets = np.cumsum(counts) - counts
+    selected_counts = counts[selection]
+    return (
+        np.repeat(offsets[selection], selected_counts)
+        + np.arange(selected_counts.sum())
+        - np.repeat(np.cumsum(selected_counts) - selected_counts, selected_counts)
+    )
+
+
+## Phase 1: overlap with MRT line buffers
+
+
+class BufferCache:
+    """
+    Buffers around every MRT line, built and prepared once per radius, for
+    bulk intersection and overlap-length queries against many bus routes.
+    """
+
+    def __init__(self, mrt_lines: gpd.GeoSeries, radii=BUFFER_RADII):
+        self.line_names = np.asarray(mrt_lines.index)
+        self.lines = shapely.make_valid(np.asarray(mrt_lines.values, dtype=object))
+        self.buffers = {}
+        for radius in radii:
+            self.get(radius)
+
+    def get(self, radius: float) -> np.ndarray:
+        """
+        Prepared buffers of all lines for a radius, built on first use.
+        """
+        if radius not in self.buffers:
+            print(f"Buffering MRT lines by {radius} m...")
+            buffers = shapely.buffer(self.lines, radius, quad_segs=BUFFER_QUAD_SEGS)
+            shapely.prepare(buffers)
+            self.buffers[radius] = buffers
+        return self.buffers[radius]
+
+    def intersecting_pairs(
+        self, routes: np.ndarray, radius: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (line, route) positions of every route intersecting a line's buffer.
+        """
+        tree = shapely.STRtree(routes)
+        line_ids, route_ids = tree.query(self.get(radius), predicate="intersects")
+        return line_ids, route_ids
+
+    def overlap_lengths(
+        self, routes: np.ndarray, line_ids: np.ndarray, radius: float
+    ) -> np.ndarray:
+        """
+        Length of each route within the buffer of the matching line
+        (0 if they do not intersect), summed over the route's hops so that
+        hops shared by several routes (or pairs) are intersected once.
+        """
+        hops, hop_ids, hop_routes = route_hops(routes)
+        # a hop travelled twice by a route counts once, as in the intersection
+        # of the whole route
+        _, first = np.unique(_pair_keys(hop_routes, hop_ids), return_index=True)
+        hop_routes, hop_ids = hop_routes[first], hop_ids[first]
+        hop_lines = line_ids[hop_routes]
+        _, first, hop_pair_ids = np.unique(
+            _pair_keys(hop_ids, hop_lines), return_index=True, return_inverse=True
+        )
+        hop_lengths = self.hop_overlap_lengths(
+            hops[hop_ids[first]], hop_lines[first], radius
+        )
+        return np.bincount(
+            hop_routes, weights=hop_lengths[hop_pair_ids], minlength=len(routes)
+        )
+
+    def hop_overlap_lengths(
+        self, hops: np.ndarray, line_ids: np.ndarray, radius: float
+    ) -> np.ndarray:
+        """
+        Length of each straight hop within the buffer of the matching line.
+        Hops entirely within the buffer need no intersection.
+        """
+        buffers = self.get(radius)[line_ids]
+        lengths = np.zeros(len(hops))
+        inside = shapely.contains_properly(buffers, hops)
+        lengths[inside] = shapely.length(hops[inside])
+        crossing = ~inside & shapely.intersects(buffers, hops)
+        lengths[crossing] = shapely.length(
+            shapely.intersection(hops[crossing], buffers[crossing])
+        )
+        return lengths
+
+    def overlaps(self, bus_lines: gpd.GeoDataFrame, radius: float) -> pd.DataFrame:
+        """
+        Every bus route intersecting an MRT line's buffer, with the length of the
+        route within it (overlap_df in the notebook).
+        Resultant df has columns MRT_Line, Bus_ServiceNo, Bus_Direction (if the
+        bus lines have a Direction), Bus_Route_Length_m, Overlap_Length_m.
+        """
+        routes = bus_lines.geometry.values
+        line_ids, route_ids = self.intersecting_pairs(routes, radius)
+        overlaps = pd.DataFrame(
+            {
+                "MRT_Line": self.line_names[line_ids],
+                "Bus_ServiceNo": bus_lines["ServiceNo"].to_numpy()[route_ids],
+            }
+        )
+        if "Direction" in bus_lines:
+            overlaps["Bus_Direction"] = bus_lines["Direction"].to_numpy()[route_ids]
+        overlaps["Bus_Route_Length_m"] = shapely.length(routes[route_ids])
+        overlaps["Overlap_Length_m"] = self.overlap_lengths(
+            routes[route_ids], line_ids, radius
+        )
+        return overlaps
+
+    def overlaps_by_radius(
+        self, bus_lines: gpd.GeoDataFrame, radii=BUFFER_RADII
+    ) -> pd.DataFrame:
+        """
+        overlaps for each radius, with a Radius_m column.
+        """
+        return pd.concat(
+            [
+                self.overlaps(bus_lines, radius).assign(Radius_m=radius)
+                for radius in radii
+            ],
+            ignore_index=True,
+        )
+
+
+def best_overlaps(overlaps: pd.DataFrame) -> pd.DataFrame:
+    """
+    The MRT line each bus service (and direction, if given) overlaps the most
+    (overlap_df_unique in the notebook), longest overlap first. Per radius if
+    there is a Radius_m column.
+    """
+    radius = ["Radius_m"] if "Radius_m" in overlaps else []
+    route = _pair_columns(overlaps)[1:]
+    return (
+        overlaps.sort_values(
+            radius + ["Overlap_Length_m"],
+            ascending=[True] * len(radius) + [False],
+            kind="stable",
+        )
+        .drop_duplicates(radius + route, keep="first")
+        .reset_index(drop=True)
+    )
+
+
+## Phase 2: segment coverage
+
+
+def _segment_hits(
+    segment_owners: np.ndarray,
+    owner_ids: np.ndarray,
+    others: np.ndarray,
+    segment_length: float,
+    owner_geometries: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # whether each `segment_length` segment of geometry `owner_ids[i]`
+    # intersects `others[i]`, for every pair i, in order along the geometry;
+    # with the pair of each segment and the number of segments of each pair
+    start_xy, end_xy, segment_owner_ids = segment_endpoints(
+        owner_geometries[segment_owners], segment_length
+    )
+    segment_counts = np.bincount(segment_owner_ids, minlength=len(segment_owners))
+    rows = _repeat_rows(segment_counts, owner_ids)
+    counts = segment_counts[owner_ids]
+    pair_ids = np.repeat(np.arange(len(owner_ids)), counts)
+    segments = shapely.linestrings(np.stack([start_xy[rows], end_xy[rows]], axis=1))
+    shapely.prepare(others)
+    return shapely.intersects(others[pair_ids], segments), pair_ids, counts
+
+
+def _longest_runs(hits: np.ndarray, pair_ids: np.ndarray, num_pairs: int) -> np.ndarray:
+    # longest run of consecutive hits of each pair, for segments grouped by pair
+    pair_start = np.ones(len(hits), dtype=bool)
+    pair_start[1:] = pair_ids[1:] != pair_ids[:-1]
+    # a run starts at a miss or at the first segment of a pair
+    run_ids = np.cumsum(~hits | pair_start) - 1
+    run_lengths = np.bincount(run_ids, weights=hits)
+    longest = np.zeros(num_pairs)
+    np.maximum.at(longest, pair_ids[pair_start | ~hits], run_lengths)
+    return longest.astype(np.int64)
+
+
+def segment_coverage(
+    bus_lines: gpd.GeoDataFrame,
+    mrt_lines: gpd.GeoSeries,
+    pairs: pd.DataFrame = None,
+    segment_length: float = SEGMENT_LENGTH,
+) -> pd.DataFrame:
+    """
+    Phase 2 of the notebook for every (MRT_Line, Bus_ServiceNo) pair (all pairs
+    if not given), from straight `segment_length` segments of the MRT line and
+    of the bus route, as segment_line_by_distance.
+    Resultant df has these columns:
+    - MRT_Line, Bus_ServiceNo, Bus_Direction (if the pairs have it)
+    - Coverage_Percentage: of the MRT line's segments the bus route intersects
+    - Intersecting_Segments_Percentage: of the bus route's segments that
+      intersect the MRT line
+    - Max_Consecutive_Segments: longest run of such bus route segments
+    - Consecutive_Coverage_Percentage: Max_Consecutive_Segments as a
+      percentage of the bus route's segments
+    """
+    if pairs is None:
+        pairs = all_pairs(bus_lines, mrt_lines)
+    pairs = pairs[_pair_columns(pairs)].reset_index(drop=True)
+    service_ids, line_ids = _pair_codes(pairs, bus_lines, mrt_lines)
+    bus_geometries = shapely.make_valid(bus_lines.geometry.values)
+    mrt_geometries = shapely.make_valid(np.asarray(mrt_lines.values, dtype=object))
+
+    # 2.1: MRT line segments crossed by the route, which does not depend on
+    # the direction of the route
+    pair_service_ids, pair_line_ids, pair_keys = _unique_pairs(
+        service_ids, line_ids, bus_geometries
+    )
+    used_lines, line_positions = np.unique(pair_line_ids, return_inverse=True)
+    hits, hit_pairs, counts = _segment_hits(
+        used_lines,
+        line_positions.ravel(),
+        bus_geometries[pair_service_ids],
+        segment_length,
+        mrt_geometries,
+    )
+    crossed = np.bincount(hit_pairs, weights=hits, minlength=len(counts))
+
+    # 2.2: bus route segments crossing the line, which are cut from the
+    # route's first stop
+    used_routes, route_positions = np.unique(service_ids, return_inverse=True)
+    route_hits, route_hit_pairs, route_counts = _segment_hits(
+        used_routes,
+        route_positions.ravel(),
+        mrt_geometries[line_ids],
+        segment_length,
+        bus_geometries,
+    )
+    intersecting = np.bincount(
+        route_hit_pairs, weights=route_hits, minlength=len(pairs)
+    )
+    longest = _longest_runs(route_hits, route_hit_pairs, len(pairs))
+
+    def percentage(values, totals):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(totals > 0, values / totals * 100, 0)
+
+    coverage = pairs.copy()
+    coverage["Coverage_Percentage"] = percentage(crossed, counts)[pair_keys]
+    coverage["Intersecting_Segments_Percentage"] = percentage(
+        intersecting, route_counts
+    )
+    coverage["Max_Consecutive_Segments"] = longest
+    coverage["Consecutive_Coverage_Percentage"] = percentage(longest, route_counts)
+    return coverage
+
+
+def bus_mrt_overlap(
+    overlaps: pd.DataFrame,
+    coverage: pd.DataFrame,
+    angles: pd.DataFrame,
+    similarity: pd.DataFrame = None,
+    radius: float = BUFFER_DISTANCE,
+) -> pd.DataFrame:
+    """
+    The notebook's result (BusMRTOverlap.csv): for each bus service, the MRT
+    line (and direction) it overlaps the most within `radius`, if the route
+    crosses any of the line's segments, with its Phase 1 to 3 metrics (and
+    similarity metrics if given) and Weighted_Average_Score, highest first.
+    """
+    if "Radius_m" in overlaps:
+        overlaps = overlaps[overlaps["Radius_m"] == radius].drop(columns="Radius_m")
+    # one route per service, as the notebook's routes of direction 1
+    best = overlaps.sort_values(
+        "Overlap_Length_m", ascending=False, kind="stable"
+    ).drop_duplicates("Bus_ServiceNo")
+    keys = _pair_columns(best)
+    table = best.merge(
+        coverage.drop(columns="Intersecting_Segments_Percentage"), on=keys
+    )
+    table = table[table["Coverage_Percentage"] > 0]
+    table = table.merge(
+        angles[keys + ["Weighted_Average_Angle"]], on=keys, how="left"
+    )
+    if similarity is not None:
+        table = table.merge(similarity, on=keys, how="left")
+    table["Weighted_Average_Score"] = parallelism_score(table)
+    return table.sort_values(
+        "Weighted_Average_Score", ascending=False, kind="stable"
+    ).reset_index(drop=True)
+
+
+## Phase 3: angular deviation
+
+
+def _segment_angles(
+    bus_lines: gpd.GeoDataFrame,
+    mrt_lines: gpd.GeoSeries,
+    pairs: pd.DataFrame,
+    segment_length: float,
+) -> dict:
+    service_ids, line_ids = _pair_codes(pairs, bus_lines, mrt_lines)
+
+    bus_geometries = shapely.make_valid(bus_lines.geometry.values)
+    mrt_geometries = shapely.make_valid(np.asarray(mrt_lines.values, dtype=object))
+
+    # angles ignore the direction of the route, so identical routes (and
+    # reversed ones) share them
+    service_ids, line_ids, pair_keys = _unique_pairs(
+        service_ids, line_ids, bus_geometries
+    )
+
+    # segments of every MRT line, grouped by line
+    start_xy, end_xy, segment_line_ids = segment_endpoints(
+        mrt_geometries, segment_length
+    )
+    segment_counts = np.bincount(segment_line_ids, minlength=len(mrt_geometries))
+
+    # every segment of the pair's line, for every distinct pair
+    counts = segment_counts[line_ids]
+    unique_pair_ids = np.repeat(np.arange(len(line_ids)), counts)
+    segments = _repeat_rows(segment_counts, line_ids)
+    segment_positions = segments - (np.cumsum(segment_counts) - segment_counts)[
+        line_ids
+    ][unique_pair_ids]
+
+    midpoint_xy = (start_xy[segments] + end_xy[segments]) / 2
+    routes = bus_geometries[service_ids][unique_pair_ids]
+    with warnings.catch_warnings():
+        # routes that cannot be projected onto give NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        closest = shapely.line_interpolate_point(
+            routes, shapely.line_locate_point(routes, shapely.points(midpoint_xy))
+        )
+    # empty points (failed projections) have no coordinates
+    closest_xy = np.full((len(closest), 2), np.nan)
+    has_point = ~shapely.is_empty(closest)
+    closest_xy[has_point] = shapely.get_coordinates(closest[has_point])
+
+    mrt_vectors = end_xy[segments] - start_xy[segments]
+    bus_vectors = closest_xy - midpoint_xy
+    mrt_norms = np.linalg.norm(mrt_vectors, axis=1)
+    bus_norms = np.linalg.norm(bus_vectors, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cosines = np.einsum("ij,ij->i", mrt_vectors, bus_vectors) / (
+            mrt_norms * bus_norms
+        )
+        angles = np.degrees(np.arccos(np.abs(np.clip(cosines, -1.0, 1.0))))
+    # degenerate vectors (midpoint on the route, zero-length segment) have no angle
+    angles[(mrt_norms == 0) | (bus_norms == 0)] = np.nan
+
+    # back to every pair
+    rows = _repeat_rows(counts, pair_keys)
+    return {
+        "pair_ids": np.repeat(np.arange(len(pair_keys)), counts[pair_keys]),
+        "segments": segment_positions[rows],
+        "lengths": mrt_norms[rows],
+        "distances": bus_norms[rows],
+        "angles": angles[rows],
+    }
+
+
+def segment_angles(
+    bus_lines: gpd.GeoDataFrame,
+    mrt_lines: gpd.GeoSeries,
+    pairs: pd.DataFrame = None,
+    segment_length: float = SEGMENT_LENGTH,
+) -> pd.DataFrame:
+    """
+    Angle between every 1 km MRT segment and the vector from its midpoint to the
+    closest point on the bus route, for every (MRT_Line, Bus_ServiceNo) pair
+    (all pairs if not given).
+    Resultant df has one row per pair and segment, with these columns:
+    - MRT_Line, Bus_ServiceNo, Bus_Direction (if the pairs have it)
+    - Segment (position along the MRT line)
+    - Segment_Length_m, Distance_m (from the midpoint to the bus route)
+    - Angle: in degrees, ignoring direction; NaN if the midpoint lies on the
+      bus route or cannot be projected onto it
+    """
+    if pairs is None:
+        pairs = all_pairs(bus_lines, mrt_lines)
+    angles = _segment_angles(bus_lines, mrt_lines, pairs, segment_length)
+    pair_ids = angles["pair_ids"]
+    return pd.DataFrame(
+        {
+            **{
+                column: pairs[column].to_numpy()[pair_ids]
+                for column in _pair_columns(pairs)
+            },
+            "Segment": angles["segments"],
+            "Segment_Length_m": angles["lengths"],
+            "Distance_m": angles["distances"],
+            "Angle": angles["angles"],
+        }
+    )
+
+
+def weighted_average_angles(
+    bus_lines: gpd.GeoDataFrame,
+    mrt_lines: gpd.GeoSeries,
+    pairs: pd.DataFrame = None,
+    segment_length: float = SEGMENT_LENGTH,
+) -> pd.DataFrame:
+    """
+    Segment-length-weighted average angle (Phase 3 of the notebook) for every
+    (MRT_Line, Bus_ServiceNo) pair (all pairs if not given). Segments without
+    an angle are skipped.
+    Resultant df has the pair columns and Weighted_Average_Angle.
+    """
+    if pairs is None:
+        pairs = all_pairs(bus_lines, mrt_lines)
+    pairs = pairs[_pair_columns(pairs)].reset_index(drop=True)
+    angles = _segment_angles(bus_lines, mrt_lines, pairs, segment_length)
+
+    has_angle = ~np.isnan(angles["angles"])
+    weights = np.where(has_angle, angles["lengths"], 0)
+    weighted_sum = np.bincount(
+        angles["pair_ids"],
+        weights=np.where(has_angle, angles["angles"], 0) * weights,
+        minlength=len(pairs),
+    )
+    total_weight = np.bincount(angles["pair_ids"], weights=weights, minlength=len(pairs))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = np.where(total_weight > 0, weighted_sum / total_weight, 0)
+
+    weighted_angles = pairs.copy()
+    weighted_angles["Weighted_Average_Angle"] = np.round(average, 1)
+    return weighted_angles
+
+
+## Similarity metrics
+
+
+def _line_parts(mrt_lines: gpd.GeoSeries) -> tuple[np.ndarray, np.ndarray]:
+    # continuous parts of every MRT line (branches, split at junctions)
+    merged = shapely.line_merge(
+        shapely.make_valid(np.asarray(mrt_lines.values, dtype=object))
+    )
+    parts, line_ids = shapely.get_parts(merged, return_index=True)
+    is_line = shapely.get_type_id(parts) == shapely.GeometryType.LINESTRING
+    return parts[is_line], line_ids[is_line]
+
+
+def _spanned_sublines(
+    routes: np.ndarray, parts: np.ndarray, part_ids: np.ndarray
+) -> np.ndarray:
+    """
+    The stretch of MRT line part `part_ids[i]` between the projections of the
+    first and last vertex of `routes[i]`, oriented in the route's direction.
+    """
+    if len(part_ids) == 0:
+        return np.empty(0, dtype=object)
+    pair_parts = parts[part_ids]
+    starts = shapely.line_locate_point(pair_parts, shapely.get_point(routes, 0))
+    ends = shapely.line_locate_point(pair_parts, shapely.get_point(routes, -1))
+    low = np.minimum(starts, ends)
+    high = np.maximum(starts, ends)
+    low_xy = shapely.get_coordinates(shapely.line_interpolate_point(pair_parts, low))
+    high_xy = shapely.get_coordinates(shapely.line_interpolate_point(pair_parts, high))
+
+    # vertices of every part, with their distance along it
+    part_xy, part_vertex_ids = shapely.get_coordinates(parts, return_index=True)
+    steps = np.linalg.norm(np.diff(part_xy, axis=0), axis=1)
+    steps = np.concatenate([[0], np.where(np.diff(part_vertex_ids) == 0, steps, 0)])
+    part_starts = np.searchsorted(part_vertex_ids, np.arange(len(parts)))
+    cumulative = np.cumsum(steps)
+    vertex_distances = cumulative - cumulative[part_starts][part_vertex_ids]
+    part_ends = np.append(part_starts[1:], len(part_xy))
+
+    coordinates = []
+    indices = []
+    for i, part in enumerate(part_ids):
+        vertices = slice(part_starts[part], part_ends[part])
+        distances = vertex_distances[vertices]
+        inner = part_xy[vertices][(distances > low[i]) & (distances < high[i])]
+        subline_xy = np.vstack([low_xy[i : i + 1], inner, high_xy[i : i + 1]])
+        if starts[i] > ends[i]:
+            subline_xy = subline_xy[::-1]
+        coordinates.append(subline_xy)
+        indices.append(np.full(len(subline_xy), i))
+    return shapely.linestrings(np.vstack(coordinates), indices=np.concatenate(indices))
+
+
+def discrete_frechet_distance(
+    p: np.ndarray, q: np.ndarray, cutoff: float = np.inf
+) -> float:
+    """
+    Discrete Fréchet distance between two sequences of points, (n, 2) and (m, 2).
+    The coupling table is filled one anti-diagonal at a time. Every coupling
+    passes through one of any two consecutive anti-diagonals, so once both
+    exceed `cutoff` the distance is known to exceed it and inf is returned.
+    """
+    n, m = len(p), len(q)
+    previous = previous_2 = np.empty(0)
+    previous_low = previous_2_low = 0
+
+    def lookup(values, low, i):
+        # values of a diagonal starting at row `low`, inf outside of it
+        position = i - low
+        valid = (position >= 0) & (position < len(values))
+        result = np.full(len(i), np.inf)
+        result[valid] = values[position[valid]]
+        return result
+
+    for k in range(n + m - 1):
+        low = max(0, k - m + 1)
+        i = np.arange(low, min(k, n - 1) + 1)
+        distances = np.hypot(*(p[i] - q[k - i]).T)
+        if k == 0:
+            current = distances
+        else:
+            best = np.minimum(
+                np.minimum(
+                    lookup(previous, previous_low, i - 1),  # (i - 1, j)
+                    lookup(previous, previous_low, i),  # (i, j - 1)
+                ),
+                lookup(previous_2, previous_2_low, i - 1),  # (i - 1, j - 1)
+            )
+            current = np.maximum(distances, best)
+            if min(current.min(), previous.min()) > cutoff:
+                return np.inf
+        previous_2, previous_2_low = previous, previous_low
+        previous, previous_low = current, low
+    return float(current[-1])
+
+
+def _densify(lines: np.ndarray, spacing: float) -> np.ndarray:
+    # zero-length lines (e.g. a route crossing the MRT line) cannot be segmentized
+    lines = lines.copy()
+    has_length = shapely.length(lines) > 0
+    lines[has_length] = shapely.segmentize(lines[has_length], spacing)
+    return lines
+
+
+def similarity_metrics(
+    bus_lines: gpd.GeoDataFrame,
+    mrt_lines: gpd.GeoSeries,
+    pairs: pd.DataFrame = None,
+    radius: float = BUFFER_DISTANCE,
+    spacing: float = FRECHET_SPACING,
+    frechet_cutoff: float = FRECHET_CUTOFF,
+    buffers: BufferCache = None,
+) -> pd.DataFrame:
+    """
+    Similarity of every bus route to every MRT line, for every
+    (MRT_Line, Bus_ServiceNo) pair (all pairs if not given).
+    The route is compared with the stretch of the MRT line it spans (between the
+    projections of its first and last stop), on the closest branch of the line.
+    Resultant df has these columns:
+    - MRT_Line, Bus_ServiceNo, Bus_Direction (if the pairs have it)
+    - Hausdorff_Distance_m
+    - Frechet_Distance_m: discrete, on points `spacing` apart; inf if above
+      `frechet_cutoff`
+    - Shared_Corridor_m: length of the route within `radius` of the line
+      (buffers from `buffers` if given)
+    - Shared_Corridor_Percentage: of the route length
+    """
+    if pairs is None:
+        pairs = all_pairs(bus_lines, mrt_lines)
+    pairs = pairs[_pair_columns(pairs)].reset_index(drop=True)
+    service_ids, line_ids = _pair_codes(pairs, bus_lines, mrt_lines)
+    bus_geometries = shapely.make_valid(bus_lines.geometry.values)
+
+    # the metrics do not depend on the direction of the route, so identical
+    # routes (and reversed ones) share them
+    service_ids, line_ids, pair_keys = _unique_pairs(
+        service_ids, line_ids, bus_geometries
+    )
+    num_pairs = len(line_ids)
+
+    # compare each pair's route with every part of its line
+    parts, part_line_ids = _line_parts(mrt_lines)
+    part_order = np.argsort(part_line_ids, kind="stable")
+    part_counts = np.bincount(part_line_ids, minlength=len(mrt_lines))
+    part_offsets = np.cumsum(part_counts) - part_counts
+    counts = part_counts[line_ids]
+    pair_ids = np.repeat(np.arange(num_pairs), counts)
+    pair_parts = part_order[
+        np.repeat(part_offsets[line_ids], counts)
+        + np.arange(counts.sum())
+        - np.repeat(np.cumsum(counts) - counts, counts)
+    ]
+
+    routes = bus_geometries[service_ids][pair_ids]
+    sublines = _spanned_sublines(routes, parts, pair_parts)
+    hausdorff = shapely.hausdorff_distance(routes, sublines)
+
+    # closest part of the line for each pair
+    order = np.lexsort((hausdorff, pair_ids))
+    first = np.unique(pair_ids[order], return_index=True)[1]
+    closest = order[first]
+
+    hausdorff_distances = np.full(num_pairs, np.inf)
+    hausdorff_distances[pair_ids[closest]] = hausdorff[closest]
+
+    # Fréchet distance is at least the Hausdorff distance, so only pairs within
+    # the cutoff need the full computation
+    frechet_distances = np.full(num_pairs, np.inf)
+    route_points = _densify(routes[closest], spacing)
+    subline_points = _densify(sublines[closest], spacing)
+    for pair, route, subline, distance in zip(
+        pair_ids[closest], route_points, subline_points, hausdorff[closest]
+    ):
+        if distance > frechet_cutoff:
+            continue
+        frechet_distances[pair] = discrete_frechet_distance(
+            shapely.get_coordinates(route),
+            shapely.get_coordinates(subline),
+            frechet_cutoff,
+        )
+
+    if buffers is None:
+        buffers = BufferCache(mrt_lines, radii=[])
+    shared_lengths = buffers.overlap_lengths(
+        bus_geometries[service_ids], line_ids, radius
+    )
+    route_lengths = shapely.length(bus_geometries[service_ids])
+
+    metrics = pairs.copy()
+    metrics["Hausdorff_Distance_m"] = hausdorff_distances[pair_keys]
+    metrics["Frechet_Distance_m"] = frechet_distances[pair_keys]
+    metrics["Shared_Corridor_m"] = shared_lengths[pair_keys]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        metrics["Shared_Corridor_Percentage"] = np.where(
+            route_lengths > 0, shared_lengths / route_lengths * 100, 0
+        )[pair_keys]
+    return metrics
+
+
+def distance_score(distances: np.ndarray, max_distance: float) -> np.ndarray:
+    """
+    Distance as a 0-100 score (100 = identical, 0 = `max_distance` apart or more),
+    to weigh it with the percentage metrics.
+    """
+    return np.clip(1 - np.asarray(distances) / max_distance, 0, 1) * 100
+
+
+def parallelism_score(
+    metrics: pd.DataFrame, weights: dict = SCORE_WEIGHTS
+) -> pd.Series:
+    """
+    Weighted sum of metric columns. The default weights give the notebook's
+    Weighted_Average_Score from the columns of segment_coverage and
+    weighted_average_angles (as in bus_mrt_overlap); similarity metrics (e.g.
+    Shared_Corridor_Percentage, or distance_score of Frechet_Distance_m) can be
+    added to the weights.
+    """
+    return sum(metrics[column] * weight for column, weight in weights.items())
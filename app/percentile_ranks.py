@@ -0,0 +1,232 @@
+"""
+Percentile-rank representation of estimated ridership.
+
+The low-ridership analysis compares each service stop's estimated tap in/out
+with the network-wide 25th percentile for that hour and day type. Instead of
+storing one percentile, the rank table stores where each estimate falls in the
+network distribution, so that any percentile cut-off and hour window becomes a
+vectorized comparison:
+
+    estimate < np.percentile(network, q)  <=>  rank < q
+"""
+
+import numpy as np
+import pandas as pd
+
+GROUP_COLUMNS = ["TIME_PER_HOUR", "DAY_TYPE"]
+HOUR_WINDOW = (6, 22)  # inclusive, i.e. 5 < TIME_PER_HOUR < 23
+
+
+def estimate_route_ridership(
+    bus_route_trips: pd.DataFrame, ridership: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Estimated tap in and tap out of every service at every stop and hour,
+    based on the service's estimated share of trips at that stop.
+    """
+    route_ridership = bus_route_trips.merge(
+        ridership,
+        on=["Destination_Stop", "PT_TYPE", "TIME_PER_HOUR", "DAY_TYPE"],
+        how="left",
+    )
+    trip_share = route_ridership["Adj_Estimated_Trips"] / route_ridership["TOTAL_TRIPS"]
+    route_ridership["Estimated_Tap_In"] = (
+        trip_share * route_ridership["TOTAL_TAP_IN_VOLUME"]
+    )
+    route_ridership["Estimated_Tap_Out"] = (
+        trip_share * route_ridership["TOTAL_TAP_OUT_VOLUME"]
+    )
+    return route_ridership
+
+
+def percentile_rank(values: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """
+    Percentile rank of each value in the reference distribution, defined as the
+    inverse of np.percentile (linear interpolation), so that for any q:
+    values < np.percentile(reference, q)  <=>  percentile_rank(values, reference) < q
+    Values below the minimum get -inf, values at or above the maximum get 100,
+    and NaN values stay NaN.
+    """
+    reference = np.sort(reference[~np.isnan(reference)])
+    ranks = np.full(len(values), np.nan)
+    if len(reference) == 0:
+        return ranks
+
+    # number of reference values <= each value
+    num_below = np.searchsorted(reference, values, side="right")
+    last = len(reference) - 1
+    lower = np.clip(num_below - 1, 0, last)
+    upper = np.clip(num_below, 0, last)
+    gap = reference[upper] - reference[lower]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(gap > 0, (values - reference[lower]) / gap, 0.0)
+    position = lower + fraction
+
+    ranks = np.where(num_below > last, 100.0, position / max(last, 1) * 100)
+    ranks = np.where(num_below == 0, -np.inf, ranks)
+    return np.where(np.isnan(values), np.nan, ranks)
+
+
+def build_percentile_rank_table(
+    bus_route_trips: pd.DataFrame, ridership: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Rank every service stop's estimated tap in/out against the network-wide
+    distribution of tap in/out (aggregated_ridership) for the same hour and day type.
+    Resultant df has these columns:
+    - ServiceNo, Direction (if bus_route_trips has it)
+    - Destination_Stop, Destination_StopSequence, Max_StopSequence
+    - DAY_TYPE, TIME_PER_HOUR
+    - Tap_In_Rank, Tap_Out_Rank
+    """
+    print("Building percentile rank table...")
+    route_ridership = estimate_route_ridership(bus_route_trips, ridership)
+    direction = ["Direction"] if "Direction" in route_ridership else []
+    rank_table = route_ridership[
+        ["ServiceNo"]
+        + direction
+        + [
+            "Destination_Stop",
+            "Destination_StopSequence",
+            "Max_StopSequence",
+            "DAY_TYPE",
+            "TIME_PER_HOUR",
+        ]
+    ].copy()
+    rank_table["Tap_In_Rank"] = np.nan
+    rank_table["Tap_Out_Rank"] = np.nan
+
+    route_groups = route_ridership.groupby(GROUP_COLUMNS).indices
+    for group, network in ridership.groupby(GROUP_COLUMNS):
+        rows = route_groups.get(group)
+        if rows is None:
+            continue
+        group_ridership = route_ridership.iloc[rows]
+        for estimate, volume, rank in [
+            ("Estimated_Tap_In", "TOTAL_TAP_IN_VOLUME", "Tap_In_Rank"),
+            ("Estimated_Tap_Out", "TOTAL_TAP_OUT_VOLUME", "Tap_Out_Rank"),
+        ]:
+            rank_table.iloc[rows, rank_table.columns.get_loc(rank)] = percentile_rank(
+                group_ridership[estimate].to_numpy(dtype=np.float64),
+                network[volume].to_numpy(dtype=np.float64),
+            )
+    return rank_table
+
+
+def get_hour_count_below_percentile_each_stop(
+    rank_table: pd.DataFrame,
+    bus_service: str,
+    percentile: float = 25,
+    hour_window: tuple[int, int] = HOUR_WINDOW,
+    direction: int = 1,
+) -> tuple[pd.DataFrame, int]:
+    """
+    Count, for each stop of the service, the hours within `hour_window`
+    (inclusive) in which both estimated tap in and tap out are below the given
+    network-wide percentile.
+    If the rank table has a Direction, only the stops of the given direction
+    are counted, or those of both directions if `direction` is None (stop
+    sequences are then per direction, and a stop served in both directions
+    counts twice towards the number of stops).
+    resultant df has these columns:
+    - Direction (if `direction` is None)
+    - Destination_StopSequence
+    - DAY_TYPE
+    - Total_Hour_Count
+    """
+    service_ranks = rank_table[rank_table["ServiceNo"] == bus_service]
+    by_direction = "Direction" in service_ranks and direction is None
+    if "Direction" in service_ranks and direction is not None:
+        service_ranks = service_ranks[service_ranks["Direction"] == direction]
+    stop_columns = ["Destination_StopSequence"]
+    if by_direction:
+        stop_columns = ["Direction"] + stop_columns
+    total_num_stops = len(
+        service_ranks[stop_columns[:-1] + ["Destination_Stop"]].drop_duplicates()
+    )
+
+    filtered_busstops = service_ranks[
+        (service_ranks["Tap_In_Rank"] < percentile)
+        & (service_ranks["Tap_Out_Rank"] < percentile)
+        & (service_ranks["TIME_PER_HOUR"] >= hour_window[0])
+        & (service_ranks["TIME_PER_HOUR"] <= hour_window[1])
+    ]
+    if filtered_busstops.empty:
+        return (
+            pd.DataFrame(columns=stop_columns + ["DAY_TYPE", "Total_Hour_Count"]),
+            total_num_stops,
+        )
+
+    num_hours_below_by_service_stop = (
+        filtered_busstops.groupby(stop_columns + ["DAY_TYPE"])
+        .size()
+        .rename("Total_Hour_Count")
+    )
+
+    # stops without any low-ridership hours get a count of 0
+    day_types = filtered_busstops["DAY_TYPE"].unique()
+    if by_direction:
+        max_sequences = filtered_busstops.groupby("Direction")["Max_StopSequence"].max()
+        full_index = pd.MultiIndex.from_tuples(
+            [
+                (route_direction, sequence, day_type)
+                for route_direction, max_sequence in max_sequences.items()
+                for sequence in range(1, int(max_sequence) + 1)
+                for day_type in day_types
+            ],
+            names=stop_columns + ["DAY_TYPE"],
+        )
+    else:
+        max_sequence = filtered_busstops["Max_StopSequence"].max()
+        full_index = pd.MultiIndex.from_product(
+            [range(1, int(max_sequence) + 1), day_types],
+            names=["Destination_StopSequence", "DAY_TYPE"],
+        )
+    num_hours_below_by_service_stop = num_hours_below_by_service_stop.reindex(
+        full_index, fill_value=0
+    ).reset_index()
+
+    num_hours_below_by_service_stop["Destination_StopSequence"] = (
+        num_hours_below_by_service_stop["Destination_StopSequence"].astype(int)
+    )
+    return num_hours_below_by_service_stop, total_num_stops
+
+
+def get_low_ridership_hours_each_stop(
+    rank_table: pd.DataFrame,
+    percentile: float = 25,
+    hour_window: tuple[int, int] = HOUR_WINDOW,
+) -> pd.DataFrame:
+    """
+    Network-wide counterpart of get_hour_count_below_percentile_each_stop: for
+    every stop and day type, the low-ridership hours within `hour_window`
+    (inclusive) summed over all the services serving the stop, in one pass
+    over the rank table.
+    resultant df has these columns:
+    - Destination_Stop
+    - DAY_TYPE
+    - Num_Services: services with estimates at the stop
+    - Service_Hours: (service, hour) pairs within the hour window
+    - Low_Ridership_Hours: of which both tap in and tap out are below the percentile
+    - Low_Ridership_Share: Low_Ridership_Hours / Service_Hours
+    """
+    in_window = rank_table[
+        (rank_table["TIME_PER_HOUR"] >= hour_window[0])
+        & (rank_table["TIME_PER_HOUR"] <= hour_window[1])
+    ]
+    is_low = (in_window["Tap_In_Rank"] < percentile) & (
+        in_window["Tap_Out_Rank"] < percentile
+    )
+    stop_metrics = (
+        in_window.assign(Low_Ridership_Hours=is_low.astype(np.int64))
+        .groupby(["Destination_Stop", "DAY_TYPE"], as_index=False)
+        .agg(
+            Num_Services=("ServiceNo", "nunique"),
+            Service_Hours=("ServiceNo", "size"),
+            Low_Ridership_Hours=("Low_Ridership_Hours", "sum"),
+        )
+    )
+    stop_metrics["Low_Ridership_Share"] = (
+        stop_metrics["Low_Ridership_Hours"] / stop_metrics["Service_Hours"]
+    )
+    return stop_metrics
@@ -0,0 +1,791 @@
+"""
+Incremental runner for the analysis pipeline.
+
+The cleaned datasets feed a chain of analysis stages (percentile ranks, low
+ridership hours, bus routes against MRT lines, ..., up to the final ranking of
+the services and its weight sensitivity). Each stage declares the
+sources and stages it reads, so the stages form a DAG. A stage's key is a hash
+of its code (including the app modules it uses), its parameters, its version
+and the content hashes of its inputs; the key and the content hash of its
+output are kept in a manifest, so a stage is only recomputed when its key
+changes, and a recomputed stage whose output did not change does not
+invalidate the stages after it.
+
+Stages can be partitioned by bus service: only the services whose input rows
+changed are recomputed, and the rows of the other services are reused.
+Stages of the same level of the DAG (which do not depend on each other), and
+the partitions of a stage, are run in parallel threads.
+
+    data/pipeline/
+        manifest.json
+        <stage>.pkl
+
+Usage (from the repo root):
+    python app/pipeline.py --data data/cleaned --workers 4
+    python app/pipeline.py --dry-run
+    python app/pipeline.py --stages hour_counts --force percentile_rank_table
+"""
+
+import argparse
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import bus_corridors
+import core
+import frontend
+import parallel_routes
+import percentile_ranks
+import result_cache
+import ridership_percentiles
+import ridership_store
+import sensitivity
+import stop_groups
+import stop_service_index
+import trip_model
+
+PIPELINE_FOLDER = os.path.join("data", "pipeline")
+MANIFEST_FNAME = "manifest.json"
+
+
+class Stage:
+    """
+    One step of the pipeline: `func(*inputs, **params)`, where inputs are the
+    values of the named sources or stages.
+    If `partition_by` ({input name: column}) is given, the stage is computed per
+    value of those columns (e.g. per bus service): func is only called on the
+    rows of the partitions whose rows changed, and its output must have the
+    partition value in `partition_column` (by default the first column of
+    `partition_by`). Inputs that are not partitioned are passed whole.
+    The key covers func's code and the app modules it uses; bump `version` to
+    recompute the stage after other changes (e.g. to installed packages).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func,
+        inputs: list[str],
+        params: dict = None,
+        partition_by: dict = None,
+        partition_column: str = None,
+        version: int = 0,
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.partition_by = partition_by or {}
+        self.partition_column = partition_column or next(
+            iter(self.partition_by.values()), None
+        )
+        self.version = version
+
+
+def _log(message: str) -> None:
+    # one write per message, so that lines from parallel stages do not interleave
+    print(message + "\n", end="", flush=True)
+
+
+def _partition_rows(data: pd.DataFrame, column: str) -> dict:
+    # positions of the rows of each partition value
+    return data.groupby(data[column].astype(str), sort=True).indices
+
+
+def _take(data: pd.DataFrame, rows) -> pd.DataFrame:
+    # partitions are hashed and passed without their position in the whole input
+    return data.iloc[rows].reset_index(drop=True)
+
+
+class Pipeline:
+    """
+    DAG of sources and stages, with stage outputs and the manifest in `folder`.
+    """
+
+    def __init__(self, folder: str = PIPELINE_FOLDER, workers: int = 4):
+        self.folder = folder
+        self.workers = workers
+        self.sources = {}
+        self.stages = {}
+        self.values = {}
+        self.versions = {}
+        self.value_locks = {}
+        self.lock = threading.Lock()
+        self.manifest = self._read_manifest()
+
+    ## Definition
+
+    def add_source(self, name: str, version, load) -> None:
+        """
+        Add an input: `version()` returns its content hash (cheaply, e.g. from
+        the file bytes), `load()` its value, only called when a stage needs it.
+        """
+        if name in self.sources or name in self.stages:
+            raise ValueError(f"Duplicate pipeline node: {name}")
+        self.sources[name] = (version, load)
+        self.value_locks[name] = threading.Lock()
+
+    def add_stage(self, stage: Stage) -> None:
+        """
+        Add a stage. Its inputs must already be in the pipeline, so the stages
+        cannot form a cycle.
+        """
+        if stage.name in self.sources or stage.name in self.stages:
+            raise ValueError(f"Duplicate pipeline node: {stage.name}")
+        missing = [
+            name
+            for name in stage.inputs
+            if name not in self.sources and name not in self.stages
+        ]
+        if missing:
+            raise ValueError(f"Unknown inputs of stage {stage.name}: {missing}")
+        unknown_partitions = set(stage.partition_by) - set(stage.inputs)
+        if unknown_partitions:
+            raise ValueError(
+                f"Stage {stage.name} is partitioned by inputs it does not read: "
+                f"{sorted(unknown_partitions)}"
+            )
+        self.stages[stage.name] = stage
+        self.value_locks[stage.name] = threading.Lock()
+
+    def required_stages(self, targets: list[str] = None) -> list[str]:
+        """
+        The targets and every stage they depend on, in order.
+        """
+        if targets is None:
+            return list(self.stages)
+        unknown = [name for name in targets if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Unknown stages: {unknown}")
+        required = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in required or name not in self.stages:
+                continue
+            required.add(name)
+            pending.extend(self.stages[name].inputs)
+        return [name for name in self.stages if name in required]
+
+    def levels(self, targets: list[str] = None) -> list[list[str]]:
+        """
+        Stages grouped by depth in the DAG. Stages of a level only read sources
+        and stages of earlier levels.
+        """
+        depth = {}
+        for name in self.required_stages(targets):
+            depth[name] = 1 + max(
+                (depth[i] for i in self.stages[name].inputs if i in depth), default=-1
+            )
+        levels = [[] for _ in range(max(depth.values(), default=-1) + 1)]
+        for name, level in depth.items():
+            levels[level].append(name)
+        return levels
+
+    ## Storage
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, f"{name}.pkl")
+
+    def _read_manifest(self) -> dict:
+        manifest_path = os.path.join(self.folder, MANIFEST_FNAME)
+        if not os.path.exists(manifest_path):
+            return {"stages": {}}
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def _write_manifest(self) -> None:
+        manifest_path = os.path.join(self.folder, MANIFEST_FNAME)
+        with open(f"{manifest_path}.tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    def _save(self, name: str, value) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        # write to a temporary file first so that readers never see partial outputs
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(name))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def value(self, name: str):
+        """
+        Value of a source or stage, loaded once. Stages must have been run.
+        """
+        with self.value_locks[name]:
+            if name not in self.values:
+                if name in self.sources:
+                    self.values[name] = self.sources[name][1]()
+                else:
+                    with open(self._path(name), "rb") as f:
+                        self.values[name] = pickle.load(f)
+            return self.values[name]
+
+    ## Running
+
+    def version(self, name: str) -> str:
+        """
+        Content hash of a source, or of the output of a stage that has been run.
+        """
+        if name in self.versions:
+            return self.versions[name]
+        if name not in self.sources:
+            raise ValueError(f"Stage {name} has not been run")
+        with self.value_locks[name]:
+            if name not in self.versions:
+                self.versions[name] = self.sources[name][0]()
+            return self.versions[name]
+
+    def stage_key(self, stage: Stage, input_versions: list[str] = None) -> str:
+        if input_versions is None:
+            input_versions = [self.version(name) for name in stage.inputs]
+        return result_cache.content_hash(
+            (
+                result_cache.function_hash(stage.func),
+                input_versions,
+                stage.params,
+                stage.partition_by,
+                stage.version,
+            )
+        )
+
+    def is_current(self, name: str) -> bool:
+        entry = self.manifest["stages"].get(name, {})
+        return (
+            entry.get("key") == self.stage_key(self.stages[name])
+            and os.path.exists(self._path(name))
+        )
+
+    def plan(self, targets: list[str] = None, force: list[str] = ()) -> dict:
+        """
+        Stages that would be recomputed by `run`, without running anything.
+        Stages after a stale stage are assumed stale too.
+        """
+        stale = {}
+        entries = self.manifest["stages"]
+        for level in self.levels(targets):
+            for name in level:
+                stage = self.stages[name]
+                upstream = [i for i in stage.inputs if stale.get(i)]
+                if name in force:
+                    stale[name] = "forced"
+                elif upstream:
+                    stale[name] = f"stale inputs {upstream}"
+                elif name not in entries or not os.path.exists(self._path(name)):
+                    stale[name] = "not built"
+                elif not self.is_current(name):
+                    stale[name] = "inputs or code changed"
+                else:
+                    stale[name] = None
+                if stale[name] is None:
+                    self.versions[name] = entries[name]["output"]
+        return stale
+
+    def run(self, targets: list[str] = None, force: list[str] = ()) -> dict:
+        """
+        Bring the targets (all stages by default) up to date, level by level.
+        Stages in `force` are recomputed entirely. Returns the status of every
+        stage run.
+        """
+        statuses = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for level in self.levels(targets):
+                results = executor.map(
+                    lambda name: self._run_stage(name, name in force), level
+                )
+                statuses.update(zip(level, results))
+        return statuses
+
+    def _run_stage(self, name: str, force: bool = False) -> str:
+        stage = self.stages[name]
+        entry = self.manifest["stages"].get(name, {})
+        key = self.stage_key(stage)
+        if not force and entry.get("key") == key and os.path.exists(self._path(name)):
+            with self.lock:
+                self.versions[name] = entry["output"]
+            _log(f"[{name}] up to date")
+            return "up to date"
+
+        start = time.perf_counter()
+        inputs = [self.value(i) for i in stage.inputs]
+        if stage.partition_by:
+            output, partitions, status = self._run_partitions(
+                stage, inputs, {} if force else entry
+            )
+        else:
+            _log(f"[{name}] running...")
+            output = stage.func(*inputs, **stage.params)
+            partitions, status = None, "rebuilt"
+        self._save(name, output)
+
+        output_hash = result_cache.content_hash(output)
+        if output_hash == entry.get("output"):
+            status += ", output unchanged"
+        with self.lock:
+            self.values[name] = output
+            self.versions[name] = output_hash
+            self.manifest["stages"][name] = {
+                "key": key,
+                "output": output_hash,
+                "partitions": partitions,
+                "seconds": round(time.perf_counter() - start, 3),
+                "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self._write_manifest()
+        _log(f"[{name}] {status} in {time.perf_counter() - start:.2f}s")
+        return status
+
+    def _run_partitions(self, stage: Stage, inputs: list, entry: dict):
+        # (output, partition keys, status) of a partitioned stage, recomputing
+        # only partitions whose rows or shared inputs changed
+        partitioned = {
+            i: stage.partition_by[name]
+            for i, name in enumerate(stage.inputs)
+            if name in stage.partition_by
+        }
+        rows = {i: _partition_rows(inputs[i], column) for i, column in partitioned.items()}
+        partition_values = sorted(set().union(*(rows[i].keys() for i in rows)))
+
+        shared_versions = [
+            None if i in partitioned else self.version(name)
+            for i, name in enumerate(stage.inputs)
+        ]
+        shared_key = self.stage_key(stage, shared_versions)
+        keys = {
+            value: result_cache.content_hash(
+                (
+                    shared_key,
+                    [
+                        result_cache.content_hash(_take(inputs[i], rows[i].get(value, [])))
+                        for i in sorted(partitioned)
+                    ],
+                )
+            )
+            for value in partition_values
+        }
+
+        old_keys = entry.get("partitions") or {}
+        previous = None
+        if old_keys and os.path.exists(self._path(stage.name)):
+            previous = self.value(stage.name)
+        changed = [
+            value
+            for value in partition_values
+            if previous is None or old_keys.get(value) != keys[value]
+        ]
+        _log(
+            f"[{stage.name}] running {len(changed)} of "
+            f"{len(partition_values)} partitions..."
+        )
+
+        def compute(values: list[str]):
+            chunk_inputs = list(inputs)
+            for i in partitioned:
+                chunk_rows = [rows[i][value] for value in values if value in rows[i]]
+                chunk_inputs[i] = _take(
+                    inputs[i], sorted(row for part in chunk_rows for row in part)
+                )
+            return stage.func(*chunk_inputs, **stage.params)
+
+        # one chunk of partitions per worker
+        num_chunks = min(self.workers, len(changed))
+        chunks = [changed[i::num_chunks] for i in range(num_chunks)]
+        with ThreadPoolExecutor(max_workers=max(num_chunks, 1)) as executor:
+            outputs = list(executor.map(compute, chunks))
+
+        if previous is not None:
+            kept = previous[stage.partition_column].astype(str)
+            kept = kept.isin(set(partition_values) - set(changed)).to_numpy()
+            outputs = [previous[kept]] + outputs
+        outputs = [output for output in outputs if len(output.columns)]
+        output = pd.concat(outputs, ignore_index=True) if outputs else pd.DataFrame()
+        if len(output):
+            output = output.sort_values(
+                stage.partition_column,
+                key=lambda values: values.astype(str),
+                kind="stable",
+            ).reset_index(drop=True)
+        status = f"rebuilt {len(changed)} of {len(partition_values)} partitions"
+        return output, keys, status
+
+
+## Analysis pipeline
+
+
+def hour_counts_each_service(
+    rank_table: pd.DataFrame,
+    percentile: float = 25,
+    hour_window: tuple[int, int] = percentile_ranks.HOUR_WINDOW,
+    direction: int = None,
+) -> pd.DataFrame:
+    """
+    get_hour_count_below_percentile_each_stop for every service in the rank
+    table, with ServiceNo and Total_Num_Stops columns.
+    """
+    service_counts = []
+    for service_no in rank_table["ServiceNo"].unique():
+        hour_counts, total_num_stops = (
+            percentile_ranks.get_hour_count_below_percentile_each_stop(
+                rank_table, service_no, percentile, hour_window, direction
+            )
+        )
+        service_counts.append(
+            hour_counts.assign(ServiceNo=service_no, Total_Num_Stops=total_num_stops)
+        )
+    if not service_counts:
+        return pd.DataFrame()
+    return pd.concat(service_counts, ignore_index=True)
+
+
+def shared_bus_corridors(
+    index: dict, bus_routes: pd.DataFrame, min_stops: int = bus_corridors.MIN_SHARED_STOPS
+) -> pd.DataFrame:
+    """
+    Runs of consecutive stops shared by two bus services (see bus_corridors).
+    """
+    return bus_corridors.find_bus_corridors(index, min_stops, bus_routes)
+
+
+def mrt_overlaps(
+    bus_lines, mrt_lines, radii=parallel_routes.BUFFER_RADII
+) -> pd.DataFrame:
+    """
+    Overlap of every bus route with every MRT line buffer it intersects, for
+    each radius (see parallel_routes.BufferCache.overlaps_by_radius).
+    """
+    buffer_cache = parallel_routes.BufferCache(mrt_lines, radii)
+    return buffer_cache.overlaps_by_radius(bus_lines, radii)
+
+
+def mrt_angles(
+    bus_lines,
+    mrt_lines,
+    overlaps: pd.DataFrame,
+    radius: float = parallel_routes.BUFFER_DISTANCE,
+) -> pd.DataFrame:
+    """
+    Weighted average angle of every bus route against every MRT line within
+    `radius` of it.
+    """
+    return parallel_routes.weighted_average_angles(
+        bus_lines, mrt_lines, _pairs_within(overlaps, radius)
+    )
+
+
+def mrt_coverage(
+    bus_lines,
+    mrt_lines,
+    overlaps: pd.DataFrame,
+    radius: float = parallel_routes.BUFFER_DISTANCE,
+) -> pd.DataFrame:
+    """
+    Phase 2 segment coverage of every bus route against every MRT line within
+    `radius` of it (see parallel_routes.segment_coverage).
+    """
+    return parallel_routes.segment_coverage(
+        bus_lines, mrt_lines, _pairs_within(overlaps, radius)
+    )
+
+
+def mrt_similarity(
+    bus_lines,
+    mrt_lines,
+    overlaps: pd.DataFrame,
+    radius: float = parallel_routes.BUFFER_DISTANCE,
+) -> pd.DataFrame:
+    """
+    Similarity metrics of every bus route against every MRT line within
+    `radius` of it (see parallel_routes.similarity_metrics).
+    """
+    return parallel_routes.similarity_metrics(
+        bus_lines, mrt_lines, _pairs_within(overlaps, radius), radius=radius
+    )
+
+
+def _pairs_within(overlaps: pd.DataFrame, radius: float) -> pd.DataFrame:
+    # pairs of the overlaps at one radius
+    if overlaps.empty:
+        return pd.DataFrame(columns=["MRT_Line", "Bus_ServiceNo", "Bus_Direction"])
+    return overlaps[overlaps["Radius_m"] == radius]
+
+
+def ridership_analysis(
+    hour_counts: pd.DataFrame, threshold: int = frontend.HOUR_COUNT_THRESHOLD
+) -> pd.DataFrame:
+    """
+    Percentage of the stops of every service with more than `threshold`
+    low-ridership hours, on weekdays and on weekends (ridership_analysis_final.csv,
+    as in export).
+    """
+    columns = ["ServiceNo", "Weekday_Percentage_Exceed", "Weekend_Percentage_Exceed"]
+    rows = []
+    if not hour_counts.empty:
+        for service_no, counts in hour_counts.groupby("ServiceNo", sort=True):
+            total_num_stops = counts["Total_Num_Stops"].iloc[0]
+            rows.append(
+                [service_no]
+                + [
+                    round(
+                        frontend.get_percent_exceeding(
+                            counts, total_num_stops, threshold, day_type
+                        ),
+                        2,
+                    )
+                    for day_type in ["WEEKDAY", "WEEKENDS/HOLIDAY"]
+                ]
+            )
+    return pd.DataFrame(rows, columns=columns)
+
+
+def ranking_metric_table(
+    ridership: pd.DataFrame, bus_mrt_overlap: pd.DataFrame, bus_route_trips: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    sensitivity.build_metric_table of the trunk services, as in
+    combined_analysis.ipynb.
+    """
+    trunk_services = bus_route_trips.loc[
+        bus_route_trips["Category"] == "TRUNK", "ServiceNo"
+    ].unique()
+    return sensitivity.build_metric_table(ridership, bus_mrt_overlap, trunk_services)
+
+
+def _load_bus_route_trips(data_folder: str) -> pd.DataFrame:
+    # both directions if available, as in core.get_bus_route_trips
+    if os.path.exists(os.path.join(data_folder, "bus_route_trips.csv")):
+        return core.load_data_file(data_folder, "bus_route_trips.csv")
+    bus_route_trips = core.load_data_file(
+        data_folder, "bus_route_trips_single_direction.csv"
+    )
+    return bus_route_trips.assign(Direction=1)
+
+
+def _bus_route_trips_hash(data_folder: str) -> str:
+    if os.path.exists(os.path.join(data_folder, "bus_route_trips.csv")):
+        return core.data_file_hash(data_folder, "bus_route_trips.csv")
+    return result_cache.content_hash(
+        (
+            "Direction=1",
+            core.data_file_hash(data_folder, "bus_route_trips_single_direction.csv"),
+        )
+    )
+
+
+def build_analysis_pipeline(
+    data_folder: str = core.DATA_FOLDER,
+    folder: str = PIPELINE_FOLDER,
+    workers: int = 4,
+    ridership_store_folder: str = None,
+    percentile: float = 25,
+    hour_window: tuple[int, int] = percentile_ranks.HOUR_WINDOW,
+) -> Pipeline:
+    """
+    The analysis stages of the app, from the cleaned data files in `data_folder`.
+    If `ridership_store_folder` is given, aggregated_ridership is aggregated
+    from the ridership store (see ridership_store) instead of read from its file.
+    """
+    pipeline = Pipeline(folder, workers)
+
+    def add_file(name: str, file: str) -> None:
+        pipeline.add_source(
+            name,
+            lambda: core.data_file_hash(data_folder, file),
+            lambda: core.load_data_file(data_folder, file),
+        )
+
+    add_file("BusRoutes", "BusRoutes.json")
+    add_file("BusStops", "BusStops.geojson")
+    add_file("RailLineStrings", "RailLineStrings.geojson")
+    if ridership_store_folder is None:
+        add_file("aggregated_ridership", "aggregated_ridership.csv")
+    else:
+        pipeline.add_source(
+            "aggregated_ridership",
+            # the manifest changes with every append
+            lambda: result_cache.file_content_hash(
+                os.path.join(ridership_store_folder, "manifest.json")
+            ),
+            lambda: ridership_store.aggregate_ridership(ridership_store_folder),
+        )
+    trip_model_files = [trip_model.BUS_SERVICES_FNAME, trip_model.OD_TRIPS_FNAME]
+    if all(os.path.exists(os.path.join(data_folder, file)) for file in trip_model_files):
+        # model the trips from bus frequencies instead of reading bus_route_trips.csv
+        add_file("BusServices", trip_model.BUS_SERVICES_FNAME)
+        add_file("od_trips", trip_model.OD_TRIPS_FNAME)
+        pipeline.add_stage(
+            Stage(
+                "bus_route_trips",
+                trip_model.build_bus_route_trips,
+                ["BusRoutes", "BusServices", "od_trips"],
+            )
+        )
+    else:
+        pipeline.add_source(
+            "bus_route_trips",
+            lambda: _bus_route_trips_hash(data_folder),
+            lambda: _load_bus_route_trips(data_folder),
+        )
+
+    # ridership
+    pipeline.add_stage(
+        Stage(
+            "ridership_percentiles",
+            ridership_percentiles.build_ridership_percentiles,
+            ["aggregated_ridership"],
+        )
+    )
+    pipeline.add_stage(
+        Stage(
+            "percentile_rank_table",
+            percentile_ranks.build_percentile_rank_table,
+            ["bus_route_trips", "aggregated_ridership"],
+            partition_by={"bus_route_trips": "ServiceNo"},
+        )
+    )
+    pipeline.add_stage(
+        Stage(
+            "hour_counts",
+            hour_counts_each_service,
+            ["percentile_rank_table"],
+            params={"percentile": percentile, "hour_window": hour_window},
+            partition_by={"percentile_rank_table": "ServiceNo"},
+        )
+    )
+
+    # bus services
+    pipeline.add_stage(
+        Stage(
+            "stop_service_index",
+            stop_service_index.build_stop_service_index,
+            ["BusRoutes", "BusStops"],
+        )
+    )
+    pipeline.add_stage(
+        Stage("bus_corridors", shared_bus_corridors, ["stop_service_index", "BusRoutes"])
+    )
+
+    # opposite bus stops
+    pipeline.add_stage(Stage("stop_groups", stop_groups.build_stop_groups, ["BusStops"]))
+    pipeline.add_stage(
+        Stage(
+            "stop_group_ridership",
+            stop_groups.aggregate_ridership_by_group,
+            ["aggregated_ridership", "stop_groups"],
+        )
+    )
+
+    # bus routes against MRT lines
+    pipeline.add_stage(
+        Stage(
+            "bus_route_lines",
+            parallel_routes.build_bus_route_lines,
+            ["BusRoutes", "BusStops"],
+            params={"direction": None},
+        )
+    )
+    pipeline.add_stage(
+        Stage("mrt_lines", parallel_routes.build_mrt_lines, ["RailLineStrings"])
+    )
+    pipeline.add_stage(
+        Stage(
+            "mrt_overlaps",
+            mrt_overlaps,
+            ["bus_route_lines", "mrt_lines"],
+            partition_by={"bus_route_lines": "ServiceNo"},
+            partition_column="Bus_ServiceNo",
+        )
+    )
+    pipeline.add_stage(
+        Stage(
+            "mrt_angles",
+            mrt_angles,
+            ["bus_route_lines", "mrt_lines", "mrt_overlaps"],
+            partition_by={"bus_route_lines": "ServiceNo", "mrt_overlaps": "Bus_ServiceNo"},
+            partition_column="Bus_ServiceNo",
+        )
+    )
+    pipeline.add_stage(
+        Stage(
+            "mrt_coverage",
+            mrt_coverage,
+            ["bus_route_lines", "mrt_lines", "mrt_overlaps"],
+            partition_by={"bus_route_lines": "ServiceNo", "mrt_overlaps": "Bus_ServiceNo"},
+            partition_column="Bus_ServiceNo",
+        )
+    )
+    pipeline.add_stage(
+        Stage(
+            "mrt_similarity",
+            mrt_similarity,
+            ["bus_route_lines", "mrt_lines", "mrt_overlaps"],
+            partition_by={"bus_route_lines": "ServiceNo", "mrt_overlaps": "Bus_ServiceNo"},
+            partition_column="Bus_ServiceNo",
+        )
+    )
+    pipeline.add_stage(
+        Stage(
+            "bus_mrt_overlap",
+            parallel_routes.bus_mrt_overlap,
+            ["mrt_overlaps", "mrt_coverage", "mrt_angles", "mrt_similarity"],
+        )
+    )
+
+    # final ranking of the services to replace
+    pipeline.add_stage(Stage("ridership_analysis", ridership_analysis, ["hour_counts"]))
+    pipeline.add_stage(
+        Stage(
+            "ranking_metric_table",
+            ranking_metric_table,
+            ["ridership_analysis", "bus_mrt_overlap", "bus_route_trips"],
+        )
+    )
+    pipeline.add_stage(
+        Stage("final_ranking", sensitivity.final_ranking, ["ranking_metric_table"])
+    )
+    pipeline.add_stage(
+        Stage("weight_sensitivity", sensitivity.weight_sensitivity, ["ranking_metric_table"])
+    )
+    return pipeline
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the analysis pipeline")
+    parser.add_argument("--data", default=core.DATA_FOLDER, help="data folder")
+    parser.add_argument("--folder", default=PIPELINE_FOLDER, help="output folder")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--ridership-store", help="aggregate ridership from this store")
+    parser.add_argument("--percentile", type=float, default=25)
+    parser.add_argument("--stages", nargs="+", help="only these stages (and their inputs)")
+    parser.add_argument("--force", nargs="+", default=[], help="recompute these stages")
+    parser.add_argument("--dry-run", action="store_true", help="only list stale stages")
+    parser.add_argument("--export", help="also write the stage outputs to CSVs here")
+    args = parser.parse_args()
+
+    pipeline = build_analysis_pipeline(
+        args.data, args.folder, args.workers, args.ridership_store, args.percentile
+    )
+    if args.dry_run:
+        for name, reason in pipeline.plan(args.stages, args.force).items():
+            print(f"{name}: {reason or 'up to date'}")
+    else:
+        start = time.perf_counter()
+        pipeline.run(args.stages, args.force)
+        print(f"Pipeline done in {time.perf_counter() - start:.2f}s")
+        if args.export:
+            os.makedirs(args.export, exist_ok=True)
+            for name in pipeline.required_stages(args.stages):
+                output = pipeline.value(name)
+                if isinstance(output, pd.DataFrame):
+                    output.to_csv(os.path.join(args.export, f"{name}.csv"), index=False)
+                    print(f"Saved {len(output)} rows to {name}.csv")
@@ -0,0 +1,335 @@
+"""
+Persistent, content-addressed disk cache for backend analysis results.
+(Named result_cache so as not to shadow the `diskcache` package.)
+
+`st.cache_data` skips underscore-prefixed arguments when building its keys, and
+its entries only live as long as the Streamlit process. Results cached here are
+keyed by a content hash of the input datasets plus the remaining function
+arguments, so they survive restarts and are invalidated when the data changes.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+CACHE_FOLDER = os.path.join("data", "cache")
+CACHE_SIZE_LIMIT = 512 * 1024 * 1024  # bytes
+HASHABLE_SCALARS = (str, bytes, int, float, complex, bool, type(None), np.generic)
+# modules in this folder are hashed by source as dependencies of cached functions
+MODULE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_content_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Hash the bytes of a file on disk.
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# precomputed hashes by id of the tagged object: pandas copies `attrs` to the
+# frames derived from a frame (filters, copies, merges), which a tag there
+# would not describe
+_content_hash_tags = {}
+
+
+def tag_content_hash(data: pd.DataFrame, content_hash: str) -> pd.DataFrame:
+    """
+    Attach a precomputed content hash (e.g. of the source file) to a dataset,
+    so that `content_hash` does not need to hash every row. The tag only
+    applies to this object, not to frames derived from it.
+    """
+    data_id = id(data)
+
+    def forget(_):
+        _content_hash_tags.pop(data_id, None)
+
+    _content_hash_tags[data_id] = (weakref.ref(data, forget), content_hash)
+    return data
+
+
+def tagged_content_hash(data) -> str | None:
+    """
+    The hash tagged on this very object by tag_content_hash, if any.
+    """
+    tag = _content_hash_tags.get(id(data))
+    if tag is not None and tag[0]() is data:
+        return tag[1]
+    return None
+
+
+def _dataframe_hash(data: pd.DataFrame) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(repr((type(data).__name__, tuple(data.columns), data.shape)).encode())
+    hasher.update(repr(getattr(data, "crs", None)).encode())
+
+    tag = tagged_content_hash(data)
+    if isinstance(data.index, pd.RangeIndex):
+        index = data.index
+        hasher.update(repr((index.start, index.stop, index.step)).encode())
+    else:
+        hasher.update(pd.util.hash_pandas_object(data.index, index=False).values.tobytes())
+
+    if tag:
+        hasher.update(tag.encode())
+    else:
+        hashable = pd.DataFrame(data)
+        if "geometry" in hashable.columns:
+            hashable = hashable.assign(geometry=data["geometry"].to_wkb())
+        hasher.update(pd.util.hash_pandas_object(hashable, index=False).values.tobytes())
+    return hasher.hexdigest()
+
+
+def content_hash(obj) -> str:
+    """
+    Hash an argument by content. DataFrames, arrays, scalars and (nested)
+    containers of them are supported; other types raise a TypeError.
+    """
+    if isinstance(obj, pd.DataFrame):
+        return _dataframe_hash(obj)
+    if isinstance(obj, pd.Series):
+        return _dataframe_hash(obj.to_frame())
+
+    hasher = hashlib.sha256()
+    if isinstance(obj, HASHABLE_SCALARS):
+        hasher.update(repr(obj).encode())
+    elif isinstance(obj, np.ndarray):
+        hasher.update(repr((obj.dtype.str, obj.shape)).encode())
+        if obj.dtype == object:
+            # the bytes of an object array are pointers
+            hasher.update(repr(obj.tolist()).encode())
+        else:
+            hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=repr):
+            hasher.update(repr(key).encode())
+            hasher.update(content_hash(obj[key]).encode())
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(type(obj).__name__.encode())
+        for item in obj:
+            hasher.update(content_hash(item).encode())
+    elif isinstance(obj, (set, frozenset)):
+        hasher.update(type(obj).__name__.encode())
+        for item_hash in sorted(content_hash(item) for item in obj):
+            hasher.update(item_hash.encode())
+    else:
+        # the repr of other objects may contain their memory address
+        raise TypeError(f"Cannot hash argument of type {type(obj).__name__}")
+    return hasher.hexdigest()
+
+
+def _update_code_hash(hasher, code) -> None:
+    hasher.update(code.co_code)
+    for const in code.co_consts:
+        # nested code objects (lambdas, comprehensions) have a memory address in their repr
+        if hasattr(const, "co_code"):
+            _update_code_hash(hasher, const)
+        else:
+            hasher.update(repr(const).encode())
+
+
+_source_hashes = {}
+
+
+def _source_hash(file: str) -> str:
+    # rehashed only when the file changes
+    stat = os.stat(file)
+    key = (file, stat.st_mtime_ns, stat.st_size)
+    if key not in _source_hashes:
+        _source_hashes[key] = file_content_hash(file)
+    return _source_hashes[key]
+
+
+def _is_local(module) -> bool:
+    file = getattr(module, "__file__", None)
+    return file is not None and os.path.dirname(os.path.abspath(file)) == MODULE_FOLDER
+
+
+def _code_names(code) -> set:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            names |= _code_names(const)
+    return names
+
+
+def _add_module_dependencies(module, files: set, seen: set) -> None:
+    # a local module's source, and that of the local modules it uses
+    if not _is_local(module) or module.__name__ in seen:
+        return
+    seen.add(module.__name__)
+    files.add(os.path.abspath(module.__file__))
+    for value in vars(module).values():
+        if inspect.ismodule(value):
+            _add_module_dependencies(value, files, seen)
+        elif inspect.isfunction(value) or inspect.isclass(value):
+            _add_module_dependencies(sys.modules.get(value.__module__), files, seen)
+
+
+def _add_function_dependencies(func, files: set, seen: set) -> None:
+    func = inspect.unwrap(func)
+    if id(func) in seen:
+        return
+    seen.add(id(func))
+    for name in _code_names(func.__code__):
+        value = func.__globals__.get(name)
+        if inspect.ismodule(value):
+            _add_module_dependencies(value, files, seen)
+        elif inspect.isfunction(value) and _is_local(sys.modules.get(value.__module__)):
+            # functions of the same module are followed, not the whole module
+            _add_function_dependencies(value, files, seen)
+        elif inspect.isclass(value):
+            _add_module_dependencies(sys.modules.get(value.__module__), files, seen)
+
+
+def function_hash(func) -> str:
+    """
+    Hash a function's identity and bytecode, and the source of the modules in
+    this folder that it uses (directly, through other functions or through
+    their imports), so that editing the function or the analysis code it
+    relies on invalidates its cached results.
+    """
+    files = set()
+    _add_function_dependencies(func, files, set())
+
+    hasher = hashlib.sha256()
+    hasher.update(f"{func.__module__}.{func.__qualname__}".encode())
+    _update_code_hash(hasher, inspect.unwrap(func).__code__)
+    for file in sorted(files):
+        hasher.update(os.path.basename(file).encode())
+        hasher.update(_source_hash(file).encode())
+    return hasher.hexdigest()
+
+
+class DiskCache:
+    """
+    Pickle-per-entry cache in a folder, capped at `size_limit` bytes.
+    Least recently used entries (by file modification time) are evicted first.
+    """
+
+    def __init__(self, folder: str = CACHE_FOLDER, size_limit: int = CACHE_SIZE_LIMIT):
+        self.folder = folder
+        self.size_limit = size_limit
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.pkl")
+
+    def get(self, key: str):
+        """
+        Return (True, value) on a hit, or (False, None) on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return True, value
+
+    def set(self, key: str, value) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+
+        # write to a temporary file first so that readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        """
+        List cached entries as (path, size in bytes, last used time).
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        entries = []
+        for file in os.listdir(self.folder):
+            if not file.endswith(".pkl"):
+                continue
+            path = os.path.join(self.folder, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Remove least recently used entries until the cache fits its size limit.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total_size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total_size <= self.size_limit:
+                break
+            print(f"Evicting cached result {os.path.basename(path)}")
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+    def clear(self) -> None:
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+
+DEFAULT_CACHE = DiskCache()
+
+
+def disk_cache(func=None, *, cache: DiskCache = None):
+    """
+    Decorator caching a function's results on disk. The key combines the
+    function's hash (see function_hash) with a content hash of every argument,
+    including underscore-prefixed ones.
+    """
+    if func is None:
+        return functools.partial(disk_cache, cache=cache)
+
+    func_hash = None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal func_hash
+        # hashed on the first call, once the functions it calls are all defined
+        if func_hash is None:
+            func_hash = function_hash(func)
+        store = cache if cache is not None else DEFAULT_CACHE
+        key = content_hash((func_hash, args, kwargs))
+        hit, value = store.get(key)
+        if hit:
+            print(f"Loaded cached result for {func.__name__}")
+            return value
+        value = func(*args, **kwargs)
+        store.set(key, value)
+        print(f"Saved cached result for {func.__name__}")
+        return value
+
+    return wrapper
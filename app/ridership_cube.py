@@ -0,0 +1,176 @@
+"""
+Dense stop x hour x day type cube of ridership.
+
+aggregated_ridership is a long table keyed by (DAY_TYPE, TIME_PER_HOUR, PT_TYPE,
+Destination_Stop), so every time-of-day view would have to filter and pivot it.
+The cube holds the same numbers as a float32 array of shape
+(stops, 24 hours, day types, measures), with a sorted integer stop index, so
+that one hour of the whole network is a single slice:
+
+    cube["cube"][:, hour, day_type_id, measure_id]
+
+The cube is saved as a .npy file next to its index and memory-mapped when
+loaded, so that it is shared by every process reading it.
+Stops, hours and day types without any record are 0.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import percentile_ranks
+
+HOURS = 24
+DAY_TYPES = ["WEEKDAY", "WEEKENDS/HOLIDAY"]
+MEASURES = ["Tap_In", "Tap_Out", "Estimated_Volume_Per_Service"]
+CUBE_FNAME = "ridership_cube.npy"
+INDEX_FNAME = "ridership_cube_index.npz"
+
+
+def _fill(cube, stop_ids, hours, day_ids, measure_id, values) -> None:
+    valid = (day_ids >= 0) & (hours >= 0) & (hours < HOURS) & ~np.isnan(values)
+    cube[stop_ids[valid], hours[valid], day_ids[valid], measure_id] = values[valid]
+
+
+def build_ridership_cube(
+    ridership: pd.DataFrame, bus_route_trips: pd.DataFrame, pt_type: str = "BUS"
+) -> dict:
+    """
+    Build the cube from aggregated_ridership and bus_route_trips.
+    Measures:
+    - Tap_In, Tap_Out: TOTAL_TAP_IN_VOLUME, TOTAL_TAP_OUT_VOLUME at the stop
+    - Estimated_Volume_Per_Service: estimated tap in + tap out of each service at
+      the stop (as in percentile_ranks), averaged over the services
+    Returns a dict with:
+    - cube: (num_stops, HOURS, len(DAY_TYPES), len(MEASURES)) float32 array
+    - stop_codes: sorted int64 Destination_Stop of each row of the cube
+    - day_types, measures: names along the last two axes
+    """
+    print("Building ridership cube...")
+    ridership = ridership[ridership["PT_TYPE"] == pt_type]
+    route_ridership = percentile_ranks.estimate_route_ridership(
+        bus_route_trips[bus_route_trips["PT_TYPE"] == pt_type], ridership
+    )
+    route_volume = (
+        route_ridership.assign(
+            Volume=route_ridership["Estimated_Tap_In"]
+            + route_ridership["Estimated_Tap_Out"]
+        )
+        .groupby(["Destination_Stop", "TIME_PER_HOUR", "DAY_TYPE"], as_index=False)[
+            "Volume"
+        ]
+        .mean()
+    )
+
+    stop_codes = np.unique(
+        np.concatenate(
+            [
+                ridership["Destination_Stop"].to_numpy(dtype=np.int64),
+                route_volume["Destination_Stop"].to_numpy(dtype=np.int64),
+            ]
+        )
+    )
+    day_type_ids = {day_type: i for i, day_type in enumerate(DAY_TYPES)}
+    cube = np.zeros((len(stop_codes), HOURS, len(DAY_TYPES), len(MEASURES)), np.float32)
+
+    for table, columns in [
+        (ridership, {"Tap_In": "TOTAL_TAP_IN_VOLUME", "Tap_Out": "TOTAL_TAP_OUT_VOLUME"}),
+        (route_volume, {"Estimated_Volume_Per_Service": "Volume"}),
+    ]:
+        stop_ids = np.searchsorted(
+            stop_codes, table["Destination_Stop"].to_numpy(dtype=np.int64)
+        )
+        hours = table["TIME_PER_HOUR"].to_numpy(dtype=np.int64)
+        day_ids = table["DAY_TYPE"].map(day_type_ids).fillna(-1).to_numpy(np.int64)
+        for measure, column in columns.items():
+            _fill(
+                cube,
+                stop_ids,
+                hours,
+                day_ids,
+                MEASURES.index(measure),
+                table[column].to_numpy(dtype=np.float64),
+            )
+
+    return {
+        "cube": cube,
+        "stop_codes": stop_codes,
+        "day_types": np.array(DAY_TYPES),
+        "measures": np.array(MEASURES),
+    }
+
+
+def save_ridership_cube(ridership_cube: dict, folder: str) -> None:
+    """
+    Write the cube and its index to `folder`. Files are written to temporary
+    paths first so that readers never see a partial cube.
+    """
+    os.makedirs(folder, exist_ok=True)
+    cube_path = os.path.join(folder, CUBE_FNAME)
+    index_path = os.path.join(folder, INDEX_FNAME)
+
+    # unique temporary files, so that concurrent builders do not write to the
+    # same one
+    cube_fd, cube_tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    index_fd, index_tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(cube_fd, "wb") as f:
+            np.save(f, ridership_cube["cube"])
+        with os.fdopen(index_fd, "wb") as f:
+            np.savez(
+                f,
+                stop_codes=ridership_cube["stop_codes"],
+                day_types=ridership_cube["day_types"],
+                measures=ridership_cube["measures"],
+            )
+        # the index is replaced last, its presence marks a complete cube
+        os.replace(cube_tmp_path, cube_path)
+        os.replace(index_tmp_path, index_path)
+    except Exception:
+        for tmp_path in [cube_tmp_path, index_tmp_path]:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+
+def load_ridership_cube(folder: str, mmap_mode: str = "r"):
+    """
+    Load a saved cube, memory-mapped by default. Returns None if there is none.
+    """
+    cube_path = os.path.join(folder, CUBE_FNAME)
+    index_path = os.path.join(folder, INDEX_FNAME)
+    if not (os.path.exists(cube_path) and os.path.exists(index_path)):
+        return None
+    with np.load(index_path) as index:
+        ridership_cube = {name: index[name] for name in index.files}
+    ridership_cube["cube"] = np.load(cube_path, mmap_mode=mmap_mode)
+    return ridership_cube
+
+
+def stop_positions(ridership_cube: dict, stop_codes) -> np.ndarray:
+    """
+    Row of each stop code in the cube, -1 for stops that are not in it.
+    """
+    stop_codes = np.asarray(stop_codes, dtype=np.int64)
+    if len(ridership_cube["stop_codes"]) == 0:
+        return np.full(len(stop_codes), -1)
+    positions = np.searchsorted(ridership_cube["stop_codes"], stop_codes)
+    positions = np.minimum(positions, len(ridership_cube["stop_codes"]) - 1)
+    found = ridership_cube["stop_codes"][positions] == stop_codes
+    return np.where(found, positions, -1)
+
+
+def hour_slice(
+    ridership_cube: dict, day_type: str, measure: str, hour: int = None
+) -> np.ndarray:
+    """
+    A view of one measure for one day type: (num_stops, HOURS), or (num_stops,)
+    for a single hour.
+    """
+    day_id = list(ridership_cube["day_types"]).index(day_type)
+    measure_id = list(ridership_cube["measures"]).index(measure)
+    if hour is None:
+        return ridership_cube["cube"][:, :, day_id, measure_id]
+    return ridership_cube["cube"][:, hour, day_id, measure_id]
@@ -0,0 +1,250 @@
+"""
+Builder for ridership_percentiles.csv.
+
+ridership_final.ipynb computed the table with a groupby-agg of
+`lambda x: np.percentile(x, 25)` (and 75) per (TIME_PER_HOUR, DAY_TYPE) group.
+`build_ridership_percentiles` computes any list of quantiles for tap in and
+tap out with one sort per value column, giving the same values as np.percentile.
+
+For inputs too large to sort at once, `QuantileSketch` is a mergeable,
+approximate alternative: sketch each chunk of rows, merge the sketches and read
+the quantiles off the result.
+
+Usage:
+    python app/ridership_percentiles.py data/cleaned/aggregated_ridership.csv \
+        data/cleaned/ridership_percentiles.csv --quantiles 10 25 40 75
+"""
+
+import argparse
+import math
+
+import numpy as np
+import pandas as pd
+
+GROUP_COLUMNS = ["TIME_PER_HOUR", "DAY_TYPE"]
+VALUE_COLUMNS = {"TAP_IN": "TOTAL_TAP_IN_VOLUME", "TAP_OUT": "TOTAL_TAP_OUT_VOLUME"}
+QUANTILES = (25, 75)
+
+
+def _lerp(lower: np.ndarray, upper: np.ndarray, fraction: np.ndarray) -> np.ndarray:
+    # same formula as np.percentile, so that results match exactly
+    diff = upper - lower
+    return np.where(
+        fraction >= 0.5, upper - diff * (1 - fraction), lower + diff * fraction
+    )
+
+
+def group_quantiles(
+    group_ids: np.ndarray, values: np.ndarray, num_groups: int, quantiles
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Mean and quantiles (in percent, linear interpolation) of the values in each
+    group, from a single sort. NaN values are ignored.
+    Returns (means of shape (num_groups,), quantiles of shape (num_groups, len(quantiles))).
+    """
+    valid = ~np.isnan(values)
+    group_ids = group_ids[valid]
+    values = values[valid]
+
+    order = np.lexsort((values, group_ids))
+    sorted_values = values[order]
+    counts = np.bincount(group_ids, minlength=num_groups)
+    starts = np.cumsum(counts) - counts
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.bincount(group_ids, weights=values, minlength=num_groups) / counts
+
+    results = np.full((num_groups, len(quantiles)), np.nan)
+    has_values = counts > 0
+    for i, quantile in enumerate(quantiles):
+        position = np.asarray(quantile) / 100 * (counts[has_values] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, counts[has_values] - 1)
+        offset = starts[has_values]
+        results[has_values, i] = _lerp(
+            sorted_values[offset + lower],
+            sorted_values[offset + upper],
+            position - lower,
+        )
+    return means, results
+
+
+def _format_quantile(quantile) -> str:
+    return f"{quantile:g}".replace(".", "_")
+
+
+def build_ridership_percentiles(
+    aggregated_ridership: pd.DataFrame, quantiles=QUANTILES
+) -> pd.DataFrame:
+    """
+    Network-wide mean and quantiles of tap in and tap out volume for each hour
+    and day type. Columns follow ridership_percentiles.csv:
+    TIME_PER_HOUR, DAY_TYPE, TAP_IN_MEAN, TAP_IN_<q>..., TAP_OUT_MEAN, TAP_OUT_<q>...
+    """
+    groups = aggregated_ridership.groupby(GROUP_COLUMNS, sort=True)
+    group_ids = groups.ngroup().to_numpy()
+    percentiles = groups.size().reset_index()[GROUP_COLUMNS]
+
+    for prefix, column in VALUE_COLUMNS.items():
+        means, values = group_quantiles(
+            group_ids,
+            aggregated_ridership[column].to_numpy(dtype=np.float64),
+            len(percentiles),
+            quantiles,
+        )
+        percentiles[f"{prefix}_MEAN"] = means
+        for i, quantile in enumerate(quantiles):
+            percentiles[f"{prefix}_{_format_quantile(quantile)}"] = values[:, i]
+    return percentiles
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch for non-negative values, with logarithmic buckets
+    so that every value is estimated within `relative_accuracy` from its
+    bucket. Quantiles interpolate between the estimates of the two values
+    around the rank, as np.percentile does between the values, so they are
+    within `relative_accuracy` of the exact percentiles too. Values are
+    counted, not stored.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.zero_count = 0
+        self.bucket_counts = {}
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, values: np.ndarray) -> "QuantileSketch":
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if (values < 0).any():
+            raise ValueError("QuantileSketch only supports non-negative values")
+
+        self.count += len(values)
+        self.total += float(values.sum())
+        is_zero = values <= self.min_value
+        self.zero_count += int(is_zero.sum())
+
+        buckets = np.ceil(np.log(values[~is_zero]) / math.log(self.gamma)).astype(
+            np.int64
+        )
+        for bucket, count in zip(*np.unique(buckets, return_counts=True)):
+            self.bucket_counts[bucket] = self.bucket_counts.get(bucket, 0) + int(count)
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        self.count += other.count
+        self.total += other.total
+        self.zero_count += other.zero_count
+        for bucket, count in other.bucket_counts.items():
+            self.bucket_counts[bucket] = self.bucket_counts.get(bucket, 0) + count
+        return self
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else np.nan
+
+    def quantiles(self, quantiles) -> np.ndarray:
+        """
+        Approximate quantiles (in percent) of the values seen so far.
+        """
+        if self.count == 0:
+            return np.full(len(quantiles), np.nan)
+
+        buckets = np.array(sorted(self.bucket_counts), dtype=np.int64)
+        cumulative = self.zero_count + np.cumsum(
+            [self.bucket_counts[bucket] for bucket in buckets]
+        )
+        # value of the bucket holding the rank, at the middle of the bucket
+        bucket_values = 2 * self.gamma**buckets / (self.gamma + 1)
+
+        def values_at(ranks: np.ndarray) -> np.ndarray:
+            # estimated value of each (integer) rank
+            values = np.zeros(len(ranks))
+            in_buckets = ranks >= self.zero_count
+            positions = np.searchsorted(cumulative, ranks[in_buckets], side="right")
+            values[in_buckets] = bucket_values[np.minimum(positions, len(buckets) - 1)]
+            return values
+
+        ranks = np.asarray(quantiles, dtype=np.float64) / 100 * (self.count - 1)
+        lower = np.floor(ranks)
+        upper = np.minimum(lower + 1, self.count - 1)
+        return _lerp(values_at(lower), values_at(upper), ranks - lower)
+
+
+def build_percentile_sketches(
+    ridership: pd.DataFrame, relative_accuracy: float = 0.01
+) -> dict:
+    """
+    Sketch tap in and tap out volume for each (TIME_PER_HOUR, DAY_TYPE) group
+    of a chunk of rows. Returns {group: {"TAP_IN": sketch, "TAP_OUT": sketch}}.
+    """
+    sketches = {}
+    for group, group_ridership in ridership.groupby(GROUP_COLUMNS):
+        sketches[group] = {
+            prefix: QuantileSketch(relative_accuracy).update(
+                group_ridership[column].to_numpy()
+            )
+            for prefix, column in VALUE_COLUMNS.items()
+        }
+    return sketches
+
+
+def merge_percentile_sketches(sketches: dict, other: dict) -> dict:
+    """
+    Merge the group sketches of another chunk into `sketches`.
+    """
+    for group, group_sketches in other.items():
+        if group not in sketches:
+            sketches[group] = group_sketches
+            continue
+        for prefix, sketch in group_sketches.items():
+            sketches[group][prefix].merge(sketch)
+    return sketches
+
+
+def sketch_ridership_percentiles(sketches: dict, quantiles=QUANTILES) -> pd.DataFrame:
+    """
+    Same table as build_ridership_percentiles, read off the merged sketches.
+    """
+    rows = []
+    for group in sorted(sketches):
+        row = dict(zip(GROUP_COLUMNS, group))
+        for prefix, sketch in sketches[group].items():
+            row[f"{prefix}_MEAN"] = sketch.mean()
+            for quantile, value in zip(quantiles, sketch.quantiles(quantiles)):
+                row[f"{prefix}_{_format_quantile(quantile)}"] = value
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build ridership_percentiles.csv")
+    parser.add_argument("aggregated_ridership", help="path to aggregated_ridership.csv")
+    parser.add_argument("output", help="path to write ridership_percentiles.csv")
+    parser.add_argument(
+        "--quantiles", type=float, nargs="+", default=list(QUANTILES)
+    )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="read the input in chunks and merge quantile sketches",
+    )
+    parser.add_argument("--chunksize", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if args.approximate:
+        sketches = {}
+        for chunk in pd.read_csv(args.aggregated_ridership, chunksize=args.chunksize):
+            merge_percentile_sketches(sketches, build_percentile_sketches(chunk))
+        percentiles = sketch_ridership_percentiles(sketches, args.quantiles)
+    else:
+        percentiles = build_ridership_percentiles(
+            pd.read_csv(args.aggregated_ridership), args.quantiles
+        )
+    percentiles.to_csv(args.output, index=False)
+    print(f"Saved {len(percentiles)} rows to {args.output}")
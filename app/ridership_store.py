@@ -0,0 +1,260 @@
+"""
+Month-partitioned store for bus stop ridership (LTA passenger volume by bus stop).
+
+Each YEAR_MONTH is kept in its own partition folder, next to its sufficient
+statistics (sum of tap in/out volume and row count per stop, hour, day type
+and PT type). A running total over all partitions is kept up to date on
+append, so aggregated_ridership (the mean over months, as in
+ridership_final.ipynb) and rolling windows over the last N months are computed
+from the statistics without reading raw rows again.
+
+Every append writes new files tagged with the store's next version, and then
+switches the manifest to them in one atomic replace. A crash before that leaves
+the store at its previous version, so retrying the append cannot count a
+month twice.
+
+    store/
+        manifest.json
+        totals-<version>.csv
+        YEAR_MONTH=2024-07/rows-<version>.csv.gz
+        YEAR_MONTH=2024-07/stats-<version>.csv
+
+Usage:
+    python app/ridership_store.py append data/raw/BusRideVolume_202410.csv
+    python app/ridership_store.py aggregate data/cleaned/aggregated_ridership.csv --last 3
+"""
+
+import argparse
+import json
+import os
+
+import pandas as pd
+
+STORE_FOLDER = os.path.join("data", "ridership_store")
+KEY_COLUMNS = ["DAY_TYPE", "TIME_PER_HOUR", "PT_TYPE", "Destination_Stop"]
+STAT_COLUMNS = ["TAP_IN_SUM", "TAP_OUT_SUM", "ROW_COUNT"]
+
+
+def _partition_folder(store_folder: str, year_month: str) -> str:
+    return os.path.join(store_folder, f"YEAR_MONTH={year_month}")
+
+
+def _read_manifest(store_folder: str) -> dict:
+    manifest_path = os.path.join(store_folder, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {"partitions": {}}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _versioned(file: str, version) -> str:
+    # stores written before versioning have unversioned files
+    if not version:
+        return file
+    name, ext = file.split(".", 1)
+    return f"{name}-{version}.{ext}"
+
+
+def _totals_path(store_folder: str, manifest: dict) -> str:
+    return os.path.join(store_folder, _versioned("totals.csv", manifest.get("version")))
+
+
+def _partition_path(store_folder: str, year_month: str, entry: dict, file: str) -> str:
+    return os.path.join(
+        _partition_folder(store_folder, year_month), _versioned(file, entry.get("version"))
+    )
+
+
+def _write_manifest(store_folder: str, manifest: dict) -> None:
+    manifest_path = os.path.join(store_folder, "manifest.json")
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def _read_stats(path: str) -> pd.DataFrame:
+    return pd.read_csv(path, dtype={"DAY_TYPE": str, "PT_TYPE": str})
+
+
+def store_version(store_folder: str = STORE_FOLDER) -> int:
+    """
+    Version of the store, increased by every append (0 if empty).
+    """
+    return _read_manifest(store_folder).get("version", 0)
+
+
+def list_partitions(store_folder: str = STORE_FOLDER) -> list[str]:
+    """
+    YEAR_MONTH values in the store, oldest first.
+    """
+    return sorted(_read_manifest(store_folder)["partitions"])
+
+
+def partition_stats(ridership: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sufficient statistics of one month of raw ridership rows.
+    """
+    ridership = ridership.rename(columns={"PT_CODE": "Destination_Stop"})
+    return (
+        ridership.groupby(KEY_COLUMNS)
+        .agg(
+            TAP_IN_SUM=("TOTAL_TAP_IN_VOLUME", "sum"),
+            TAP_OUT_SUM=("TOTAL_TAP_OUT_VOLUME", "sum"),
+            ROW_COUNT=("TOTAL_TAP_IN_VOLUME", "size"),
+        )
+        .reset_index()
+    )
+
+
+def _add_stats(total: pd.DataFrame, stats: pd.DataFrame, sign: int = 1) -> pd.DataFrame:
+    stats = stats.set_index(KEY_COLUMNS)[STAT_COLUMNS] * sign
+    if total is None:
+        return stats.reset_index()
+    total = total.set_index(KEY_COLUMNS)[STAT_COLUMNS].add(stats, fill_value=0)
+    # keys that no longer appear in any month
+    total = total[total["ROW_COUNT"] > 0]
+    return total.reset_index()
+
+
+def append_month(ridership: pd.DataFrame, store_folder: str = STORE_FOLDER) -> list[str]:
+    """
+    Add raw ridership rows (one or more YEAR_MONTH values) to the store.
+    A month that is already stored is replaced. The running totals are updated
+    with the difference only. Returns the months written.
+    """
+    os.makedirs(store_folder, exist_ok=True)
+    manifest = _read_manifest(store_folder)
+    old_manifest = json.loads(json.dumps(manifest))
+    old_totals_path = _totals_path(store_folder, manifest)
+    totals = _read_stats(old_totals_path) if os.path.exists(old_totals_path) else None
+    version = manifest.get("version", 0) + 1
+
+    months = []
+    for year_month, month_rows in ridership.groupby("YEAR_MONTH"):
+        year_month = str(year_month)
+        print(f"Storing ridership for {year_month} ({len(month_rows)} rows)...")
+        if year_month in manifest["partitions"]:
+            old_entry = manifest["partitions"][year_month]
+            totals = _add_stats(
+                totals,
+                _read_stats(_partition_path(store_folder, year_month, old_entry, "stats.csv")),
+                sign=-1,
+            )
+
+        entry = {"rows": len(month_rows), "version": version}
+        os.makedirs(_partition_folder(store_folder, year_month), exist_ok=True)
+        stats = partition_stats(month_rows)
+        month_rows.to_csv(
+            _partition_path(store_folder, year_month, entry, "rows.csv.gz"), index=False
+        )
+        stats.to_csv(_partition_path(store_folder, year_month, entry, "stats.csv"), index=False)
+        totals = _add_stats(totals, stats)
+
+        manifest["partitions"][year_month] = entry
+        months.append(year_month)
+
+    if totals is not None:
+        manifest["version"] = version
+        totals_path = _totals_path(store_folder, manifest)
+        totals.to_csv(f"{totals_path}.tmp", index=False)
+        os.replace(f"{totals_path}.tmp", totals_path)
+    # the new version only becomes visible here
+    _write_manifest(store_folder, manifest)
+
+    # remove the files of the previous version
+    superseded = [old_totals_path] if totals is not None else []
+    for year_month in months:
+        if year_month in old_manifest["partitions"]:
+            old_entry = old_manifest["partitions"][year_month]
+            superseded += [
+                _partition_path(store_folder, year_month, old_entry, file)
+                for file in ["rows.csv.gz", "stats.csv"]
+            ]
+    for path in superseded:
+        if os.path.exists(path):
+            os.remove(path)
+    return months
+
+
+def read_month(year_month: str, store_folder: str = STORE_FOLDER) -> pd.DataFrame:
+    """
+    Raw ridership rows of one stored month.
+    """
+    entry = _read_manifest(store_folder)["partitions"][year_month]
+    return pd.read_csv(_partition_path(store_folder, year_month, entry, "rows.csv.gz"))
+
+
+def _stats_to_means(stats: pd.DataFrame) -> pd.DataFrame:
+    aggregated_ridership = stats[KEY_COLUMNS].copy()
+    aggregated_ridership["TOTAL_TAP_IN_VOLUME"] = stats["TAP_IN_SUM"] / stats["ROW_COUNT"]
+    aggregated_ridership["TOTAL_TAP_OUT_VOLUME"] = (
+        stats["TAP_OUT_SUM"] / stats["ROW_COUNT"]
+    )
+    return aggregated_ridership.sort_values(KEY_COLUMNS).reset_index(drop=True)
+
+
+def aggregate_ridership(
+    store_folder: str = STORE_FOLDER,
+    months: list[str] = None,
+    last_n_months: int = None,
+) -> pd.DataFrame:
+    """
+    aggregated_ridership (mean tap in/out volume per stop, hour, day type and
+    PT type) over all stored months, the given months, or the last N months.
+    Only the per-month statistics are read. Raises a ValueError if the store
+    has no months.
+    """
+    manifest = _read_manifest(store_folder)
+    if not manifest["partitions"]:
+        raise ValueError(f"Ridership store is empty: {store_folder}")
+    if months is None and last_n_months is None:
+        return _stats_to_means(_read_stats(_totals_path(store_folder, manifest)))
+
+    stored_months = sorted(manifest["partitions"])
+    if months is None:
+        if last_n_months < 1:
+            raise ValueError(f"last_n_months must be at least 1, got {last_n_months}")
+        months = stored_months[-last_n_months:]
+    if not months:
+        raise ValueError("No months to aggregate")
+    missing = sorted(set(months) - set(stored_months))
+    if missing:
+        raise ValueError(f"Months not in ridership store: {missing}")
+
+    stats = None
+    for year_month in months:
+        stats = _add_stats(
+            stats,
+            _read_stats(
+                _partition_path(
+                    store_folder, year_month, manifest["partitions"][year_month], "stats.csv"
+                )
+            ),
+        )
+    return _stats_to_means(stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Month-partitioned ridership store")
+    parser.add_argument("--store", default=STORE_FOLDER)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    append_parser = subparsers.add_parser("append", help="add months of raw ridership")
+    append_parser.add_argument("files", nargs="+")
+
+    aggregate_parser = subparsers.add_parser(
+        "aggregate", help="write aggregated_ridership.csv"
+    )
+    aggregate_parser.add_argument("output")
+    aggregate_parser.add_argument("--last", type=int, help="only the last N months")
+    aggregate_parser.add_argument("--months", nargs="+", help="only these months")
+
+    args = parser.parse_args()
+    if args.command == "append":
+        for file in args.files:
+            months = append_month(pd.read_csv(file), args.store)
+            print(f"Stored {months} from {file}")
+    else:
+        aggregated_ridership = aggregate_ridership(args.store, args.months, args.last)
+        aggregated_ridership.to_csv(args.output, index=False)
+        print(f"Saved {len(aggregated_ridership)} rows to {args.output}")
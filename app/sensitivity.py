@@ -0,0 +1,164 @@
+"""
+Weight-sensitivity analysis for the final ranking (combined_analysis.ipynb).
+
+The final ranking scores each identified service with one hand-picked weight
+vector. Here every service is scored under thousands of sampled weight vectors
+at once (a single matrix multiplication over the metric table), to see how
+stable each route's rank is and for which weights it reaches the top N.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# weights used for the final ranking in combined_analysis.ipynb
+WEIGHTS = {
+    "Max_Consecutive_Segments": 0.25,
+    "Weighted_Average_Score": 0.50,
+    "Weekday_Percentage_Exceed": 0.15,
+    "Weekend_Percentage_Exceed": 0.10,
+}
+EXCLUDED_LINES = ["LRT", "Jurong Region", "Cross Island"]
+MIN_CONSECUTIVE_SEGMENTS = 4
+
+
+def build_metric_table(
+    ridership_analysis: pd.DataFrame,
+    geospatial_analysis: pd.DataFrame,
+    trunk_services: list[str] = None,
+) -> pd.DataFrame:
+    """
+    Same selection as combined_analysis.ipynb: services running alongside an MRT
+    line (excluding LRT, Jurong Region and Cross Island lines) for more than
+    4 consecutive segments, joined with their ridership analysis.
+    - ridership_analysis: ridership_analysis_final.csv
+    - geospatial_analysis: BusMRTOverlap.csv
+    - trunk_services: if given, only keep these services
+    """
+    ridership = ridership_analysis.dropna()
+    if trunk_services is not None:
+        ridership = ridership[ridership["ServiceNo"].isin(trunk_services)]
+
+    identified = geospatial_analysis[
+        ~geospatial_analysis["MRT_Line"].str.contains("|".join(EXCLUDED_LINES))
+        & (geospatial_analysis["Max_Consecutive_Segments"] > MIN_CONSECUTIVE_SEGMENTS)
+    ]
+    metric_table = ridership.merge(
+        identified, left_on="ServiceNo", right_on="Bus_ServiceNo"
+    ).drop(columns=["Bus_ServiceNo"])
+    return metric_table.reset_index(drop=True)
+
+
+def final_ranking(metric_table: pd.DataFrame, weights: dict = WEIGHTS) -> pd.DataFrame:
+    """
+    The metric table with the Weighted_Total_Score of combined_analysis.ipynb,
+    highest first.
+    """
+    weights = pd.DataFrame([weights])
+    ranking = metric_table.copy()
+    ranking["Weighted_Total_Score"] = score_weight_samples(metric_table, weights)[0]
+    return ranking.sort_values(
+        "Weighted_Total_Score", ascending=False, kind="stable"
+    ).reset_index(drop=True)
+
+
+def sample_weights(
+    num_samples: int,
+    metrics: list[str] = None,
+    concentration: float = 1.0,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Sample weight vectors uniformly (concentration=1) from the simplex of
+    non-negative weights summing to 1. Higher concentrations sample closer to
+    equal weights.
+    """
+    metrics = metrics or list(WEIGHTS)
+    rng = np.random.default_rng(seed)
+    samples = rng.dirichlet(np.full(len(metrics), concentration), size=num_samples)
+    return pd.DataFrame(samples, columns=metrics)
+
+
+def score_weight_samples(metric_table: pd.DataFrame, weights: pd.DataFrame) -> np.ndarray:
+    """
+    Weighted total score of every route under every weight vector,
+    as a (num_samples, num_routes) array.
+    """
+    metric_values = metric_table[list(weights.columns)].to_numpy(dtype=np.float64)
+    return weights.to_numpy(dtype=np.float64) @ metric_values.T
+
+
+def rank_scores(scores: np.ndarray) -> np.ndarray:
+    """
+    Rank (1 = highest score) of every route in every row of the score array.
+    """
+    num_samples, num_routes = scores.shape
+    order = np.argsort(-scores, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    ranks[np.arange(num_samples)[:, None], order] = np.arange(1, num_routes + 1)
+    return ranks
+
+
+def rank_distribution(ranks: np.ndarray) -> np.ndarray:
+    """
+    Share of weight samples in which each route takes each rank,
+    as a (num_routes, num_routes) array indexed by [route, rank - 1].
+    """
+    num_samples, num_routes = ranks.shape
+    routes = np.broadcast_to(np.arange(num_routes), ranks.shape)
+    counts = np.bincount(
+        (routes * num_routes + ranks - 1).ravel(), minlength=num_routes * num_routes
+    )
+    return counts.reshape(num_routes, num_routes) / num_samples
+
+
+def weight_sensitivity(
+    metric_table: pd.DataFrame,
+    num_samples: int = 10000,
+    top_n: int = 3,
+    concentration: float = 1.0,
+    seed: int = 0,
+    baseline_weights: dict = WEIGHTS,
+) -> pd.DataFrame:
+    """
+    Rank every route under `num_samples` sampled weight vectors.
+    Resultant df has one row per route in the metric table, with these columns:
+    - ServiceNo, MRT_Line
+    - Baseline_Rank: rank under the baseline weights
+    - Mean_Rank, Rank_Std, Best_Rank, Worst_Rank
+    - Baseline_Rank_Share: share of samples giving the baseline rank
+    - Top_N_Share: share of samples placing the route in the top N
+    - <metric>_Min / _Mean / _Max: range of each weight over the samples that
+      place the route in the top N (NaN if it never gets there)
+    """
+    metrics = list(baseline_weights)
+    weights = sample_weights(num_samples, metrics, concentration, seed)
+    ranks = rank_scores(score_weight_samples(metric_table, weights))
+
+    baseline = pd.DataFrame([baseline_weights], columns=metrics)
+    baseline_ranks = rank_scores(score_weight_samples(metric_table, baseline))[0]
+
+    in_top_n = ranks <= top_n
+
+    result = metric_table[["ServiceNo", "MRT_Line"]].copy()
+    result["Baseline_Rank"] = baseline_ranks
+    result["Mean_Rank"] = ranks.mean(axis=0)
+    result["Rank_Std"] = ranks.std(axis=0)
+    result["Best_Rank"] = ranks.min(axis=0)
+    result["Worst_Rank"] = ranks.max(axis=0)
+    result["Baseline_Rank_Share"] = (ranks == baseline_ranks).mean(axis=0)
+    result["Top_N_Share"] = in_top_n.mean(axis=0)
+
+    # region of weight space in which each route makes the top N
+    weight_values = weights.to_numpy()
+    with warnings.catch_warnings():
+        # routes that never make the top N get NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for i, metric in enumerate(metrics):
+            region = np.where(in_top_n, weight_values[:, [i]], np.nan)
+            result[f"{metric}_Min"] = np.nanmin(region, axis=0)
+            result[f"{metric}_Mean"] = np.nanmean(region, axis=0)
+            result[f"{metric}_Max"] = np.nanmax(region, axis=0)
+
+    return result.sort_values(["Baseline_Rank"]).reset_index(drop=True)
@@ -0,0 +1,189 @@
+"""
+Bus stops on opposite sides of a road, paired into stop groups.
+
+Most stops have a twin across the road ("OPP BLK 123" and "BLK 123"), so
+counting stops double counts places. Candidate pairs come from a KDTree radius
+self-join over the projected stop locations, and are ranked by how well their
+descriptions match and then by distance:
+1. one description is the other with "OPP" in front, within OPPOSITE_RADIUS_METERS
+2. the same description once "OPP"/"BEF"/"AFT" are removed, within
+   SAME_NAME_RADIUS_METERS
+3. any other stop within NEARBY_RADIUS_METERS
+Pairs are then accepted best first, so every stop is paired with at most one
+other stop, and both are each other's best remaining match.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from whatif import projected_xy
+
+OPPOSITE_RADIUS_METERS = 150
+SAME_NAME_RADIUS_METERS = 100
+NEARBY_RADIUS_METERS = 40
+POSITION_PREFIXES = ("OPP", "BEF", "AFT")
+
+
+def normalise_description(description) -> str:
+    """
+    Upper-case description without punctuation, extra spaces or a leading
+    "OPP"/"BEF"/"AFT".
+    """
+    if not isinstance(description, str):
+        return ""
+    words = re.sub(r"[^\w ]", " ", description.upper()).split()
+    if words and words[0] in POSITION_PREFIXES:
+        words = words[1:]
+    return " ".join(words)
+
+
+def _is_opposite(a, b) -> bool:
+    # "OPP X" and "X", in either order
+    a, b = str(a).upper().strip(), str(b).upper().strip()
+    return bool(a) and bool(b) and (a == f"OPP {b}" or b == f"OPP {a}")
+
+
+def find_stop_pairs(bus_stops) -> pd.DataFrame:
+    """
+    Opposite stops paired by the matching above. Stops without a location are
+    never paired.
+    Resultant df has columns Stop_A, Stop_B (BUS_STOP_N), Distance_m, Match
+    ("Opposite", "Same name" or "Nearby").
+    """
+    # sklearn is slow to import, only import it when pairs are built
+    from sklearn.neighbors import KDTree
+
+    print("Pairing opposite bus stops...")
+    bus_stops = bus_stops[bus_stops.geometry.notna()].drop_duplicates("BUS_STOP_N")
+    codes = bus_stops["BUS_STOP_N"].astype(str).to_numpy()
+    descriptions = bus_stops["LOC_DESC"].to_numpy()
+    xy = projected_xy(bus_stops)
+
+    # candidate pairs (a < b) within the largest radius
+    radius = max(OPPOSITE_RADIUS_METERS, SAME_NAME_RADIUS_METERS, NEARBY_RADIUS_METERS)
+    neighbours, distances = KDTree(xy).query_radius(xy, r=radius, return_distance=True)
+    lengths = np.array([len(n) for n in neighbours], dtype=np.int64)
+    a = np.repeat(np.arange(len(codes)), lengths)
+    b = np.concatenate(neighbours).astype(np.int64) if len(codes) else a
+    distance = np.concatenate(distances) if len(codes) else np.zeros(0)
+    keep = a < b
+    a, b, distance = a[keep], b[keep], distance[keep]
+
+    # rank: 0 = opposite, 1 = same name, 2 = nearby, 3 = no match
+    names = np.array([normalise_description(d) for d in descriptions], dtype=object)
+    same_name = (names[a] == names[b]) & (names[a] != "")
+    opposite = np.array(
+        [_is_opposite(descriptions[i], descriptions[j]) for i, j in zip(a, b)],
+        dtype=bool,
+    )
+    rank = np.full(len(a), 3)
+    rank[distance <= NEARBY_RADIUS_METERS] = 2
+    rank[same_name & (distance <= SAME_NAME_RADIUS_METERS)] = 1
+    rank[opposite & (distance <= OPPOSITE_RADIUS_METERS)] = 0
+    candidates = np.flatnonzero(rank < 3)
+
+    # best first; each stop is paired at most once
+    order = candidates[np.lexsort((distance[candidates], rank[candidates]))]
+    paired = np.zeros(len(codes), dtype=bool)
+    pairs = []
+    for i in order:
+        if paired[a[i]] or paired[b[i]]:
+            continue
+        paired[a[i]] = paired[b[i]] = True
+        pairs.append(i)
+    pairs = np.array(pairs, dtype=np.int64)
+
+    match_names = np.array(["Opposite", "Same name", "Nearby"])
+    return pd.DataFrame(
+        {
+            "Stop_A": codes[a[pairs]],
+            "Stop_B": codes[b[pairs]],
+            "Distance_m": np.round(distance[pairs], 1),
+            "Match": match_names[rank[pairs]],
+        }
+    )
+
+
+def build_stop_groups(bus_stops) -> pd.DataFrame:
+    """
+    Stop -> stop group mapping of every bus stop. A group is a pair of
+    opposite stops, or a single stop, and is named after its lowest stop code.
+    Resultant df has columns BUS_STOP_N, Stop_Group, Group_Size, Paired_Stop,
+    Distance_m (to the paired stop) and Match (see find_stop_pairs).
+    """
+    pairs = find_stop_pairs(bus_stops)
+    codes = bus_stops["BUS_STOP_N"].astype(str).drop_duplicates()
+
+    both_ways = pd.concat(
+        [
+            pairs,
+            pairs.rename(columns={"Stop_A": "Stop_B", "Stop_B": "Stop_A"}),
+        ],
+        ignore_index=True,
+    ).rename(columns={"Stop_A": "BUS_STOP_N", "Stop_B": "Paired_Stop"})
+    stop_groups = pd.DataFrame({"BUS_STOP_N": codes.to_numpy()}).merge(
+        both_ways, on="BUS_STOP_N", how="left"
+    )
+    stop_groups["Stop_Group"] = np.where(
+        stop_groups["Paired_Stop"].notna(),
+        np.minimum(
+            stop_groups["BUS_STOP_N"].to_numpy(dtype=object),
+            stop_groups["Paired_Stop"].fillna("").to_numpy(dtype=object),
+        ),
+        stop_groups["BUS_STOP_N"],
+    )
+    stop_groups["Group_Size"] = np.where(stop_groups["Paired_Stop"].notna(), 2, 1)
+    return stop_groups[
+        ["BUS_STOP_N", "Stop_Group", "Group_Size", "Paired_Stop", "Distance_m", "Match"]
+    ]
+
+
+def get_group_locations(stop_groups: pd.DataFrame, bus_stops) -> pd.DataFrame:
+    """
+    Location of every stop group (midpoint of its stops), for proximity queries
+    at group level.
+    Resultant df has columns Stop_Group, Group_Size, latitude, longitude.
+    """
+    bus_stops = bus_stops[bus_stops.geometry.notna()].to_crs(4326)
+    locations = pd.DataFrame(
+        {
+            "BUS_STOP_N": bus_stops["BUS_STOP_N"].astype(str).to_numpy(),
+            "latitude": bus_stops.geometry.y.to_numpy(),
+            "longitude": bus_stops.geometry.x.to_numpy(),
+        }
+    ).drop_duplicates("BUS_STOP_N")
+    return (
+        stop_groups[["BUS_STOP_N", "Stop_Group", "Group_Size"]]
+        .merge(locations, on="BUS_STOP_N")
+        .groupby(["Stop_Group", "Group_Size"], as_index=False)[["latitude", "longitude"]]
+        .mean()
+    )
+
+
+def aggregate_ridership_by_group(
+    ridership: pd.DataFrame, stop_groups: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    aggregated_ridership summed over the stops of each stop group.
+    Stops that are not in BusStops are their own group.
+    Resultant df has columns DAY_TYPE, TIME_PER_HOUR, PT_TYPE, Stop_Group,
+    TOTAL_TAP_IN_VOLUME, TOTAL_TAP_OUT_VOLUME.
+    """
+    # Destination_Stop is numeric, BUS_STOP_N may have leading zeros
+    group_of_stop = pd.Series(
+        stop_groups["Stop_Group"].to_numpy(),
+        index=pd.to_numeric(stop_groups["BUS_STOP_N"], errors="coerce"),
+    )
+    group_of_stop = group_of_stop[
+        group_of_stop.index.notna() & ~group_of_stop.index.duplicated()
+    ]
+    stops = ridership["Destination_Stop"]
+    groups = stops.map(group_of_stop)
+    ridership = ridership.assign(
+        Stop_Group=groups.fillna(stops.astype(str)).astype(str)
+    )
+    return ridership.groupby(
+        ["DAY_TYPE", "TIME_PER_HOUR", "PT_TYPE", "Stop_Group"], as_index=False
+    )[["TOTAL_TAP_IN_VOLUME", "TOTAL_TAP_OUT_VOLUME"]].sum()
@@ -0,0 +1,209 @@
+"""
+Array-backed inverted indexes between bus stops and bus services.
+
+Built once from `BusRoutes`, in CSR form: for a row i, its entries are
+values[offsets[i]:offsets[i + 1]]. Stops, services and routes (a service in one
+direction of travel) are referred to by integer ids, so "which services serve
+stop X" and "which stops does service Y visit, in order" are array slices.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def to_csr(rows: np.ndarray, num_rows: int, *values: np.ndarray):
+    """
+    Group the values by row id and return (offsets, *grouped values).
+    The relative order of values within a row is preserved.
+    """
+    order = np.argsort(rows, kind="stable")
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=offsets[1:])
+    return (offsets, *(value[order] for value in values))
+
+
+def gather_rows(offsets: np.ndarray, rows: np.ndarray):
+    """
+    Positions of all entries of the given CSR rows, and the index (into `rows`)
+    of the row each entry belongs to.
+    """
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    within_row = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return within_row + np.repeat(starts, lengths), owner
+
+
+def build_stop_service_index(bus_routes: pd.DataFrame, bus_stops=None) -> dict:
+    """
+    Build the stop <-> service indexes from BusRoutes. If BusStops is given,
+    the row position of each stop in it is also stored ("stop_rows", -1 if missing).
+    """
+    print("Building stop-service index...")
+    bus_routes = bus_routes.sort_values(["ServiceNo", "Direction", "StopSequence"])
+    services = bus_routes["ServiceNo"].astype(str).to_numpy()
+    directions = bus_routes["Direction"].to_numpy().astype(np.int64)
+    stops = bus_routes["BusStopCode"].astype(str).to_numpy()
+
+    service_names, service_ids = np.unique(services, return_inverse=True)
+    stop_codes, stop_ids = np.unique(stops, return_inverse=True)
+
+    # a route is one service in one direction of travel
+    route_keys, route_ids = np.unique(
+        np.column_stack([service_ids, directions]), axis=0, return_inverse=True
+    )
+    route_ids = route_ids.ravel()
+    route_service = route_keys[:, 0]
+    route_direction = route_keys[:, 1]
+
+    # route -> stops, in stop sequence order (rows are already sorted)
+    route_offsets, route_stops, route_sequences = to_csr(
+        route_ids,
+        len(route_keys),
+        stop_ids,
+        bus_routes["StopSequence"].to_numpy(),
+    )
+
+    # stop -> routes, each route once
+    route_stop_pairs = np.unique(np.column_stack([stop_ids, route_ids]), axis=0)
+    stop_route_offsets, stop_routes = to_csr(
+        route_stop_pairs[:, 0], len(stop_codes), route_stop_pairs[:, 1]
+    )
+
+    # service <-> stops, both directions combined
+    service_stop_pairs = np.unique(np.column_stack([service_ids, stop_ids]), axis=0)
+    service_offsets, service_stops = to_csr(
+        service_stop_pairs[:, 0], len(service_names), service_stop_pairs[:, 1]
+    )
+    stop_service_offsets, stop_services = to_csr(
+        service_stop_pairs[:, 1], len(stop_codes), service_stop_pairs[:, 0]
+    )
+
+    index = {
+        "service_names": service_names,
+        "stop_codes": stop_codes,
+        "route_service": route_service,
+        "route_direction": route_direction,
+        "route_lookup": {
+            (service_names[service], int(direction)): route
+            for route, (service, direction) in enumerate(route_keys)
+        },
+        "route_offsets": route_offsets,
+        "route_stops": route_stops,
+        "route_sequences": route_sequences,
+        "stop_route_offsets": stop_route_offsets,
+        "stop_routes": stop_routes,
+        "service_offsets": service_offsets,
+        "service_stops": service_stops,
+        "stop_service_offsets": stop_service_offsets,
+        "stop_services": stop_services,
+    }
+
+    if bus_stops is not None:
+        stop_rows = pd.Series(
+            np.arange(len(bus_stops)),
+            index=bus_stops["BUS_STOP_N"].astype(str).to_numpy(),
+        )
+        # keep the first row for stop codes that appear more than once
+        stop_rows = stop_rows[~stop_rows.index.duplicated()]
+        index["stop_rows"] = stop_rows.reindex(stop_codes, fill_value=-1).to_numpy()
+    return index
+
+
+def get_stop_id(index: dict, stop_code) -> int:
+    """
+    Integer id of a bus stop code, or -1 if no service stops there.
+    """
+    stop_code = str(stop_code)
+    position = np.searchsorted(index["stop_codes"], stop_code)
+    if position < len(index["stop_codes"]) and index["stop_codes"][position] == stop_code:
+        return int(position)
+    return -1
+
+
+def get_service_id(index: dict, service_no) -> int:
+    """
+    Integer id of a bus service, or -1 if it is not in BusRoutes.
+    """
+    service_no = str(service_no)
+    position = np.searchsorted(index["service_names"], service_no)
+    if (
+        position < len(index["service_names"])
+        and index["service_names"][position] == service_no
+    ):
+        return int(position)
+    return -1
+
+
+def get_stop_ids_for_service(index: dict, service_no, direction: int = None) -> np.ndarray:
+    """
+    Integer ids of the stops visited by a service. With a direction, the stops
+    are in stop sequence order (loop services may visit a stop twice); without
+    one, the unique stops over both directions are returned.
+    """
+    if direction is None:
+        service = get_service_id(index, service_no)
+        if service < 0:
+            return index["service_stops"][:0]
+        offsets = index["service_offsets"]
+        return index["service_stops"][offsets[service] : offsets[service + 1]]
+
+    route = index["route_lookup"].get((str(service_no), int(direction)))
+    if route is None:
+        return index["route_stops"][:0]
+    offsets = index["route_offsets"]
+    return index["route_stops"][offsets[route] : offsets[route + 1]]
+
+
+def get_stops_for_service(index: dict, service_no, direction: int = None) -> np.ndarray:
+    """
+    Stop codes visited by a service, see `get_stop_ids_for_service`.
+    """
+    return index["stop_codes"][get_stop_ids_for_service(index, service_no, direction)]
+
+
+def get_services_at_stop(index: dict, stop_code, direction: int = None) -> np.ndarray:
+    """
+    Services stopping at a bus stop, optionally only those travelling in the
+    given direction.
+    """
+    stop = get_stop_id(index, stop_code)
+    if stop < 0:
+        return index["service_names"][:0]
+
+    if direction is None:
+        offsets = index["stop_service_offsets"]
+        return index["service_names"][
+            index["stop_services"][offsets[stop] : offsets[stop + 1]]
+        ]
+
+    offsets = index["stop_route_offsets"]
+    routes = index["stop_routes"][offsets[stop] : offsets[stop + 1]]
+    routes = routes[index["route_direction"][routes] == direction]
+    return index["service_names"][np.unique(index["route_service"][routes])]
+
+
+def get_route_stop_pairs(index: dict) -> pd.DataFrame:
+    """
+    Consecutive (origin, destination) stop pairs along every route, as used for
+    trip modelling.
+    """
+    route_stops = index["route_stops"]
+    route_offsets = index["route_offsets"]
+
+    # every entry except the last stop of each route starts a pair
+    is_origin = np.ones(len(route_stops), dtype=bool)
+    is_origin[route_offsets[1:] - 1] = False
+    origins = np.flatnonzero(is_origin)
+    routes = np.repeat(np.arange(len(route_offsets) - 1), np.diff(route_offsets))[origins]
+
+    return pd.DataFrame(
+        {
+            "ServiceNo": index["service_names"][index["route_service"][routes]],
+            "Direction": index["route_direction"][routes],
+            "Origin_Stop": index["stop_codes"][route_stops[origins]],
+            "Destination_Stop": index["stop_codes"][route_stops[origins + 1]],
+            "Origin_StopSequence": index["route_sequences"][origins],
+            "Destination_StopSequence": index["route_sequences"][origins + 1],
+        }
+    )
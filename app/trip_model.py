@@ -0,0 +1,185 @@
+"""
+Frequency-based trip modelling (ridership/03_Trip Modelling.ipynb), vectorized.
+
+Every consecutive stop pair of every route is matched with the origin-destination
+trips between those stops (TOTAL_TRIPS). A service's estimated number of trips
+in an hour comes from its headway in that hour's band (BusServices.json), and
+Adj_Estimated_Trips caps it at TOTAL_TRIPS, so that Adj_Estimated_Trips /
+TOTAL_TRIPS is the service's share of the trips at the stop in that hour (see
+percentile_ranks.estimate_route_ridership).
+
+The notebook parsed each headway with `mean_frequency` and looked up every
+trip row's service and band one row at a time; here the headways are parsed
+per column, turned into an hourly trips table through the HOUR_BANDS lookup,
+and joined onto all trip rows at once.
+
+Usage (from the repo root):
+    python app/trip_model.py data/BusServices.json data/raw/origin_destination_bus_202408.csv
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import core
+import stop_service_index
+
+BUS_SERVICES_FNAME = "BusServices.json"
+OD_TRIPS_FNAME = "origin_destination_bus.csv"  # origin_destination_bus_<YYYYMM>.csv
+FREQUENCY_COLUMNS = ["AM_Peak_Freq", "AM_Offpeak_Freq", "PM_Peak_Freq", "PM_Offpeak_Freq"]
+# inclusive TIME_PER_HOUR range of each headway column; other hours have no trips
+FREQUENCY_BANDS = {
+    "AM_Peak_Freq": (7, 9),
+    "AM_Offpeak_Freq": (10, 16),
+    "PM_Peak_Freq": (17, 19),
+    "PM_Offpeak_Freq": (20, 23),
+}
+
+
+def hour_bands() -> np.ndarray:
+    """
+    Lookup table of TIME_PER_HOUR (0-23) to the position of its headway column
+    in FREQUENCY_COLUMNS, or -1 for hours outside every band.
+    """
+    bands = np.full(24, -1)
+    for column, (start, end) in FREQUENCY_BANDS.items():
+        bands[start : end + 1] = FREQUENCY_COLUMNS.index(column)
+    return bands
+
+
+HOUR_BANDS = hour_bands()
+
+
+def mean_frequency(headways: pd.Series) -> pd.Series:
+    """
+    Headway in minutes of every "a-b" range, as the notebook's sum of the
+    values / 2: the mean of a range, and half of a single value.
+    "-", empty and missing headways become 0, i.e. no trips.
+    """
+    bounds = headways.astype("string").str.split("-", expand=True)
+    bounds = bounds.apply(pd.to_numeric, errors="coerce")
+    return (bounds.sum(axis=1, min_count=1) / 2).fillna(0.0)
+
+
+def build_hourly_trips(bus_services: pd.DataFrame) -> pd.DataFrame:
+    """
+    Estimated trips of every service and direction in every hour of the day,
+    floor(60 / mean headway) of the hour's band.
+    Resultant df has columns ServiceNo, Direction, Category, TIME_PER_HOUR,
+    Estimated_Trips.
+    """
+    bus_services = bus_services.assign(
+        ServiceNo=bus_services["ServiceNo"].astype(str)
+    ).drop_duplicates(["ServiceNo", "Direction"])
+    headways = np.column_stack(
+        [mean_frequency(bus_services[column]).to_numpy() for column in FREQUENCY_COLUMNS]
+    )
+    with np.errstate(divide="ignore"):
+        trips = np.where(headways > 0, np.floor(60 / headways), 0.0)
+    # a last column of zeros for hours outside every band (HOUR_BANDS -1)
+    trips = np.column_stack([trips, np.zeros(len(trips))])
+
+    num_services = len(bus_services)
+    return pd.DataFrame(
+        {
+            "ServiceNo": np.repeat(bus_services["ServiceNo"].to_numpy(), 24),
+            "Direction": np.repeat(bus_services["Direction"].to_numpy(), 24),
+            "Category": np.repeat(bus_services["Category"].to_numpy(), 24),
+            "TIME_PER_HOUR": np.tile(np.arange(24), num_services),
+            "Estimated_Trips": trips[:, HOUR_BANDS].reshape(-1),
+        }
+    )
+
+
+def build_bus_route_trips(
+    bus_routes: pd.DataFrame, bus_services: pd.DataFrame, od_trips: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    bus_route_trips.csv: origin-destination trips between consecutive stops of
+    every route, with each service's Adj_Estimated_Trips.
+    Stop pairs without trips, and stops whose code is not a number (so cannot
+    match the trips data) are dropped. Services missing from BusServices are
+    kept with 0 estimated trips and no Category, as the notebook's row-wise
+    estimate gives them (its merge for the Category column dropped them
+    instead, and added empty rows for services without trips).
+    There is no trip share column: percentile_ranks.estimate_route_ridership
+    computes Adj_Estimated_Trips / TOTAL_TRIPS itself, as it must for the
+    bus_route_trips csvs written by the notebook, which have no such column.
+    Resultant df has these columns:
+    - ServiceNo, Direction
+    - Origin_Stop, Destination_Stop, Origin_StopSequence, Destination_StopSequence
+    - DAY_TYPE, TIME_PER_HOUR, PT_TYPE, TOTAL_TRIPS
+    - Category, Max_StopSequence, Adj_Estimated_Trips
+    """
+    print("Modelling bus route trips...")
+    pairs = stop_service_index.get_route_stop_pairs(
+        stop_service_index.build_stop_service_index(bus_routes)
+    )
+    # stop codes are strings in the index and numbers in the trips data
+    for column in ["Origin_Stop", "Destination_Stop"]:
+        pairs[column] = pd.to_numeric(pairs[column], errors="coerce")
+    pairs = pairs.dropna(subset=["Origin_Stop", "Destination_Stop"]).astype(
+        {"Origin_Stop": "int64", "Destination_Stop": "int64"}
+    )
+
+    route_trips = pairs.merge(
+        od_trips[
+            [
+                "ORIGIN_PT_CODE",
+                "DESTINATION_PT_CODE",
+                "DAY_TYPE",
+                "TIME_PER_HOUR",
+                "PT_TYPE",
+                "TOTAL_TRIPS",
+            ]
+        ],
+        left_on=["Origin_Stop", "Destination_Stop"],
+        right_on=["ORIGIN_PT_CODE", "DESTINATION_PT_CODE"],
+    ).drop(columns=["ORIGIN_PT_CODE", "DESTINATION_PT_CODE"])
+    route_trips = route_trips.merge(
+        build_hourly_trips(bus_services),
+        on=["ServiceNo", "Direction", "TIME_PER_HOUR"],
+        how="left",
+    )
+    route_trips["Estimated_Trips"] = route_trips["Estimated_Trips"].fillna(0.0)
+
+    route_trips["Max_StopSequence"] = route_trips.groupby(["ServiceNo", "Direction"])[
+        "Destination_StopSequence"
+    ].transform("max")
+    route_trips["Adj_Estimated_Trips"] = np.fmin(
+        route_trips["TOTAL_TRIPS"], route_trips["Estimated_Trips"]
+    )
+    return route_trips.drop(columns=["Estimated_Trips"])
+
+
+def single_direction(bus_route_trips: pd.DataFrame) -> pd.DataFrame:
+    """
+    bus_route_trips_single_direction.csv: the first direction of every service,
+    as read by core.get_hour_count_below_25th_percentile_each_stop.
+    """
+    return bus_route_trips[bus_route_trips["Direction"] == 1].drop(
+        columns=["Direction"]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Model bus route trips from bus frequencies and origin-destination trips"
+    )
+    parser.add_argument("bus_services", help="BusServices.json")
+    parser.add_argument("od_trips", help="origin_destination_bus_<YYYYMM>.csv")
+    parser.add_argument("--data", default=core.DATA_FOLDER, help="data folder")
+    args = parser.parse_args()
+
+    bus_route_trips = build_bus_route_trips(
+        core.load_data_file(args.data, "BusRoutes.json"),
+        pd.read_json(args.bus_services),
+        pd.read_csv(args.od_trips),
+    )
+    bus_route_trips.to_csv(os.path.join(args.data, "bus_route_trips.csv"), index=False)
+    single_direction(bus_route_trips).to_csv(
+        os.path.join(args.data, "bus_route_trips_single_direction.csv"), index=False
+    )
+    print(f"Wrote {len(bus_route_trips)} bus route trips to {args.data}")
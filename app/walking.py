@@ -0,0 +1,284 @@
+"""
+Walking distances between bus stops and rail stations over a pedestrian network.
+
+Straight-line distances overstate how reachable a stop is across expressways,
+rivers and canals. Given an offline pedestrian network (a file of footpath
+LineStrings, e.g. exported from OpenStreetMap), stops and stations are snapped
+to the nearest network node and a shortest-path search is run from every
+station at once, up to a distance limit. The result is a sparse
+station -> (stop, walking distance) table in CSR form, so that "stops within
+N m walk of a station" is an array slice, like the straight-line query.
+
+Nodes are the endpoints of the footpaths and the vertices they share (their
+junctions); each edge is a footpath between two nodes and weighs its length.
+Walking to and from the snapped nodes is added in a straight line.
+
+The network is optional, so geopandas, shapely, scipy and sklearn are only
+imported when it is used.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from stop_service_index import to_csr
+
+PROJECTED_CRS = 3857  # as for the straight-line distances in the app
+WALKING_NETWORK_FNAME = "WalkingNetwork.geojson"
+MAX_WALKING_DISTANCE = 1000  # metres
+MAX_SNAP_DISTANCE = 100  # metres from a stop or station to the network
+NODE_TOLERANCE = 1  # metres, vertices closer than this are the same node
+STATION_BATCH_SIZE = 64  # stations searched from at once
+
+
+def _split_at_shared_vertices(
+    lines: np.ndarray, node_tolerance: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # vertex coordinates, and the start vertex, end vertex and length of the
+    # pieces of the lines between their endpoints and the vertices they share
+    # with other lines (or that a line passes twice), with vertices within the
+    # tolerance merged
+    import shapely
+
+    xy, line_ids = shapely.get_coordinates(lines, return_index=True)
+    vertex_keys, vertex_ids = np.unique(
+        np.round(xy / node_tolerance).astype(np.int64), axis=0, return_inverse=True
+    )
+    vertex_ids = vertex_ids.ravel()
+
+    first = np.ones(len(xy), dtype=bool)
+    first[1:] = line_ids[1:] != line_ids[:-1]
+    last = np.ones(len(xy), dtype=bool)
+    last[:-1] = first[1:]
+    shared = np.bincount(vertex_ids, minlength=len(vertex_keys))[vertex_ids] >= 2
+    is_break = first | last | shared
+
+    # every piece starts at a break that is not the end of its line, and ends
+    # at the next break
+    starts = vertex_ids[is_break & ~last]
+    ends = vertex_ids[is_break & ~first]
+    hop_pieces = np.cumsum(is_break & ~last)[~last] - 1
+    hop_lengths = np.linalg.norm(np.diff(xy, axis=0), axis=1)[~last[:-1]]
+    lengths = np.bincount(hop_pieces, weights=hop_lengths, minlength=len(starts))
+    return vertex_keys * float(node_tolerance), starts, ends, lengths
+
+
+def load_walking_network(
+    file_path: str,
+    node_tolerance: float = NODE_TOLERANCE,
+    node_crossings: bool = False,
+) -> dict:
+    """
+    Build the pedestrian graph from a file of footpath LineStrings.
+    Footpaths are joined where they share a vertex (or endpoint), as OSM ways
+    are at their junctions, including mid-way. Lines crossing without a shared
+    vertex (bridges, underpasses) are not joined, unless `node_crossings` is
+    set, for networks whose junctions are not vertices of both lines.
+    Returns a dict with:
+    - node_xy: (num_nodes, 2) node coordinates in PROJECTED_CRS
+    - graph: sparse (num_nodes, num_nodes) matrix of edge lengths, undirected
+    """
+    import geopandas as gpd
+    import shapely
+    from scipy.sparse import coo_matrix
+
+    print(f"Loading walking network ({file_path})...")
+    edges = gpd.read_file(file_path).to_crs(PROJECTED_CRS)
+    edges = edges[edges.geometry.notna()].explode(ignore_index=True)
+    edges = edges[edges.geom_type == "LineString"]
+
+    lines = edges.geometry.values
+    if node_crossings and len(lines):
+        lines = shapely.get_parts(shapely.node(shapely.multilinestrings(lines)))
+    vertex_xy, starts, ends, lengths = _split_at_shared_vertices(lines, node_tolerance)
+
+    # nodes are the vertices the pieces start or end at
+    used_vertices, node_ids = np.unique(
+        np.concatenate([starts, ends]), return_inverse=True
+    )
+    node_ids = node_ids.ravel()
+    num_nodes = len(used_vertices)
+    node_xy = vertex_xy[used_vertices]
+
+    starts, ends = node_ids[: len(starts)], node_ids[len(starts) :]
+    # keep the shortest of parallel edges; coo_matrix would sum them
+    edge_table = (
+        pd.DataFrame(
+            {
+                "start": np.minimum(starts, ends),
+                "end": np.maximum(starts, ends),
+                "length": lengths,
+            }
+        )
+        .query("start != end")
+        .groupby(["start", "end"], as_index=False)["length"]
+        .min()
+    )
+    graph = coo_matrix(
+        (edge_table["length"], (edge_table["start"], edge_table["end"])),
+        shape=(num_nodes, num_nodes),
+    ).tocsr()
+    print(f"Walking network has {num_nodes} nodes and {len(edge_table)} edges")
+    return {"node_xy": node_xy, "graph": graph}
+
+
+def _point_xy(gdf: "gpd.GeoDataFrame") -> np.ndarray:
+    points = gdf.to_crs(PROJECTED_CRS).geometry.centroid
+    return np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+
+
+def snap_to_network(
+    network: dict, points_xy: np.ndarray, max_snap_distance: float = MAX_SNAP_DISTANCE
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Nearest network node of each point and the distance to it.
+    Points further than `max_snap_distance` from the network get node -1.
+    """
+    from sklearn.neighbors import KDTree
+
+    distances, nodes = KDTree(network["node_xy"]).query(points_xy, k=1)
+    distances, nodes = distances.ravel(), nodes.ravel()
+    nodes[distances > max_snap_distance] = -1
+    return nodes, distances
+
+
+def build_walking_table(
+    network: dict,
+    rail_stations: "gpd.GeoDataFrame",
+    bus_stops: "gpd.GeoDataFrame",
+    max_distance: float = MAX_WALKING_DISTANCE,
+    max_snap_distance: float = MAX_SNAP_DISTANCE,
+) -> dict:
+    """
+    Walking distance from every station to every bus stop within `max_distance`.
+    Stations may have several rows (e.g. one per exit); the shortest walk from
+    any of them is kept.
+    Returns a dict with:
+    - station_names: sorted unique StationName values
+    - offsets, stop_codes, distances: CSR rows per station, nearest stop first
+    """
+    from scipy.sparse.csgraph import dijkstra
+
+    print("Building walking distance table...")
+    rail_stations = rail_stations[rail_stations.geometry.notna()]
+    bus_stops = bus_stops[bus_stops.geometry.notna()]
+
+    station_names, station_ids = np.unique(
+        rail_stations["StationName"].str.lower().to_numpy(), return_inverse=True
+    )
+    station_nodes, station_snaps = snap_to_network(
+        network, _point_xy(rail_stations), max_snap_distance
+    )
+    stop_codes = bus_stops["BUS_STOP_N"].astype(str).to_numpy()
+    stop_nodes, stop_snaps = snap_to_network(
+        network, _point_xy(bus_stops), max_snap_distance
+    )
+    snapped_stops = np.flatnonzero(stop_nodes >= 0)
+    snapped_stations = np.flatnonzero(station_nodes >= 0)
+
+    rows, stops, distances = [], [], []
+    for batch_start in range(0, len(snapped_stations), STATION_BATCH_SIZE):
+        batch = snapped_stations[batch_start : batch_start + STATION_BATCH_SIZE]
+        # (batch, num_nodes) network distances, inf beyond the limit
+        node_distances = dijkstra(
+            network["graph"],
+            directed=False,
+            indices=station_nodes[batch],
+            limit=max_distance,
+        )
+        walks = (
+            station_snaps[batch][:, None]
+            + node_distances[:, stop_nodes[snapped_stops]]
+            + stop_snaps[snapped_stops][None, :]
+        )
+        batch_rows, batch_stops = np.nonzero(walks <= max_distance)
+        rows.append(station_ids[batch][batch_rows])
+        stops.append(snapped_stops[batch_stops])
+        distances.append(walks[batch_rows, batch_stops])
+
+    table = pd.DataFrame(
+        {
+            "station": np.concatenate(rows) if rows else np.empty(0, dtype=np.int64),
+            "stop": np.concatenate(stops) if stops else np.empty(0, dtype=np.int64),
+            "distance": np.concatenate(distances) if distances else np.empty(0),
+        }
+    )
+    # shortest walk per station and stop (stations with several exits), nearest first
+    table = (
+        table.sort_values(["station", "distance"])
+        .drop_duplicates(["station", "stop"])
+        .reset_index(drop=True)
+    )
+    offsets, table_stops, table_distances = to_csr(
+        table["station"].to_numpy(),
+        len(station_names),
+        table["stop"].to_numpy(),
+        table["distance"].to_numpy(),
+    )
+    return {
+        "station_names": station_names,
+        "offsets": offsets,
+        "stop_codes": stop_codes[table_stops],
+        "distances": table_distances,
+    }
+
+
+def walking_table_frame(walking_table: dict) -> pd.DataFrame:
+    """
+    The walking distance table as a df with columns StationName (lower case),
+    BUS_STOP_N, Walking_Distance_m.
+    """
+    counts = np.diff(walking_table["offsets"])
+    return pd.DataFrame(
+        {
+            "StationName": np.repeat(walking_table["station_names"], counts),
+            "BUS_STOP_N": walking_table["stop_codes"],
+            "Walking_Distance_m": walking_table["distances"],
+        }
+    )
+
+
+def find_bus_stops_within_walking_distance(
+    walking_table: dict, station_name: str, radius_meters: float, bus_stops_gdf
+):
+    """
+    Same as core.find_bus_stops_within_radius, with walking distances.
+    `radius_meters` above the table's max_distance returns only the stops
+    within max_distance.
+    """
+    station_id = np.searchsorted(walking_table["station_names"], station_name.lower())
+    if (
+        station_id == len(walking_table["station_names"])
+        or walking_table["station_names"][station_id] != station_name.lower()
+    ):
+        return f"Station '{station_name}' not found.", None
+
+    row = slice(
+        walking_table["offsets"][station_id], walking_table["offsets"][station_id + 1]
+    )
+    distances = walking_table["distances"][row]
+    within = distances <= radius_meters
+    # a stop code can appear more than once; keep its shortest distance
+    walking_distances = (
+        pd.Series(distances[within], index=walking_table["stop_codes"][row][within])
+        .groupby(level=0)
+        .min()
+    )
+
+    stop_codes = bus_stops_gdf["BUS_STOP_N"].astype(str).to_numpy()
+    nearby = np.isin(stop_codes, walking_distances.index)
+    nearby_bus_stops = bus_stops_gdf[nearby].copy()
+    nearby_bus_stops["Distance (m)"] = walking_distances.reindex(
+        stop_codes[nearby]
+    ).to_numpy()
+    return None, nearby_bus_stops
+
+
+def find_walking_network(folder: str):
+    """
+    Path of the walking network file in the data folder, or None if there is none
+    (walking distances are optional).
+    """
+    file_path = os.path.join(folder, WALKING_NETWORK_FNAME)
+    return file_path if os.path.exists(file_path) else None
@@ -0,0 +1,172 @@
+"""
+What-if analysis for removing bus services.
+
+The stop <-> service incidence comes from the stop-service index, and the
+stop/station neighbourhoods are precomputed once by `build_whatif_index`, so
+that `evaluate_service_removal` only needs a few array operations per scenario.
+"""
+
+import numpy as np
+import pandas as pd
+
+from stop_service_index import gather_rows, to_csr
+
+PROJECTED_CRS = 3857
+RADIUS_METERS = 500
+
+
+def projected_xy(gdf) -> np.ndarray:
+    """
+    PROJECTED_CRS x/y of the (centroids of the) located geometries.
+    """
+    gdf = gdf[gdf.geometry.notna()].to_crs(PROJECTED_CRS)
+    points = gdf.geometry.centroid
+    return np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+
+
+def build_whatif_index(
+    stop_service_index: dict,
+    bus_stops,
+    rail_stations,
+    radius_meters: float = RADIUS_METERS,
+) -> dict:
+    """
+    Precompute everything needed to evaluate service removals, on top of the
+    stop-service index (which must have been built with BusStops):
+    - for each served stop, the other served stops within `radius_meters`
+    - for each served stop, the distance to the nearest rail station
+    Stops without a location have no neighbours.
+    """
+    # sklearn is slow to import, only import it when the index is built
+    from sklearn.neighbors import KDTree
+
+    print("Building what-if index...")
+    stop_codes = stop_service_index["stop_codes"]
+    stop_rows = stop_service_index["stop_rows"]
+    located = np.flatnonzero(stop_rows >= 0)
+    located = located[bus_stops.geometry.iloc[stop_rows[located]].notna().to_numpy()]
+
+    # neighbouring stops within the radius, as (offsets, stop ids, distances)
+    stop_xy = projected_xy(bus_stops.iloc[stop_rows[located]])
+    neighbours, distances = KDTree(stop_xy).query_radius(
+        stop_xy, r=radius_meters, return_distance=True
+    )
+    lengths = np.array([len(n) for n in neighbours], dtype=np.int64)
+    neighbour_offsets, neighbour_stops, neighbour_distances = to_csr(
+        np.repeat(located, lengths),
+        len(stop_codes),
+        located[np.concatenate(neighbours).astype(np.int64)],
+        np.concatenate(distances),
+    )
+
+    # distance from each stop to the nearest rail station
+    nearest_station = np.full(len(stop_codes), np.inf)
+    station_xy = projected_xy(rail_stations)
+    if len(station_xy):
+        station_distance, _ = KDTree(station_xy).query(stop_xy, k=1)
+        nearest_station[located] = station_distance[:, 0]
+
+    descriptions = np.full(len(stop_codes), None, dtype=object)
+    descriptions[located] = bus_stops["LOC_DESC"].iloc[stop_rows[located]].to_numpy()
+
+    return {
+        "radius_meters": radius_meters,
+        "service_names": stop_service_index["service_names"],
+        "stop_codes": stop_codes,
+        "stop_descriptions": descriptions,
+        "service_offsets": stop_service_index["service_offsets"],
+        "service_stops": stop_service_index["service_stops"],
+        "degree": np.diff(stop_service_index["stop_service_offsets"]),
+        "neighbour_offsets": neighbour_offsets,
+        "neighbour_stops": neighbour_stops,
+        "neighbour_distances": neighbour_distances,
+        "nearest_station": nearest_station,
+    }
+
+
+def evaluate_service_removal(index: dict, removed_services: list[str]) -> pd.DataFrame:
+    """
+    Evaluate the effect of removing the given services on every stop they serve.
+    Resultant df has one row per affected stop, with these columns:
+    - BusStopCode, Description
+    - Services_Lost, Services_Remaining
+    - Nearest_Served_Stop_m: nearest stop within the radius that is still served
+    - Nearest_Station_m
+    - Status: "Reduced service", "No service" (but an alternative within the
+      radius) or "No service within radius"
+    """
+    removed_ids = np.flatnonzero(np.isin(index["service_names"], removed_services))
+    if len(removed_ids) == 0:
+        return pd.DataFrame(
+            columns=[
+                "BusStopCode",
+                "Description",
+                "Services_Lost",
+                "Services_Remaining",
+                "Nearest_Served_Stop_m",
+                "Nearest_Station_m",
+                "Status",
+            ]
+        )
+
+    # count how many services each stop loses
+    positions, _ = gather_rows(index["service_offsets"], removed_ids)
+    lost = np.bincount(
+        index["service_stops"][positions], minlength=len(index["stop_codes"])
+    )
+    remaining = index["degree"] - lost
+    affected = np.flatnonzero(lost > 0)
+
+    # nearest stop that is still served, for the stops left without any service
+    nearest_served = np.full(len(affected), np.nan)
+    stranded = np.flatnonzero(remaining[affected] == 0)
+    if len(stranded):
+        positions, owner = gather_rows(
+            index["neighbour_offsets"], affected[stranded]
+        )
+        neighbours = index["neighbour_stops"][positions]
+        distances = np.where(
+            remaining[neighbours] > 0, index["neighbour_distances"][positions], np.inf
+        )
+        nearest = np.full(len(stranded), np.inf)
+        np.minimum.at(nearest, owner, distances)
+        nearest_served[stranded] = np.where(np.isinf(nearest), np.nan, nearest)
+
+    nearest_station = index["nearest_station"][affected]
+    has_alternative = ~np.isnan(nearest_served) | (
+        nearest_station <= index["radius_meters"]
+    )
+    status = np.where(
+        remaining[affected] > 0,
+        "Reduced service",
+        np.where(has_alternative, "No service", "No service within radius"),
+    )
+
+    return pd.DataFrame(
+        {
+            "BusStopCode": index["stop_codes"][affected],
+            "Description": index["stop_descriptions"][affected],
+            "Services_Lost": lost[affected],
+            "Services_Remaining": remaining[affected],
+            "Nearest_Served_Stop_m": nearest_served,
+            "Nearest_Station_m": np.where(
+                np.isinf(nearest_station), np.nan, nearest_station
+            ),
+            "Status": status,
+        }
+    )
+
+
+def summarise_service_removal(affected_stops: pd.DataFrame) -> dict:
+    """
+    Count the affected stops by status.
+    """
+    counts = affected_stops["Status"].value_counts()
+    return {
+        "Stops affected": len(affected_stops),
+        "Stops with reduced service": int(counts.get("Reduced service", 0)),
+        "Stops with no service": int(counts.get("No service", 0)),
+        "Stops with no service within radius": int(
+            counts.get("No service within radius", 0)
+        ),
+    }
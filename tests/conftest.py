@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the app's modules import each other by name, as when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "app"))
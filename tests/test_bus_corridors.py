@@ -0,0 +1,72 @@
+import pandas as pd
+
+import bus_corridors
+import stop_service_index
+
+
+def make_index(routes: dict):
+    # {(service, direction): [stop codes in order]}
+    rows = [
+        (service, direction, sequence, stop)
+        for (service, direction), stops in routes.items()
+        for sequence, stop in enumerate(stops, start=1)
+    ]
+    bus_routes = pd.DataFrame(
+        rows, columns=["ServiceNo", "Direction", "StopSequence", "BusStopCode"]
+    )
+    return stop_service_index.build_stop_service_index(bus_routes)
+
+
+def shared_runs(index: dict, min_stops: int) -> set:
+    # (service A, service B, first shared stop A, first shared stop B, stops)
+    runs = bus_corridors.find_shared_runs(index, min_stops)
+    services = index["service_names"][index["route_service"]]
+    stops = index["stop_codes"][index["route_stops"]]
+    return {
+        (services[a], services[b], stops[start_a], stops[start_b], int(num_stops))
+        for a, b, start_a, start_b, num_stops in zip(
+            *(runs[key] for key in ["route_a", "route_b", "start_a", "start_b", "num_stops"])
+        )
+    }
+
+
+def test_maximal_runs_between_services():
+    index = make_index(
+        {
+            ("1", 1): [10, 11, 12, 13, 14, 15, 90, 20, 21, 22],
+            ("2", 1): [80, 11, 12, 13, 14, 15, 16, 20, 21, 22],
+            # only two stops in common with service 1
+            ("3", 1): [10, 11, 70, 71, 72],
+        }
+    )
+    assert shared_runs(index, 3) == {("1", "2", "11", "11", 5), ("1", "2", "20", "20", 3)}
+    assert shared_runs(index, 4) == {("1", "2", "11", "11", 5)}
+    assert shared_runs(index, 6) == set()
+
+
+def test_runs_within_a_service_are_ignored():
+    index = make_index(
+        {
+            ("1", 1): [10, 11, 12, 13],
+            ("1", 2): [10, 11, 12, 13],
+            ("2", 1): [5, 10, 11, 12],
+        }
+    )
+    runs = bus_corridors.find_shared_runs(index, 3)
+    # one run with each direction of service 1, none between them
+    assert sorted(runs["route_a"].tolist()) == [0, 1]
+    assert runs["route_b"].tolist() == [2, 2]
+    assert shared_runs(index, 3) == {("1", "2", "10", "10", 3)}
+
+
+def test_repeated_stops_on_a_loop_route():
+    index = make_index(
+        {
+            ("1", 1): [1, 2, 3, 4, 1, 2, 3, 4],
+            ("2", 1): [1, 2, 3, 4],
+        }
+    )
+    # service 2 matches both laps of the loop
+    runs = bus_corridors.find_shared_runs(index, 3)
+    assert sorted(runs["start_a"].tolist()) == [0, 4]
+    assert runs["num_stops"].tolist() == [4, 4]
@@ -0,0 +1,214 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import LineString
+
+import parallel_routes
+
+
+def make_lines(bus_routes: dict, mrt_lines: dict):
+    # {service: [(x, y), ...]}, {line name: [(x, y), ...]}
+    bus_lines = gpd.GeoDataFrame(
+        {"ServiceNo": list(bus_routes)},
+        geometry=[LineString(xy) for xy in bus_routes.values()],
+        crs=parallel_routes.PROJECTED_CRS,
+    )
+    mrt = gpd.GeoSeries(
+        [LineString(xy) for xy in mrt_lines.values()],
+        index=pd.Index(list(mrt_lines), name="StationLine"),
+        crs=parallel_routes.PROJECTED_CRS,
+    )
+    return bus_lines, mrt
+
+
+def notebook_segments(line, distance):
+    # segment_line_by_distance in the notebook
+    segments = []
+    current = 0
+    while current < line.length:
+        start = line.interpolate(current)
+        end = line.interpolate(min(current + distance, line.length))
+        segments.append(LineString([start, end]))
+        current += distance
+    return segments
+
+
+def notebook_coverage(bus_route, mrt_line, distance):
+    # Phase 2.1 and 2.2 of the notebook, one pair at a time
+    mrt_segments = notebook_segments(mrt_line, distance)
+    coverage = sum(bus_route.intersects(s) for s in mrt_segments) / len(mrt_segments) * 100
+    consecutive = longest = intersecting = 0
+    bus_segments = notebook_segments(bus_route, distance)
+    for segment in bus_segments:
+        if mrt_line.intersects(segment):
+            intersecting += 1
+            consecutive += 1
+            longest = max(longest, consecutive)
+        else:
+            consecutive = 0
+    return (
+        coverage,
+        intersecting / len(bus_segments) * 100,
+        longest,
+        longest / len(bus_segments) * 100,
+    )
+
+
+def brute_force_hausdorff(a: LineString, b: LineString, step: float = 1.0) -> float:
+    def points(line):
+        distances = np.append(np.arange(0, line.length, step), line.length)
+        return np.array([line.interpolate(d).coords[0] for d in distances])
+
+    pa, pb = points(a), points(b)
+    distances = np.linalg.norm(pa[:, None] - pb[None], axis=2)
+    return max(distances.min(axis=1).max(), distances.min(axis=0).max())
+
+
+def brute_force_frechet(p: np.ndarray, q: np.ndarray) -> float:
+    # the textbook coupling table, one cell at a time
+    n, m = len(p), len(q)
+    table = np.full((n, m), np.inf)
+    for i in range(n):
+        for j in range(m):
+            distance = np.linalg.norm(p[i] - q[j])
+            if i == 0 and j == 0:
+                table[i, j] = distance
+                continue
+            best = min(
+                table[i - 1, j] if i > 0 else np.inf,
+                table[i, j - 1] if j > 0 else np.inf,
+                table[i - 1, j - 1] if i > 0 and j > 0 else np.inf,
+            )
+            table[i, j] = max(distance, best)
+    return table[-1, -1]
+
+
+def random_routes(rng, count: int) -> dict:
+    # wandering routes between x = 500 and x = 5500, around the x axis
+    routes = {}
+    for service in range(count):
+        num_stops = rng.integers(2, 12)
+        xs = np.sort(rng.uniform(500, 5500, num_stops))
+        ys = rng.uniform(-1500, 1500, num_stops)
+        routes[str(service)] = list(zip(xs, ys))
+    return routes
+
+
+def test_segment_coverage_matches_notebook():
+    rng = np.random.default_rng(0)
+    bus_routes = random_routes(rng, 30)
+    mrt_xy = {"EW": [(0, 0), (6000, 0)], "NS": [(3000, -4000), (3200, 0), (2500, 4000)]}
+    bus_lines, mrt_lines = make_lines(bus_routes, mrt_xy)
+
+    coverage = parallel_routes.segment_coverage(bus_lines, mrt_lines)
+    assert len(coverage) == len(bus_routes) * len(mrt_xy)
+    for row in coverage.itertuples():
+        expected = notebook_coverage(
+            LineString(bus_routes[row.Bus_ServiceNo]),
+            LineString(mrt_xy[row.MRT_Line]),
+            parallel_routes.SEGMENT_LENGTH,
+        )
+        assert (
+            row.Coverage_Percentage,
+            row.Intersecting_Segments_Percentage,
+            row.Max_Consecutive_Segments,
+            row.Consecutive_Coverage_Percentage,
+        ) == pytest.approx(expected)
+
+
+def test_consecutive_segments_along_a_crossing_route():
+    # the route's 1 km segments 1, 2 and 4 (of 5) cross the line
+    bus_lines, mrt_lines = make_lines(
+        {"1": [(0, 500), (1000, 500), (1000, -500), (1000, 500), (2000, 500), (2000, -500)]},
+        {"EW": [(-1000, 0), (5000, 0)]},
+    )
+    coverage = parallel_routes.segment_coverage(bus_lines, mrt_lines).iloc[0]
+    assert coverage["Intersecting_Segments_Percentage"] == pytest.approx(60)
+    assert coverage["Max_Consecutive_Segments"] == 2
+    assert coverage["Consecutive_Coverage_Percentage"] == pytest.approx(40)
+    # it touches the line at x = 1000 and x = 2000, the ends of 3 of its 6 segments
+    assert coverage["Coverage_Percentage"] == pytest.approx(50)
+
+
+def test_hausdorff_distance_matches_brute_force():
+    rng = np.random.default_rng(1)
+    bus_routes = random_routes(rng, 10)
+    bus_lines, mrt_lines = make_lines(bus_routes, {"EW": [(0, 0), (6000, 0)]})
+
+    metrics = parallel_routes.similarity_metrics(bus_lines, mrt_lines)
+    for row in metrics.itertuples():
+        route = LineString(bus_routes[row.Bus_ServiceNo])
+        # the stretch of the line spanned by the route's first and last stop
+        first, last = route.coords[0], route.coords[-1]
+        spanned = LineString([(first[0], 0), (last[0], 0)])
+        assert row.Hausdorff_Distance_m == pytest.approx(
+            brute_force_hausdorff(route, spanned), abs=1.0
+        )
+
+
+def test_discrete_frechet_distance_matches_brute_force():
+    rng = np.random.default_rng(2)
+    for n, m in [(1, 1), (1, 5), (7, 3), (20, 20), (31, 12)]:
+        p = rng.uniform(0, 1000, (n, 2))
+        q = rng.uniform(0, 1000, (m, 2))
+        expected = brute_force_frechet(p, q)
+        assert parallel_routes.discrete_frechet_distance(p, q) == pytest.approx(expected)
+        # a cutoff above the distance does not change it, one below gives inf
+        assert parallel_routes.discrete_frechet_distance(
+            p, q, expected + 1
+        ) == pytest.approx(expected)
+        if n + m > 3:
+            assert parallel_routes.discrete_frechet_distance(p, q, expected - 1) == np.inf
+
+
+def test_frechet_distance_of_routes():
+    bus_routes = {"1": [(0, 100), (2000, 100)], "2": [(0, 100), (1000, 900), (2000, 100)]}
+    bus_lines, mrt_lines = make_lines(bus_routes, {"EW": [(0, 0), (2000, 0)]})
+    metrics = parallel_routes.similarity_metrics(bus_lines, mrt_lines, spacing=100)
+    frechet = metrics.set_index("Bus_ServiceNo")["Frechet_Distance_m"]
+    assert frechet["1"] == pytest.approx(100)
+    # the detour is compared with the nearest points along the line, as far
+    # apart as 900 m
+    assert 900 <= frechet["2"] < parallel_routes.FRECHET_CUTOFF
+
+
+def test_shared_corridor():
+    # 2000 m alongside the line, then away from it: 400 m of the 2000 m leg
+    # are within 500 m
+    bus_lines, mrt_lines = make_lines(
+        {"1": [(0, 100), (2000, 100), (2000, 2100)], "2": [(0, 3000), (2000, 3000)]},
+        {"EW": [(0, 0), (4000, 0)]},
+    )
+    metrics = parallel_routes.similarity_metrics(bus_lines, mrt_lines, radius=500)
+    metrics = metrics.set_index("Bus_ServiceNo")
+    assert metrics.loc["1", "Shared_Corridor_m"] == pytest.approx(2400, rel=1e-3)
+    assert metrics.loc["1", "Shared_Corridor_Percentage"] == pytest.approx(60, rel=1e-3)
+    assert metrics.loc["2", "Shared_Corridor_m"] == 0
+
+
+def test_bus_mrt_overlap_scores_the_best_line():
+    bus_lines, mrt_lines = make_lines(
+        {
+            "1": [(100, 100), (1000, -100), (2000, 100), (3000, -100)],
+            "2": [(300, -2000), (300, 2000)],
+        },
+        {"EW": [(0, 0), (3000, 0)], "NS": [(0, -3000), (0, 3000)]},
+    )
+    buffers = parallel_routes.BufferCache(mrt_lines, radii=[500])
+    overlaps = buffers.overlaps(bus_lines, 500)
+    pairs = overlaps[["MRT_Line", "Bus_ServiceNo"]]
+    table = parallel_routes.bus_mrt_overlap(
+        overlaps,
+        parallel_routes.segment_coverage(bus_lines, mrt_lines, pairs),
+        parallel_routes.weighted_average_angles(bus_lines, mrt_lines, pairs),
+        radius=500,
+    )
+    # service 1 runs along EW; service 2 runs alongside NS, but never crosses it
+    assert table["Bus_ServiceNo"].tolist() == ["1"]
+    assert table.loc[0, "MRT_Line"] == "EW"
+    assert table.loc[0, "Weighted_Average_Score"] == pytest.approx(
+        0.4 * table.loc[0, "Coverage_Percentage"]
+        + 0.4 * table.loc[0, "Consecutive_Coverage_Percentage"]
+        + 0.2 * table.loc[0, "Weighted_Average_Angle"]
+    )
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import percentile_ranks
+
+
+def test_percentile_rank_inverts_np_percentile():
+    rng = np.random.default_rng(0)
+    reference = rng.integers(0, 50, 200).astype(float)
+    values = rng.integers(-5, 55, 300).astype(float)
+    ranks = percentile_ranks.percentile_rank(values, reference)
+    for q in [5, 10, 25, 33.3, 50, 75, 100]:
+        cut_off = np.percentile(reference, q)
+        assert np.array_equal(values < cut_off, ranks < q)
+
+
+def test_percentile_rank_bounds_and_nan():
+    reference = np.array([1.0, 2.0, 3.0, np.nan, 5.0])
+    values = np.array([0.0, 1.0, 2.5, 5.0, 9.0, np.nan])
+    ranks = percentile_ranks.percentile_rank(values, reference)
+    assert ranks[0] == -np.inf
+    assert ranks[1:5] == pytest.approx([0.0, 50.0, 100.0, 100.0])
+    assert np.isnan(ranks[5])
+
+
+def test_percentile_rank_ties_and_single_value():
+    ranks = percentile_ranks.percentile_rank(
+        np.array([2.0, 3.0]), np.array([1.0, 2.0, 2.0, 2.0, 4.0])
+    )
+    # 2.0 is at the last of its ties; 3.0 is halfway from 2.0 to 4.0
+    assert ranks == pytest.approx([75.0, 87.5])
+    single = percentile_ranks.percentile_rank(np.array([1.0, 2.0, 3.0]), np.array([2.0]))
+    assert single.tolist() == [-np.inf, 100.0, 100.0]
+
+
+def test_percentile_rank_empty_reference():
+    ranks = percentile_ranks.percentile_rank(np.array([1.0, 2.0]), np.array([np.nan]))
+    assert np.isnan(ranks).all()
@@ -0,0 +1,122 @@
+import pandas as pd
+
+import pipeline
+import result_cache
+
+# services seen by each call of service_totals
+CALLS = []
+
+
+def service_totals(trips: pd.DataFrame, weights: pd.DataFrame) -> pd.DataFrame:
+    CALLS.append(sorted(trips["ServiceNo"].unique()))
+    trips = trips.merge(weights, on="DAY_TYPE")
+    trips["Weighted_Trips"] = trips["TOTAL_TRIPS"] * trips["Weight"]
+    return trips.groupby("ServiceNo", as_index=False)["Weighted_Trips"].sum()
+
+
+def make_pipeline(folder: str, sources: dict) -> pipeline.Pipeline:
+    steps = pipeline.Pipeline(str(folder), workers=2)
+    for name in ["trips", "weights"]:
+        steps.add_source(
+            name,
+            lambda name=name: result_cache.content_hash(sources[name]),
+            lambda name=name: sources[name],
+        )
+    steps.add_stage(
+        pipeline.Stage(
+            "service_totals",
+            service_totals,
+            ["trips", "weights"],
+            partition_by={"trips": "ServiceNo"},
+        )
+    )
+    return steps
+
+
+def run(folder: str, sources: dict, force=()) -> tuple[str, pd.DataFrame, list]:
+    CALLS.clear()
+    steps = make_pipeline(folder, sources)
+    status = steps.run(force=list(force))["service_totals"]
+    return status, steps.value("service_totals"), sorted(sum(CALLS, []))
+
+
+def expected(sources: dict) -> pd.DataFrame:
+    output = service_totals(sources["trips"], sources["weights"])
+    return output.sort_values("ServiceNo", key=lambda s: s.astype(str)).reset_index(
+        drop=True
+    )
+
+
+def make_sources() -> dict:
+    return {
+        "trips": pd.DataFrame(
+            {
+                "ServiceNo": ["10", "2", "10", "2", "30", "30"],
+                "DAY_TYPE": ["WEEKDAY", "WEEKDAY", "WEEKENDS", "WEEKENDS"]
+                + ["WEEKDAY", "WEEKDAY"],
+                "TOTAL_TRIPS": [1, 2, 3, 4, 5, 6],
+            }
+        ),
+        "weights": pd.DataFrame({"DAY_TYPE": ["WEEKDAY", "WEEKENDS"], "Weight": [1, 10]}),
+    }
+
+
+def test_only_changed_partitions_are_recomputed(tmp_path):
+    sources = make_sources()
+    status, output, computed = run(tmp_path, sources)
+    assert status == "rebuilt 3 of 3 partitions"
+    assert computed == ["10", "2", "30"]
+    pd.testing.assert_frame_equal(output, expected(sources))
+
+    status, _, computed = run(tmp_path, sources)
+    assert status == "up to date"
+    assert computed == []
+
+    # change service 2, drop service 30, add service 7
+    trips = sources["trips"]
+    trips.loc[trips["ServiceNo"] == "2", "TOTAL_TRIPS"] += 100
+    sources["trips"] = pd.concat(
+        [
+            trips[trips["ServiceNo"] != "30"],
+            pd.DataFrame(
+                {"ServiceNo": ["7"], "DAY_TYPE": ["WEEKENDS"], "TOTAL_TRIPS": [8]}
+            ),
+        ],
+        ignore_index=True,
+    )
+    status, output, computed = run(tmp_path, sources)
+    assert status == "rebuilt 2 of 3 partitions"
+    assert computed == ["2", "7"]
+    pd.testing.assert_frame_equal(output, expected(sources))
+
+
+def test_shared_input_or_force_recomputes_all_partitions(tmp_path):
+    sources = make_sources()
+    run(tmp_path, sources)
+
+    sources["weights"] = sources["weights"].assign(Weight=[2, 20])
+    status, output, computed = run(tmp_path, sources)
+    assert status == "rebuilt 3 of 3 partitions"
+    assert computed == ["10", "2", "30"]
+    pd.testing.assert_frame_equal(output, expected(sources))
+
+    status, output, computed = run(tmp_path, sources, force=["service_totals"])
+    assert status == "rebuilt 3 of 3 partitions, output unchanged"
+    assert computed == ["10", "2", "30"]
+
+
+def test_final_ranking_depends_on_every_data_file(tmp_path):
+    steps = pipeline.build_analysis_pipeline(str(tmp_path / "data"), str(tmp_path / "out"))
+    for target in ["final_ranking", "weight_sensitivity"]:
+        required = steps.required_stages([target])
+        assert {"hour_counts", "mrt_coverage", "mrt_angles", "mrt_similarity"} <= set(required)
+        sources = {
+            name for stage in required for name in steps.stages[stage].inputs
+        } - set(steps.stages)
+        assert sources == {
+            "BusRoutes",
+            "BusStops",
+            "RailLineStrings",
+            "aggregated_ridership",
+            "bus_route_trips",
+        }
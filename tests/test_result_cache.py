@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import result_cache
+
+
+def make_frame() -> pd.DataFrame:
+    return pd.DataFrame({"ServiceNo": ["10", "2", "30"], "TOTAL_TRIPS": [1, 2, 3]})
+
+
+def test_equal_content_gives_equal_hashes():
+    assert result_cache.content_hash(make_frame()) == result_cache.content_hash(make_frame())
+    assert result_cache.content_hash({"a": 1, "b": [1, 2]}) == result_cache.content_hash(
+        {"b": [1, 2], "a": 1}
+    )
+    changed = make_frame()
+    changed.loc[0, "TOTAL_TRIPS"] = 5
+    assert result_cache.content_hash(changed) != result_cache.content_hash(make_frame())
+    assert result_cache.content_hash(np.arange(3)) != result_cache.content_hash(
+        np.arange(3.0)
+    )
+
+
+def test_unsupported_types_are_not_hashed():
+    with pytest.raises(TypeError):
+        result_cache.content_hash(object())
+
+
+def test_tag_replaces_the_content_of_the_tagged_frame():
+    data = result_cache.tag_content_hash(make_frame(), "file hash")
+    other = make_frame()
+    other["TOTAL_TRIPS"] = [7, 8, 9]
+    result_cache.tag_content_hash(other, "file hash")
+    assert result_cache.tagged_content_hash(data) == "file hash"
+    assert result_cache.content_hash(data) == result_cache.content_hash(other)
+
+
+def test_frames_derived_from_a_tagged_frame_are_hashed_by_content():
+    data = result_cache.tag_content_hash(make_frame(), "file hash")
+    tagged_key = result_cache.content_hash(data)
+
+    # same shape and index as the tagged frame, different values
+    derived = data.assign(TOTAL_TRIPS=data["TOTAL_TRIPS"] * 2)
+    copied = data.copy()
+    copied.loc[0, "TOTAL_TRIPS"] = 100
+    for frame in [derived, copied]:
+        assert result_cache.tagged_content_hash(frame) is None
+        assert result_cache.content_hash(frame) != tagged_key
+        assert result_cache.content_hash(frame) == result_cache.content_hash(
+            frame.copy()
+        )
+
+    # a new frame at the address of a collected tagged frame is not tagged
+    del data
+    assert result_cache.tagged_content_hash(make_frame()) is None
+
+
+def test_disk_cache_reuses_results_until_the_data_changes(tmp_path):
+    cache = result_cache.DiskCache(str(tmp_path), size_limit=1 << 20)
+    calls = []
+
+    @result_cache.disk_cache(cache=cache)
+    def total_trips(trips: pd.DataFrame, factor: int = 1) -> int:
+        calls.append(factor)
+        return int(trips["TOTAL_TRIPS"].sum()) * factor
+
+    data = result_cache.tag_content_hash(make_frame(), "file hash")
+    assert total_trips(data) == 6
+    assert total_trips(data) == 6
+    assert total_trips(data, factor=2) == 12
+    assert total_trips(data[data["TOTAL_TRIPS"] > 1]) == 5
+    assert calls == [1, 2, 1]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_disk_cache_evicts_least_recently_used_entries(tmp_path):
+    # room for three entries (and their pickle headers)
+    cache = result_cache.DiskCache(str(tmp_path), size_limit=3500)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.set(key, b"x" * 1000)
+        # distinct modification times
+        os.utime(cache._path(key), (i, i))
+    cache.get("a")
+    cache.set("d", b"x" * 1000)
+    assert sorted(os.path.basename(path) for path, _, _ in cache.entries()) == [
+        "a.pkl",
+        "c.pkl",
+        "d.pkl",
+    ]
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import ridership_percentiles
+
+QUANTILES = np.arange(0, 100.5, 2.5)
+
+
+def sample_volumes(rng) -> dict:
+    # tap volumes: small counts with ties and zeros, and a long tail
+    return {
+        "counts": rng.poisson(3, 5000).astype(np.float64),
+        "tail": np.floor(rng.lognormal(3, 1.5, 20000)),
+        "few": np.array([0.0, 1, 1, 2, 7, 40]),
+    }
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_sketch_quantiles_within_the_relative_accuracy(relative_accuracy):
+    rng = np.random.default_rng(0)
+    for name, values in sample_volumes(rng).items():
+        sketch = ridership_percentiles.QuantileSketch(relative_accuracy).update(values)
+        exact = np.percentile(values, QUANTILES)
+        estimated = sketch.quantiles(QUANTILES)
+        assert np.all(
+            np.abs(estimated - exact) <= relative_accuracy * exact + 1e-9
+        ), name
+
+
+def test_merged_sketches_match_one_sketch():
+    rng = np.random.default_rng(1)
+    values = sample_volumes(rng)["tail"]
+    whole = ridership_percentiles.QuantileSketch().update(values)
+    merged = ridership_percentiles.QuantileSketch()
+    for chunk in np.array_split(values, 7):
+        merged.merge(ridership_percentiles.QuantileSketch().update(chunk))
+    assert merged.quantiles(QUANTILES) == pytest.approx(whole.quantiles(QUANTILES))
+    assert merged.mean() == pytest.approx(values.mean())
@@ -0,0 +1,113 @@
+import os
+
+import pandas as pd
+import pytest
+
+import ridership_store
+
+
+def make_month(year_month: str, scale: int) -> pd.DataFrame:
+    # two rows for stop 1 at 8am, so that the mean is over rows
+    return pd.DataFrame(
+        {
+            "YEAR_MONTH": year_month,
+            "DAY_TYPE": ["WEEKDAY", "WEEKDAY", "WEEKDAY", "WEEKENDS/HOLIDAY"],
+            "TIME_PER_HOUR": [8, 8, 9, 8],
+            "PT_TYPE": "BUS",
+            "PT_CODE": [1, 1, 2, 1],
+            "TOTAL_TAP_IN_VOLUME": [10 * scale, 20 * scale, 5 * scale, 1 * scale],
+            "TOTAL_TAP_OUT_VOLUME": [1 * scale, 3 * scale, 2 * scale, 4 * scale],
+        }
+    )
+
+
+def expected_means(ridership: pd.DataFrame) -> pd.DataFrame:
+    # as in ridership_final.ipynb
+    return (
+        ridership.rename(columns={"PT_CODE": "Destination_Stop"})
+        .groupby(ridership_store.KEY_COLUMNS)[
+            ["TOTAL_TAP_IN_VOLUME", "TOTAL_TAP_OUT_VOLUME"]
+        ]
+        .mean()
+        .reset_index()
+    )
+
+
+def assert_means_equal(actual: pd.DataFrame, expected: pd.DataFrame):
+    pd.testing.assert_frame_equal(
+        actual.reset_index(drop=True),
+        expected.reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_append_and_aggregate(tmp_path):
+    store = str(tmp_path)
+    months = [make_month("2024-07", 1), make_month("2024-08", 2), make_month("2024-09", 3)]
+    assert ridership_store.append_month(pd.concat(months[:2]), store) == [
+        "2024-07",
+        "2024-08",
+    ]
+    assert ridership_store.append_month(months[2], store) == ["2024-09"]
+
+    assert ridership_store.list_partitions(store) == ["2024-07", "2024-08", "2024-09"]
+    assert ridership_store.store_version(store) == 2
+    assert_means_equal(
+        ridership_store.aggregate_ridership(store), expected_means(pd.concat(months))
+    )
+    assert_means_equal(
+        ridership_store.aggregate_ridership(store, last_n_months=2),
+        expected_means(pd.concat(months[1:])),
+    )
+    assert_means_equal(
+        ridership_store.aggregate_ridership(store, months=["2024-07"]),
+        expected_means(months[0]),
+    )
+    pd.testing.assert_frame_equal(
+        ridership_store.read_month("2024-08", store), months[1], check_dtype=False
+    )
+
+
+def test_replacing_a_month_does_not_count_it_twice(tmp_path):
+    store = str(tmp_path)
+    ridership_store.append_month(make_month("2024-07", 1), store)
+    ridership_store.append_month(make_month("2024-08", 2), store)
+    replacement = make_month("2024-07", 5).iloc[:3]
+    ridership_store.append_month(replacement, store)
+
+    assert_means_equal(
+        ridership_store.aggregate_ridership(store),
+        expected_means(pd.concat([replacement, make_month("2024-08", 2)])),
+    )
+    # only the files of the current version are left
+    files = sorted(
+        os.path.relpath(os.path.join(folder, file), store)
+        for folder, _, folder_files in os.walk(store)
+        for file in folder_files
+    )
+    assert files == [
+        "YEAR_MONTH=2024-07/rows-3.csv.gz",
+        "YEAR_MONTH=2024-07/stats-3.csv",
+        "YEAR_MONTH=2024-08/rows-2.csv.gz",
+        "YEAR_MONTH=2024-08/stats-2.csv",
+        "manifest.json",
+        "totals-3.csv",
+    ]
+
+
+def test_aggregate_ridership_rejects_bad_months(tmp_path):
+    store = str(tmp_path)
+    ridership_store.append_month(make_month("2024-07", 1), store)
+    with pytest.raises(ValueError):
+        ridership_store.aggregate_ridership(store, last_n_months=0)
+    with pytest.raises(ValueError):
+        ridership_store.aggregate_ridership(store, months=[])
+    with pytest.raises(ValueError):
+        ridership_store.aggregate_ridership(store, months=["2024-08"])
+
+
+def test_aggregate_ridership_of_an_empty_store(tmp_path):
+    with pytest.raises(ValueError, match="empty"):
+        ridership_store.aggregate_ridership(str(tmp_path))
+    with pytest.raises(ValueError, match="empty"):
+        ridership_store.aggregate_ridership(str(tmp_path), last_n_months=1)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+import stop_service_index
+
+
+def make_bus_routes():
+    # service 10 loops back to stop 1; service 2 has both directions
+    return pd.DataFrame(
+        {
+            "ServiceNo": ["10", "10", "10", "10", "2", "2", "2", "2"],
+            "Direction": [1, 1, 1, 1, 1, 1, 2, 2],
+            "StopSequence": [1, 2, 3, 4, 2, 1, 1, 2],
+            "BusStopCode": [1, 2, 3, 1, 3, 4, 5, 4],
+        }
+    )
+
+
+def test_gather_rows():
+    offsets = np.array([0, 2, 2, 5, 6])
+    positions, owner = stop_service_index.gather_rows(offsets, np.array([2, 0, 1, 3]))
+    assert positions.tolist() == [2, 3, 4, 0, 1, 5]
+    assert owner.tolist() == [0, 0, 0, 1, 1, 3]
+
+
+def test_gather_rows_empty():
+    positions, owner = stop_service_index.gather_rows(np.array([0, 3]), np.array([], int))
+    assert positions.tolist() == []
+    assert owner.tolist() == []
+
+
+def test_route_stops_in_sequence_order():
+    index = stop_service_index.build_stop_service_index(make_bus_routes())
+    stops = stop_service_index.get_stops_for_service
+    assert stops(index, "10", 1).tolist() == ["1", "2", "3", "1"]
+    assert stops(index, "2", 1).tolist() == ["4", "3"]
+    assert stops(index, "2", 2).tolist() == ["5", "4"]
+    assert stops(index, 2).tolist() == ["3", "4", "5"]
+    assert stops(index, "99", 1).tolist() == []
+
+
+def test_services_at_stop():
+    index = stop_service_index.build_stop_service_index(make_bus_routes())
+    services = stop_service_index.get_services_at_stop
+    assert services(index, 3).tolist() == ["10", "2"]
+    assert services(index, "4", direction=2).tolist() == ["2"]
+    assert services(index, "5", direction=1).tolist() == []
+    assert services(index, "99").tolist() == []
+
+
+def test_stop_rows_keep_first_duplicate():
+    bus_stops = pd.DataFrame({"BUS_STOP_N": ["3", "1", "3", "4"]})
+    index = stop_service_index.build_stop_service_index(make_bus_routes(), bus_stops)
+    rows = dict(zip(index["stop_codes"], index["stop_rows"]))
+    assert rows == {"1": 1, "2": -1, "3": 0, "4": 3, "5": -1}
+
+
+def test_route_stop_pairs():
+    index = stop_service_index.build_stop_service_index(make_bus_routes())
+    pairs = stop_service_index.get_route_stop_pairs(index)
+    service_2 = pairs[(pairs["ServiceNo"] == "2") & (pairs["Direction"] == 1)]
+    assert service_2[["Origin_Stop", "Destination_Stop"]].values.tolist() == [["4", "3"]]
+    assert len(pairs) == 3 + 1 + 1
@@ -0,0 +1,154 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import trip_model
+
+
+def make_data():
+    bus_routes = pd.DataFrame(
+        [
+            (service, direction, sequence, stop)
+            for (service, direction), stops in {
+                ("10", 1): [101, 102, 103],
+                ("10", 2): [103, 102, 101],
+                ("20", 1): [101, 102, 104],
+                # not in BusServices
+                ("99", 1): [102, 103, 104],
+            }.items()
+            for sequence, stop in enumerate(stops, start=1)
+        ],
+        columns=["ServiceNo", "Direction", "StopSequence", "BusStopCode"],
+    )
+    bus_services = pd.DataFrame(
+        {
+            "ServiceNo": ["10", "10", "20"],
+            "Direction": [1, 2, 1],
+            "Category": ["TRUNK", "TRUNK", "FEEDER"],
+            "AM_Peak_Freq": ["5", "08-12", "-"],
+            "AM_Offpeak_Freq": ["10-14", "7", None],
+            "PM_Peak_Freq": ["6-9", "-", "15"],
+            "PM_Offpeak_Freq": [None, "12-20", "3-4"],
+        }
+    )
+    rng = np.random.default_rng(0)
+    stops = [101, 102, 103, 104]
+    od_trips = pd.DataFrame(
+        [
+            (origin, destination, day_type, hour, "BUS", int(rng.integers(1, 30)))
+            for origin in stops
+            for destination in stops
+            if origin != destination
+            for day_type in ["WEEKDAY", "WEEKENDS/HOLIDAY"]
+            for hour in range(0, 24, 2)
+        ],
+        columns=[
+            "ORIGIN_PT_CODE",
+            "DESTINATION_PT_CODE",
+            "DAY_TYPE",
+            "TIME_PER_HOUR",
+            "PT_TYPE",
+            "TOTAL_TRIPS",
+        ],
+    )
+    return bus_routes, bus_services, od_trips
+
+
+def notebook_bus_route_trips(bus_routes, bus_services, od_trips) -> pd.DataFrame:
+    # 03_Trip Modelling.ipynb, one row at a time (without its merge for the
+    # Category column, see build_bus_route_trips)
+    pairs = []
+    routes = bus_routes.sort_values(["ServiceNo", "Direction", "StopSequence"])
+    for (service_no, direction), group in routes.groupby(["ServiceNo", "Direction"]):
+        group = group.reset_index(drop=True)
+        for i in range(len(group) - 1):
+            pairs.append(
+                {
+                    "ServiceNo": service_no,
+                    "Direction": direction,
+                    "Origin_Stop": group.iloc[i]["BusStopCode"],
+                    "Destination_Stop": group.iloc[i + 1]["BusStopCode"],
+                    "Destination_StopSequence": group.iloc[i + 1]["StopSequence"],
+                }
+            )
+    route_trips = pd.DataFrame(pairs).merge(
+        od_trips,
+        left_on=["Origin_Stop", "Destination_Stop"],
+        right_on=["ORIGIN_PT_CODE", "DESTINATION_PT_CODE"],
+    )
+
+    def mean_frequency(freq):
+        if freq == "-" or pd.isna(freq):
+            return None
+        return sum(map(int, freq.split("-"))) / 2
+
+    frequency = bus_services.copy()
+    for column in trip_model.FREQUENCY_COLUMNS:
+        frequency[column] = frequency[column].apply(mean_frequency)
+    frequency = frequency.fillna(0)
+
+    def get_frequency_type(time_hour):
+        if 7 <= time_hour <= 9:
+            return "AM_Peak_Freq"
+        elif 10 <= time_hour <= 16:
+            return "AM_Offpeak_Freq"
+        elif 17 <= time_hour <= 19:
+            return "PM_Peak_Freq"
+        elif 20 <= time_hour <= 23:
+            return "PM_Offpeak_Freq"
+        return None
+
+    def calculate_estimated_trips(row):
+        freq_type = get_frequency_type(row["TIME_PER_HOUR"])
+        if freq_type:
+            service_info = frequency[
+                (frequency["ServiceNo"] == row["ServiceNo"])
+                & (frequency["Direction"] == row["Direction"])
+            ]
+            if not service_info.empty:
+                minutes = service_info.iloc[0][freq_type]
+                return math.floor(60 / minutes) if minutes > 0 else 0
+        return 0
+
+    route_trips["Estimated_Trips"] = route_trips.apply(calculate_estimated_trips, axis=1)
+    route_trips["Max_StopSequence"] = route_trips.groupby(["ServiceNo", "Direction"])[
+        "Destination_StopSequence"
+    ].transform("max")
+    route_trips["Adj_Estimated_Trips"] = route_trips[
+        ["TOTAL_TRIPS", "Estimated_Trips"]
+    ].min(axis=1)
+    return route_trips
+
+
+KEYS = ["ServiceNo", "Direction", "Origin_Stop", "Destination_Stop", "DAY_TYPE", "TIME_PER_HOUR"]
+
+
+def test_matches_the_notebook_row_by_row():
+    data = make_data()
+    vectorized = trip_model.build_bus_route_trips(*data)
+    expected = notebook_bus_route_trips(*data)
+
+    columns = KEYS + ["TOTAL_TRIPS", "Max_StopSequence", "Adj_Estimated_Trips"]
+    pd.testing.assert_frame_equal(
+        vectorized.sort_values(KEYS).reset_index(drop=True)[columns],
+        expected.sort_values(KEYS).reset_index(drop=True)[columns],
+        check_dtype=False,
+    )
+
+
+def test_headways_as_in_the_notebook():
+    headways = pd.Series(["5", "08-12", "-", None, ""])
+    assert trip_model.mean_frequency(headways).tolist() == pytest.approx(
+        [2.5, 10, 0, 0, 0]
+    )
+
+
+def test_services_missing_from_bus_services_have_no_trips():
+    route_trips = trip_model.build_bus_route_trips(*make_data())
+    missing = route_trips[route_trips["ServiceNo"] == "99"]
+    assert len(missing) > 0
+    assert (missing["Adj_Estimated_Trips"] == 0).all()
+    assert (missing["Max_StopSequence"] == 3).all()
+    assert missing["Category"].isna().all()
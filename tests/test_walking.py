@@ -0,0 +1,73 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Point
+
+import walking
+
+
+def save_network(tmp_path, lines: list) -> str:
+    file_path = str(tmp_path / walking.WALKING_NETWORK_FNAME)
+    gpd.GeoDataFrame(geometry=lines, crs=walking.PROJECTED_CRS).to_file(
+        file_path, driver="GeoJSON"
+    )
+    return file_path
+
+
+def walk(network: dict, start_xy, end_xy, max_distance=10000) -> float:
+    table = walking.build_walking_table(
+        network,
+        gpd.GeoDataFrame(
+            {"StationName": ["Station"]}, geometry=[Point(start_xy)], crs=walking.PROJECTED_CRS
+        ),
+        gpd.GeoDataFrame(
+            {"BUS_STOP_N": ["1"]}, geometry=[Point(end_xy)], crs=walking.PROJECTED_CRS
+        ),
+        max_distance=max_distance,
+    )
+    return table["distances"][0] if len(table["distances"]) else np.inf
+
+
+def test_footpaths_are_joined_at_shared_vertices_mid_way(tmp_path):
+    # two footpaths crossing at (500, 0), a vertex of both but an endpoint of
+    # neither; the only way from the west end to the north end is through it
+    network = walking.load_walking_network(
+        save_network(
+            tmp_path,
+            [
+                LineString([(0, 0), (500, 0), (1000, 0)]),
+                LineString([(500, -400), (500, 0), (500, 300)]),
+            ],
+        )
+    )
+    assert len(network["node_xy"]) == 5
+    assert walk(network, (0, 0), (500, 300)) == pytest.approx(800)
+    assert walk(network, (1000, 0), (500, -400)) == pytest.approx(900)
+
+
+def test_crossings_without_a_shared_vertex(tmp_path):
+    # a footbridge over a road: no shared vertex, so not joined by default
+    file_path = save_network(
+        tmp_path,
+        [LineString([(0, 0), (1000, 0)]), LineString([(500, -400), (500, 300)])],
+    )
+    network = walking.load_walking_network(file_path)
+    assert walk(network, (0, 0), (500, 300)) == np.inf
+
+    noded = walking.load_walking_network(file_path, node_crossings=True)
+    assert walk(noded, (0, 0), (500, 300)) == pytest.approx(800)
+
+
+def test_pieces_keep_the_length_along_the_footpath(tmp_path):
+    # a bent footpath joined mid-way by a short path
+    network = walking.load_walking_network(
+        save_network(
+            tmp_path,
+            [
+                LineString([(0, 0), (300, 400), (600, 0), (900, 400)]),
+                LineString([(600, 0), (600, -100)]),
+            ],
+        )
+    )
+    assert walk(network, (0, 0), (600, -100)) == pytest.approx(1100)
+    assert walk(network, (900, 400), (600, -100)) == pytest.approx(600)